@@ -0,0 +1,45 @@
+"""
+Times the BatchBarcodeConverter on GTIN barcodes with and without NumPy,
+and the AntaresBarcodeConverter one barcode at a time.
+
+Usage:
+
+    python benchmarks/barcode_conversion.py [number of barcodes]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gs123.check_digit import calculate_check_digit  # noqa: E402
+from quartet_4nt4r3s import conversion  # noqa: E402
+
+
+def barcodes(count):
+    gtins = [calculate_check_digit('0034219503%03d' % i) for i in range(100)]
+    return ['01%s21%012d' % (gtins[i % 100], 100000000000 + i)
+            for i in range(count)]
+
+
+def main(count=1000000):
+    values = barcodes(count)
+    modes = [False] + ([True] if conversion.numpy else [])
+    for prop_name in conversion.BATCH_PROPERTIES:
+        for use_numpy in modes:
+            converter = conversion.BatchBarcodeConverter(
+                7, use_numpy=use_numpy)
+            start = time.perf_counter()
+            converter.convert(values, prop_name)
+            print('%-40s %-6s %.2fs' % (
+                prop_name, 'numpy' if use_numpy else 'python',
+                time.perf_counter() - start))
+        start = time.perf_counter()
+        for value in values[:count // 10]:
+            getattr(conversion.AntaresBarcodeConverter(value, 7), prop_name)
+        print('%-40s %-6s %.2fs (estimated)' % (
+            prop_name, 'single', (time.perf_counter() - start) * 10))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,51 @@
+"""
+Compares the memory and lookup time of a set of EPC URN strings, the way
+the Antares parser keeps its known epcs by default, with the
+CompactEPCSet used with the Compact EPCs step parameter.
+
+Usage:
+
+    python benchmarks/compact_epcs.py [number of epcs] [number of gtins]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from quartet_4nt4r3s.compact import CompactEPCSet  # noqa: E402
+
+
+def epcs(count, gtins):
+    per_gtin = count // gtins
+    for gtin in range(gtins):
+        for serial in range(per_gtin):
+            yield 'urn:epc:id:sgtin:0342195.%06d.%012d' % (
+                gtin, 900000000000 + serial * 7)
+
+
+def measure(factory, count, gtins):
+    tracemalloc.start()
+    start = time.perf_counter()
+    known = factory()
+    known.update(epcs(count, gtins))
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    found = sum(1 for epc in epcs(count, gtins) if epc in known)
+    lookup = time.perf_counter() - start
+    assert found == len(known)
+    return size, elapsed, lookup
+
+
+def main(count=1000000, gtins=10):
+    for name, factory in [('set', set), ('CompactEPCSet', CompactEPCSet)]:
+        size, elapsed, lookup = measure(factory, count, gtins)
+        print('%-14s %8.1f MB %6.1f bytes/epc  add %.2fs  lookup %.2fs' % (
+            name, size / 1e6, size / count, elapsed, lookup))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
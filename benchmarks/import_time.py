@@ -0,0 +1,81 @@
+"""
+Measures what importing the quartet_4nt4r3s modules costs a Celery worker
+or a manage.py command on top of django.setup(), using python -X
+importtime in a fresh interpreter for each module.  The heaviest
+packages each module pulls in are listed so new eager imports of
+requests, paramiko, celery or quartet_output are easy to spot.
+
+Usage:
+
+    python benchmarks/import_time.py [settings module] [module ...]
+"""
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = [
+    'quartet_4nt4r3s.apps',
+    'quartet_4nt4r3s.steps',
+    'quartet_4nt4r3s.parsing_steps',
+    'quartet_4nt4r3s.conversion_steps',
+    'quartet_4nt4r3s.output_steps',
+    'quartet_4nt4r3s.views',
+    'quartet_4nt4r3s.management.commands.run_antares_standin',
+    'quartet_4nt4r3s.management.commands.antares_profile_summary',
+    'quartet_4nt4r3s.management.commands.create_rfxcel_processing_rule',
+]
+
+MARKER = 'antares-import-time'
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+SCRIPT = (
+    'import sys, django; django.setup(); '
+    'sys.stderr.write("%s\\n"); sys.stderr.flush(); '
+    'import {module}' % MARKER
+)
+
+
+def measure(module, settings_module):
+    """
+    Imports a module after django.setup() in a new interpreter.
+    :return: A two-tuple of the total microseconds and a dict of the
+    microseconds spent in each top level package.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module,
+               PYTHONPATH=os.pathsep.join(
+                   [ROOT, os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         SCRIPT.format(module=module)],
+        env=env, cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    lines = result.stderr.split(MARKER, 1)[1].splitlines()
+    total = 0
+    packages = defaultdict(int)
+    for line in lines:
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, name = match.groups()
+        packages[name.split('.')[0]] += int(own)
+        if not indent:
+            total += int(cumulative)
+    return total, packages
+
+
+def main(settings_module='tests.settings', *modules):
+    for module in modules or MODULES:
+        total, packages = measure(module, settings_module)
+        heaviest = sorted(packages.items(), key=lambda p: -p[1])[:5]
+        print('%-66s %8.1fms' % (module, total / 1000))
+        print('    %s' % ', '.join('%s %.1fms' % (name, us / 1000)
+                                   for name, us in heaviest))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,73 @@
+"""
+Compares reading a large EPCIS document through a Django File, as the
+EPCISParsingStep did, with reading a memory map of it from
+quartet_4nt4r3s.filemap.  Each read runs lxml's iterparse the way the
+EPCIS parser does, in its own process, and reports the CPU time and peak
+RSS.  The document is written to a temporary file once.
+
+Usage:
+
+    python benchmarks/mapped_parse.py [number of events]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+EVENT = (
+    '<ObjectEvent><eventTime>2018-01-01T00:00:00Z</eventTime>'
+    '<eventTimeZoneOffset>+00:00</eventTimeZoneOffset><epcList>%s'
+    '</epcList><action>ADD</action>'
+    '<bizStep>urn:epcglobal:cbv:bizstep:commissioning</bizStep>'
+    '</ObjectEvent>\n'
+)
+EPC = '<epc>urn:epc:id:sgtin:0342195.030809.%012d</epc>'
+
+
+def write_document(path, count):
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<epcis:EPCISDocument xmlns:epcis="urn:epcglobal:epcis:xsd:1"'
+                '><EPCISBody><EventList>\n')
+        for i in range(count):
+            f.write(EVENT % ''.join(EPC % (i * 10 + j) for j in range(10)))
+        f.write('</EventList></EPCISBody></epcis:EPCISDocument>\n')
+
+
+def parse(path, mode):
+    from django.conf import settings
+    settings.configure()
+    from django.core.files.base import File
+    from lxml import etree
+    from quartet_4nt4r3s import filemap
+    start = time.process_time()
+    with open(path, 'rb') as f, filemap.open_mapped(File(f)) as mapped:
+        stream = mapped if mode == 'mmap' else File(f)
+        for event, element in etree.iterparse(stream, events=('end',),
+                                              remove_comments=True):
+            if element.tag == 'ObjectEvent':
+                element.clear()
+    cpu = time.process_time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('%-5s cpu %.2fs  peak rss %.0f MB' % (mode, cpu, rss))
+
+
+def main(count=200000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'epcis.xml')
+        write_document(path, count)
+        print('%.0f MB document' % (os.path.getsize(path) / 1e6))
+        for mode in ('file', 'mmap'):
+            subprocess.run([sys.executable, __file__, '--parse', path, mode],
+                           check=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--parse']:
+        parse(*sys.argv[2:4])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,66 @@
+"""
+Posts rfXcel number requests to a running Antares number request endpoint
+from several threads and reports the throughput and latency percentiles.
+Point the Antares server at the stand-in (python manage.py
+run_antares_standin) with the ANTARES_SERIALBOX_HOST and
+ANTARES_SERIALBOX_PORT settings for reproducible offline runs.
+
+Usage:
+
+    python benchmarks/number_request_load.py URL [requests] [concurrency]
+        [request file]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_REQUEST = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                               'data', 'antares-number-request.xml')
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main(url, count=1000, concurrency=8, request_file=DEFAULT_REQUEST):
+    with open(request_file, 'rb') as f:
+        body = f.read()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def post(_):
+        start = time.perf_counter()
+        try:
+            response = session.post(url, data=body,
+                                    headers={'content-type': 'text/xml'})
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(post, range(count)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    print('%s requests, %s threads, %.2fs' % (count, concurrency, elapsed))
+    print('throughput: %.1f requests/s' % (count / elapsed))
+    print('errors:     %s' % errors)
+    for name, fraction in [('p50', 0.5), ('p95', 0.95), ('p99', 0.99)]:
+        print('%s:        %.1fms' % (
+            name, percentile(latencies, fraction) * 1000))
+    print('max:        %.1fms' % (latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], *[int(arg) for arg in sys.argv[2:4]],
+         *sys.argv[4:5])
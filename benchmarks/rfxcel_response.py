@@ -0,0 +1,73 @@
+"""
+Compares rendering the rfXcel syncAllocateTraceIdsResponse with the
+jinja2 template (the quartet_templates TemplateStep path) against the
+native builder used by the RFXCELResponseStep, and the peak memory of
+converting numbers to a URN list first against the fused conversion of
+the RFXCELURNResponseStep.
+
+Usage:
+
+    python benchmarks/rfxcel_response.py [number of ids] [repeats]
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+from jinja2.environment import Environment
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from quartet_4nt4r3s import rfxcel  # noqa: E402
+
+
+def main(count=100000, repeats=5):
+    ids = ['urn:epc:id:sgtin:0342195.030809.%012d' % i for i in range(count)]
+    task_parameters = {'requestId': 'benchmark', 'eventId': 'benchmark',
+                       'pool': '10342195308095'}
+    environment = Environment(trim_blocks=True, lstrip_blocks=True,
+                              autoescape=True)
+    template = environment.from_string(rfxcel.template_data)
+    context = {'data': ids, 'task_parameters': task_parameters,
+               'epoch': 1540000000.0, 'UUID': 'benchmark'}
+
+    def render_template():
+        return template.render(context)
+
+    def build_response():
+        return rfxcel.build_response(ids, task_parameters, 'Random GTIN',
+                                     1540000000.0, 'benchmark')
+
+    assert render_template() == build_response()
+    template_time = min(timeit.repeat(render_template, number=1,
+                                      repeat=repeats))
+    native_time = min(timeit.repeat(build_response, number=1,
+                                    repeat=repeats))
+    print('%s ids, best of %s' % (count, repeats))
+    print('template: %.4fs' % template_time)
+    print('native:   %.4fs' % native_time)
+    print('speedup:  %.1fx' % (template_time / native_time))
+    urn_prefix = 'urn:epc:id:sgtin:0342195.030809.'
+
+    def convert_then_build():
+        urns = [urn_prefix + str(number) for number in range(count)]
+        return rfxcel.build_response(urns, task_parameters, 'Random GTIN',
+                                     1540000000.0, 'benchmark')
+
+    def fused():
+        return rfxcel.build_urn_response(range(count), urn_prefix,
+                                         task_parameters, 'Random GTIN',
+                                         1540000000.0, 'benchmark')
+
+    assert convert_then_build() == fused()
+    for name, function in (('list + native', convert_then_build),
+                           ('fused', fused)):
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%s peak memory: %.1f MB' % (name, peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -1,6 +1,17 @@
 # -*- coding: utf-8
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_save
 
 
 class Quartet4nt4r3sConfig(AppConfig):
     name = 'quartet_4nt4r3s'
+
+    def ready(self):
+        from quartet_capture.models import Task
+        from quartet_4nt4r3s import tracing
+        post_save.connect(tracing.on_task_saved, sender=Task,
+                          dispatch_uid='antares-tracing')
+        if getattr(settings, 'ANTARES_WARM_UP', False):
+            from quartet_4nt4r3s import warmup
+            warmup.install()
@@ -0,0 +1,223 @@
+"""
+Re-ingests archived Antares messages, SOAP processMessages payloads or
+bare EPCIS documents, with the Antares BusinessEPCISParser across a pool
+of processes.
+
+The files are ordered by their modification time.  Before anything is
+parsed every file is scanned for the epcs (and parent ids) it mentions.
+A file is only parsed after every earlier file that mentions one of its
+epcs has been parsed, so commissioning, packing, shipping and
+decommissioning of the same epcs happen in order while files about other
+epcs are parsed alongside them.  A file whose earlier file failed is
+skipped.
+"""
+import glob
+import heapq
+import io
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, \
+    ProcessPoolExecutor, wait
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+PARSED = 'parsed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class FileResult:
+    """
+    The outcome of one file.
+    """
+
+    def __init__(self, path: str, status: str, size: int = 0,
+                 events: int = 0, seconds: float = 0.0, error: str = None):
+        self.path = path
+        self.status = status
+        self.size = size
+        self.events = events
+        self.seconds = seconds
+        self.error = error
+
+
+def get_files(paths: list, pattern: str = '*') -> list:
+    """
+    Expands directories and glob patterns into a list of files ordered by
+    modification time and then name.
+    :param paths: Files, directories or glob patterns.
+    :param pattern: The glob pattern of the files in a directory.
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, pattern))
+        else:
+            matches = glob.glob(path)
+        files.update(match for match in matches if os.path.isfile(match))
+    return sorted(files, key=lambda f: (os.path.getmtime(f), f))
+
+
+def scan_file(path: str):
+    """
+    Returns the epcs and parent ids in a file, or the error that stopped
+    the scan.
+    """
+    try:
+        epcs = set()
+        context = etree.iterparse(path, events=('end',),
+                                  tag=('{*}epc', '{*}parentID'),
+                                  huge_tree=True)
+        for event, element in context:
+            if element.text:
+                epcs.add(element.text.strip())
+            element.clear()
+        return list(epcs), None
+    except Exception as e:
+        return None, '%s: %s' % (type(e).__name__, e)
+
+
+def get_dependencies(epc_lists: list) -> list:
+    """
+    Returns, for each file, the set of indexes of the earlier files it has
+    to wait for: the last earlier file to mention each of its epcs.
+    :param epc_lists: The epcs of each file in order.
+    """
+    last_file = {}
+    dependencies = []
+    for index, epcs in enumerate(epc_lists):
+        dependencies.append(
+            {last_file[epc] for epc in epcs or () if epc in last_file})
+        for epc in epcs or ():
+            last_file[epc] = index
+    return dependencies
+
+
+def parse_file(path: str, parser_kwargs: dict) -> FileResult:
+    """
+    Unwraps the EPCIS document in a file and parses it.
+    """
+    from quartet_4nt4r3s import soap
+    from quartet_4nt4r3s.parser import BusinessEPCISParser
+    start = time.perf_counter()
+    size = os.path.getsize(path)
+    try:
+        with open(path, 'rb') as f:
+            document = soap.unwrap_epcis_document(f)
+        parser = BusinessEPCISParser(io.BytesIO(document.encode('utf-8')),
+                                     **parser_kwargs)
+        parser.parse()
+    except Exception as e:
+        logger.exception('Could not parse %s.', path)
+        return FileResult(path, FAILED, size,
+                          seconds=time.perf_counter() - start,
+                          error='%s: %s' % (type(e).__name__, e))
+    return FileResult(path, PARSED, size, parser.event_index,
+                      time.perf_counter() - start)
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        # processes that are spawned rather than forked start empty
+        django.setup()
+
+
+class InlineExecutor:
+    """
+    Runs each call as it is submitted, in this process.
+    """
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def map(self, fn, *iterables, chunksize=1):
+        return map(fn, *iterables)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def backfill(files: list, workers: int = None, parser_kwargs: dict = None,
+             on_result=None) -> list:
+    """
+    Parses the files in dependency order.
+    :param files: The files in timestamp order, see get_files.
+    :param workers: The number of processes, 0 to parse in this process.
+    Defaults to the number of CPUs.
+    :param parser_kwargs: Keyword arguments for the BusinessEPCISParser.
+    :param on_result: Called with each FileResult as it is known.
+    :return: A FileResult for each file, in the order of the files.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    parser_kwargs = parser_kwargs or {}
+    if workers:
+        from django import db
+        # the workers must not share the database connections of this
+        # process
+        db.connections.close_all()
+        executor = ProcessPoolExecutor(workers, initializer=_init_worker)
+    else:
+        executor = InlineExecutor()
+    results = [None] * len(files)
+
+    def finish(index, result):
+        pending = [(index, result)]
+        while pending:
+            index, result = pending.pop()
+            results[index] = result
+            if on_result:
+                on_result(result)
+            for dependent in dependents[index]:
+                if results[dependent] is not None:
+                    continue
+                if result.status != PARSED:
+                    # mark it now so it is not queued twice
+                    results[dependent] = skipped = FileResult(
+                        files[dependent], SKIPPED,
+                        error='%s was not parsed.' % files[index])
+                    pending.append((dependent, skipped))
+                    continue
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    heapq.heappush(ready, dependent)
+
+    try:
+        scans = list(executor.map(scan_file, files,
+                                  chunksize=max(1, len(files) // (
+                                      4 * max(workers, 1)))))
+        dependencies = get_dependencies([epcs for epcs, _ in scans])
+        dependents = [[] for _ in files]
+        for index, earlier in enumerate(dependencies):
+            for dependency in earlier:
+                dependents[dependency].append(index)
+        waiting = [len(earlier) for earlier in dependencies]
+        ready = [index for index, earlier in enumerate(dependencies)
+                 if not earlier]
+        heapq.heapify(ready)
+        for index, (epcs, error) in enumerate(scans):
+            if error:
+                finish(index, FileResult(files[index], FAILED, error=error))
+        running = {}
+        while ready or running:
+            # keep a few files queued for each worker
+            while ready and len(running) < 2 * max(workers, 1):
+                index = heapq.heappop(ready)
+                if results[index] is None:
+                    running[executor.submit(
+                        parse_file, files[index], parser_kwargs)] = index
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(running.pop(future), future.result())
+    finally:
+        executor.shutdown()
+    return results
@@ -0,0 +1,277 @@
+"""
+Captures the traffic of the Antares endpoints and replays it against a
+test instance.
+
+Add the CaptureMiddleware to MIDDLEWARE to record every EPCIS report and
+number request.  Each request is appended as a line of JSON to a file
+under the ANTARES_CAPTURE_DIR directory (the temp directory's
+`antares-capture` by default), one file per process and day so processes
+never write to the same file.  A record holds the time the request
+arrived, the path and query, the content type and SOAP action, the request
+body with the WS-Security username and password replaced by REDACTED, the
+status, the size of the response and how long the response took.  Other
+headers, including Authorization, are not recorded.
+
+The antares_replay management command sends the captured requests to
+another instance with the same spacing, or that spacing divided by a
+speed factor, and reports the throughput, errors and latency percentiles.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+CAPTURED_URL_NAMES = ('antares-epcis-report', 'antares-number-request')
+REDACTED = 'REDACTED'
+
+# credentials are only looked for in the SOAP header, before the Body
+BODY_START = re.compile(rb'<(?:[\w.-]+:)?Body[\s>]')
+CREDENTIAL = re.compile(
+    rb'(<(?:[\w.-]+:)?(Username|Password)\b[^>]*(?<!/)>)[^<]*')
+
+_lock = threading.Lock()
+
+
+def get_capture_dir() -> str:
+    return getattr(settings, 'ANTARES_CAPTURE_DIR',
+                   os.path.join(tempfile.gettempdir(), 'antares-capture'))
+
+
+def replace_credentials(body: bytes, username: str,
+                        password: str) -> bytes:
+    """
+    Replaces the text of the Username and Password elements in the header
+    of a SOAP message.
+    :param body: The SOAP message.
+    :param username: The new username.
+    :param password: The new password.
+    """
+    values = {
+        b'Username': escape(username).encode('utf-8'),
+        b'Password': escape(password).encode('utf-8'),
+    }
+    match = BODY_START.search(body)
+    end = match.start() if match else len(body)
+    header = CREDENTIAL.sub(lambda m: m.group(1) + values[m.group(2)],
+                            body[:end])
+    return header + body[end:]
+
+
+def redact(body: bytes) -> bytes:
+    """
+    Replaces the WS-Security username and password of a SOAP message with
+    REDACTED.
+    """
+    return replace_credentials(body, REDACTED, REDACTED)
+
+
+def write_record(record: dict):
+    """
+    Appends a record to this process's capture file for today.
+    """
+    directory = get_capture_dir()
+    path = os.path.join(directory, 'antares-%s-%d.jsonl' % (
+        datetime.now().strftime('%Y%m%d'), os.getpid()))
+    line = json.dumps(record) + '\n'
+    with _lock:
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(line)
+
+
+class CaptureMiddleware:
+    """
+    Records the requests to the Antares EPCIS report and number request
+    views.  The response to a request is not changed.  A streamed response
+    is recorded when it has been sent.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        arrived = time.time()
+        start = time.perf_counter()
+        try:
+            match = resolve(request.path_info,
+                            getattr(request, 'urlconf', None))
+        except Resolver404:
+            match = None
+        if match is None or match.url_name not in CAPTURED_URL_NAMES:
+            # the bodies of other requests are never read here
+            return self.get_response(request)
+        # read the body before the view so it is still there afterwards
+        body = request.body if request.method == 'POST' else b''
+        response = self.get_response(request)
+        record = {
+            'time': arrived,
+            'url_name': match.url_name,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'content_type': request.META.get('CONTENT_TYPE', ''),
+            'soap_action': request.META.get('HTTP_SOAPACTION'),
+            'request_size': len(body),
+            'body': redact(body).decode('utf-8', 'replace'),
+            'status': response.status_code,
+        }
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, record, start)
+        else:
+            self.save(record, len(response.content), start)
+        return response
+
+    def stream(self, content, record: dict, start: float):
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.save(record, size, start)
+
+    def save(self, record: dict, response_size: int, start: float):
+        record['response_size'] = response_size
+        record['duration'] = time.perf_counter() - start
+        try:
+            write_record(record)
+        except OSError:
+            # capturing must never fail a request
+            logger.exception('Could not save the capture of %s.',
+                             record['path'])
+
+
+def load_records(paths: list) -> list:
+    """
+    Reads the records of capture files ordered by the time they arrived.
+    :param paths: The capture files.
+    """
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record['time'])
+    return records
+
+
+class ReplayResult:
+    """
+    The outcome of one replayed request.
+    """
+
+    def __init__(self, record: dict, status: int = None, size: int = 0,
+                 latency: float = 0.0, lag: float = 0.0, error: str = None):
+        self.record = record
+        self.status = status
+        self.size = size
+        self.latency = latency
+        self.lag = lag
+        self.error = error
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None or self.status >= 400
+
+
+def replay(records: list, url: str, speed: float = 1.0,
+           concurrency: int = 8, username: str = None,
+           password: str = None, session=None, timeout: float = 60):
+    """
+    Sends the captured requests to another instance.  A request is sent
+    when its offset from the first request, divided by the speed, has
+    passed.  If all the threads are busy it waits for one, the time it
+    waited is the lag of its result.
+    :param records: The records in time order, see load_records.
+    :param url: The scheme, host and port of the instance.
+    :param speed: How many times faster than captured to send the
+    requests, 0 sends them as fast as possible.
+    :param concurrency: The number of requests that can be open at once.
+    :param username: Replaces the redacted username.
+    :param password: Replaces the redacted password.
+    :param session: The requests.Session to send with.
+    :param timeout: The seconds to wait for each response.
+    :return: The ReplayResult of each record and the elapsed seconds.
+    """
+    if session is None:
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    url = url.rstrip('/')
+
+    def send(record, due):
+        sent = time.perf_counter()
+        body = record['body'].encode('utf-8')
+        if username is not None or password is not None:
+            body = replace_credentials(body, username or '', password or '')
+        headers = {'Content-Type': record['content_type']}
+        if record.get('soap_action') is not None:
+            headers['SOAPAction'] = record['soap_action']
+        try:
+            response = session.request(record['method'],
+                                       url + record['path'], data=body,
+                                       headers=headers, timeout=timeout)
+            size = len(response.content)
+        except Exception as e:
+            return ReplayResult(record, latency=time.perf_counter() - sent,
+                                lag=sent - due,
+                                error='%s: %s' % (type(e).__name__, e))
+        return ReplayResult(record, response.status_code, size,
+                            time.perf_counter() - sent, sent - due)
+
+    futures = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record in records:
+            due = start
+            if speed:
+                due += (record['time'] - records[0]['time']) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(send, record, due))
+    results = [future.result() for future in futures]
+    return results, time.perf_counter() - start
+
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(results: list, elapsed: float) -> str:
+    """
+    The throughput, errors and latency percentiles of replayed requests,
+    in total and for each endpoint.
+    """
+    lines = ['%s requests in %.2fs: %.1f requests/s' % (
+        len(results), elapsed, len(results) / elapsed if elapsed else 0)]
+    groups = [('all', results)]
+    for name in CAPTURED_URL_NAMES:
+        group = [r for r in results if r.record['url_name'] == name]
+        if group:
+            groups.append((name, group))
+    lines.append('%-24s %8s %7s %9s %9s %9s %9s %9s' % (
+        'endpoint', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms',
+        'max ms', 'p95 lag'))
+    for name, group in groups:
+        latencies = sorted(r.latency for r in group)
+        lags = sorted(r.lag for r in group)
+        lines.append('%-24s %8d %7d %9.1f %9.1f %9.1f %9.1f %9.1f' % (
+            name, len(group), sum(1 for r in group if r.failed),
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.95) * 1000,
+            percentile(latencies, 0.99) * 1000, latencies[-1] * 1000,
+            percentile(lags, 0.95) * 1000))
+    return '\n'.join(lines) + '\n'
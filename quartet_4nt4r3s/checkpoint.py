@@ -0,0 +1,53 @@
+import json
+import logging
+
+from quartet_capture.models import Task, TaskParameter
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PARAMETER = 'antares-parse-checkpoint'
+
+
+def get_checkpoint(task: Task):
+    """
+    Returns the last committed parse checkpoint for a task.
+    :param task: The task being executed.
+    :return: A two-tuple of message id and event index or None if the task
+    has no checkpoint.
+    """
+    param = TaskParameter.objects.filter(
+        task=task, name=CHECKPOINT_PARAMETER).first()
+    if not param:
+        return None
+    checkpoint = json.loads(param.value)
+    return checkpoint['message_id'], checkpoint['event_index']
+
+
+def save_checkpoint(task: Task, message_id: int, event_index: int):
+    """
+    Records the message id and the index of the last event committed for
+    a task.  Must be called inside the same transaction as the data that
+    was committed.
+    :param task: The task being executed.
+    :param message_id: The id of the Message the events belong to.
+    :param event_index: The number of events that have been committed.
+    """
+    logger.debug('Checkpoint for task %s at event %s.', task.name,
+                 event_index)
+    TaskParameter.objects.update_or_create(
+        task=task, name=CHECKPOINT_PARAMETER,
+        defaults={
+            'value': json.dumps({'message_id': message_id,
+                                 'event_index': event_index}),
+            'description': 'The last committed event of the EPCIS parse.'
+        }
+    )
+
+
+def clear_checkpoint(task: Task):
+    """
+    Removes the checkpoint for a task once the parse has completed.
+    :param task: The task being executed.
+    """
+    TaskParameter.objects.filter(task=task,
+                                 name=CHECKPOINT_PARAMETER).delete()
@@ -0,0 +1,231 @@
+"""
+Coalesces concurrent number requests for the same pool.  The first request
+for a pool waits a short window (the ANTARES_COALESCE_WINDOW setting, in
+seconds) for others to arrive, then asks serialbox for all of their ids at
+once.  The rfXcel response is split back into one response per request, in
+the order the requests arrived, each with its own requestId, eventId and
+responseId.  Requests only share an allocation if they are for the same
+serialbox, pool and credentials.
+
+Only pools known to answer with an rfXcel idList are coalesced: pools whose
+xml response rule is one of the rfXcel rules installed by
+create_example_urn_response_rules or has an rfXcel response step, and the
+pools named in the ANTARES_COALESCE_POOLS setting.  Requests for other
+pools are sent on their own.
+
+A window of 0 (the default) turns coalescing off.  A request that arrives
+alone is sent on its own as usual.  Should a merged response still not
+split, its requests are sent on their own and the ids of the merged
+allocation go unused, they are never answered with an error.
+"""
+import logging
+import threading
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_COUNT = 100000
+
+# the number response rules whose responses have an rfXcel idList
+RFXCEL_RESPONSE_RULES = (
+    'Random RFXCEL GTIN URN Response',
+    'Sequential RFXCEL GTIN URN Response',
+    'Sequential RFXCEL SSCC Response',
+)
+RFXCEL_RESPONSE_STEPS = (
+    'quartet_4nt4r3s.steps.RFXCELResponseStep',
+    'quartet_4nt4r3s.steps.RFXCELURNResponseStep',
+)
+
+
+class CoalescedResponse:
+    """
+    One request's share of a coalesced allocation.
+    """
+
+    def __init__(self, status: int, content_type: str, body: bytes):
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+
+
+class Share:
+    def __init__(self, count: int, event_id: str):
+        self.count = count
+        self.event_id = event_id
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Batch:
+    def __init__(self):
+        self.shares = []
+        self.count = 0
+
+
+def split_allocation(body: bytes, shares: list):
+    """
+    Splits a syncAllocateTraceIdsResponse into one response per share.
+    :param body: The response XML.
+    :param shares: A list of (count, event id) two-tuples.
+    :return: A list of response bodies or None if the response has no
+    idList or too few ids.
+    """
+    try:
+        root = etree.fromstring(body)
+    except etree.XMLSyntaxError:
+        return None
+    id_list = next(root.iter('{*}idList'), None)
+    if id_list is None or len(id_list) < sum(c for c, _ in shares):
+        return None
+    ids = list(id_list)
+    del id_list[:]
+    event_id_element = next(root.iter('{*}eventId'), None)
+    declaration = body.lstrip().startswith(b'<?xml')
+    bodies = []
+    offset = 0
+    for count, event_id in shares:
+        id_list.extend(ids[offset:offset + count])
+        offset += count
+        if 'requestId' in root.attrib:
+            root.set('requestId', event_id or '')
+        if 'responseId' in root.attrib:
+            root.set('responseId', str(uuid4()))
+        if event_id_element is not None:
+            event_id_element.text = event_id
+        bodies.append(etree.tostring(root, encoding='utf-8',
+                                     xml_declaration=declaration))
+        del id_list[:]
+    return bodies
+
+
+class AllocationCoalescer:
+    """
+    Merges concurrent allocations with the same key.
+    """
+
+    def __init__(self, window: float = None, max_count: int = None):
+        """
+        :param window: The seconds the first request waits for others.
+        Defaults to the ANTARES_COALESCE_WINDOW setting.
+        :param max_count: The most ids asked for at once, a request that
+        would go over it starts a new allocation.  Defaults to the
+        ANTARES_COALESCE_MAX_COUNT setting.
+        """
+        self._window = window
+        self._max_count = max_count
+        self._lock = threading.Lock()
+        self._batches = {}
+        self._unsplittable = set()
+
+    @property
+    def window(self) -> float:
+        if self._window is not None:
+            return self._window
+        return getattr(settings, 'ANTARES_COALESCE_WINDOW', 0)
+
+    @property
+    def max_count(self) -> int:
+        if self._max_count is not None:
+            return self._max_count
+        return getattr(settings, 'ANTARES_COALESCE_MAX_COUNT',
+                       DEFAULT_MAX_COUNT)
+
+    def coalesces(self, pool) -> bool:
+        """
+        Whether the requests for a pool can share an allocation.
+        :param pool: The serialbox Pool.
+        """
+        if not self.window:
+            return False
+        if pool.machine_name in getattr(settings, 'ANTARES_COALESCE_POOLS',
+                                        ()):
+            return True
+        from serialbox.models import ResponseRule
+        response_rule = ResponseRule.objects.filter(
+            pool=pool, content_type='xml').select_related('rule').first()
+        if response_rule is None or response_rule.rule is None:
+            return False
+        if response_rule.rule.name in RFXCEL_RESPONSE_RULES:
+            return True
+        return response_rule.rule.step_set.filter(
+            step_class__in=RFXCEL_RESPONSE_STEPS).exists()
+
+    def allocate(self, key, count: int, event_id: str, fetch):
+        """
+        Joins the open allocation for the key or opens one.
+        :param key: The serialbox url, pool and credentials.
+        :param count: The number of ids this request needs.
+        :param event_id: The rfXcel event id of this request.
+        :param fetch: A callable that takes a count and returns the
+        requests.Response of a serialbox allocation.  Only the first
+        request's is called.
+        :return: A CoalescedResponse, or None if the request should be
+        sent on its own.  Only call it for pools that coalesces accepts.
+        """
+        if not self.window or key in self._unsplittable:
+            return None
+        share = Share(count, event_id)
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None or batch.count + count > self.max_count
+            if leader:
+                batch = self._batches[key] = Batch()
+            batch.shares.append(share)
+            batch.count += count
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                if self._batches.get(key) is batch:
+                    del self._batches[key]
+            self._allocate_batch(key, batch, fetch)
+        else:
+            share.done.wait()
+        if share.error:
+            raise share.error
+        return share.result
+
+    def _allocate_batch(self, key, batch: Batch, fetch):
+        try:
+            if len(batch.shares) == 1:
+                # nothing to merge, the request is sent as usual
+                return
+            logger.debug('Allocating %s ids for %s requests at once.',
+                         batch.count, len(batch.shares))
+            response = fetch(batch.count)
+            content_type = response.headers.get('Content-Type',
+                                                'application/xml')
+            if response.status_code != 200:
+                for share in batch.shares:
+                    share.result = CoalescedResponse(
+                        response.status_code, content_type,
+                        response.content)
+                return
+            bodies = split_allocation(
+                response.content,
+                [(share.count, share.event_id) for share in batch.shares])
+            if bodies is None:
+                # the requests are sent on their own, leaving the merged
+                # range unused rather than failing a successful allocation
+                logger.error('Could not split the allocation of %s ids '
+                             'for %s, its requests are sent on their own '
+                             'and will not be coalesced again.',
+                             batch.count, key[1])
+                self._unsplittable.add(key)
+                return
+            for share, body in zip(batch.shares, bodies):
+                share.result = CoalescedResponse(200, content_type, body)
+        except Exception as e:
+            for share in batch.shares:
+                share.error = e
+        finally:
+            for share in batch.shares:
+                share.done.set()
+
+
+coalescer = AllocationCoalescer()
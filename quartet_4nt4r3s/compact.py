@@ -0,0 +1,192 @@
+"""
+A compact set of EPC URNs for the Antares parser.  An SGTIN or SSCC URN
+with a numeric serial is split into its prefix (everything up to the
+serial), the width of the serial and the serial as an integer.  Each
+prefix and width is stored once in a table and the serials for it are kept
+in a sorted array of 64 bit integers, about 8 bytes an EPC instead of the
+100 or so of a URN string in a set.  Any other EPC is kept as a string.
+The URNs are rebuilt only when the set is iterated.
+"""
+from array import array
+from bisect import bisect_left
+
+PACKED_SCHEMES = ('urn:epc:id:sgtin:', 'urn:epc:id:sscc:')
+
+# the longest serial that always fits in an unsigned 64 bit integer
+MAX_SERIAL_DIGITS = 19
+
+# the number of EPCs added before they are merged into the sorted arrays
+DEFAULT_MERGE_SIZE = 65536
+
+# removing more than this many serials from an array rebuilds it once
+# instead of deleting them one at a time
+REBUILD_THRESHOLD = 32
+
+
+def pack(epc: str):
+    """
+    Splits an EPC URN into its prefix, serial width and serial number.
+    :return: A three-tuple or None if the EPC can not be packed.
+    """
+    if not epc.startswith(PACKED_SCHEMES):
+        return None
+    prefix, dot, serial = epc.rpartition('.')
+    if not dot or len(serial) > MAX_SERIAL_DIGITS:
+        return None
+    if not serial.isascii() or not serial.isdigit():
+        return None
+    return prefix + dot, len(serial), int(serial)
+
+
+def unpack(prefix: str, width: int, serial: int) -> str:
+    """
+    Rebuilds the EPC URN from the values returned by pack.
+    """
+    return prefix + str(serial).zfill(width)
+
+
+def _contains(serials: array, serial: int) -> bool:
+    i = bisect_left(serials, serial)
+    return i < len(serials) and serials[i] == serial
+
+
+def _merge_sorted(serials: array, new_serials: list) -> array:
+    """
+    Merges sorted serials that are not in the array into it.  The array
+    is copied in slices between the insertion points.
+    """
+    if not serials or new_serials[0] > serials[-1]:
+        # serials are usually allocated in ascending order
+        serials.extend(new_serials)
+        return serials
+    merged = array('Q')
+    start = 0
+    for serial in new_serials:
+        end = bisect_left(serials, serial, start)
+        merged.extend(serials[start:end])
+        merged.append(serial)
+        start = end
+    merged.extend(serials[start:])
+    return merged
+
+
+class CompactEPCSet:
+    """
+    A set of EPC URNs that supports the set operations the Antares parser
+    uses: in, add, update, difference_update, clear, len and iteration.
+    New EPCs are collected in a small set and merged into the sorted
+    arrays once there are merge_size of them.
+    """
+
+    def __init__(self, epcs=(), merge_size: int = DEFAULT_MERGE_SIZE):
+        """
+        :param epcs: EPC URNs to start with.
+        :param merge_size: The number of EPCs added between merges.
+        """
+        self.merge_size = merge_size
+        self._indexes = {}
+        self._prefixes = []
+        self._serials = []
+        self._pending = []
+        self._pending_count = 0
+        self._strings = set()
+        self.update(epcs)
+
+    def _index(self, prefix: str, width: int, create: bool = False):
+        key = (prefix, width)
+        index = self._indexes.get(key)
+        if index is None and create:
+            index = self._indexes[key] = len(self._prefixes)
+            self._prefixes.append(key)
+            self._serials.append(array('Q'))
+            self._pending.append(set())
+        return index
+
+    def __contains__(self, epc: str) -> bool:
+        packed = pack(epc)
+        if packed is None:
+            return epc in self._strings
+        index = self._index(packed[0], packed[1])
+        if index is None:
+            return False
+        serial = packed[2]
+        return serial in self._pending[index] or _contains(
+            self._serials[index], serial)
+
+    def add(self, epc: str):
+        packed = pack(epc)
+        if packed is None:
+            self._strings.add(epc)
+            return
+        index = self._index(packed[0], packed[1], create=True)
+        serial = packed[2]
+        pending = self._pending[index]
+        if serial in pending or _contains(self._serials[index], serial):
+            return
+        pending.add(serial)
+        self._pending_count += 1
+        if self._pending_count >= self.merge_size:
+            self._merge()
+
+    def update(self, epcs):
+        for epc in epcs:
+            self.add(epc)
+
+    def difference_update(self, epcs):
+        removed = {}
+        for epc in epcs:
+            packed = pack(epc)
+            if packed is None:
+                self._strings.discard(epc)
+                continue
+            index = self._index(packed[0], packed[1])
+            if index is None:
+                continue
+            pending = self._pending[index]
+            if packed[2] in pending:
+                pending.remove(packed[2])
+                self._pending_count -= 1
+            else:
+                removed.setdefault(index, set()).add(packed[2])
+        for index, serials in removed.items():
+            self._remove_serials(index, serials)
+
+    def _remove_serials(self, index: int, serials: set):
+        current = self._serials[index]
+        if len(serials) > REBUILD_THRESHOLD:
+            self._serials[index] = array(
+                'Q', (serial for serial in current if serial not in serials))
+            return
+        for serial in serials:
+            i = bisect_left(current, serial)
+            if i < len(current) and current[i] == serial:
+                del current[i]
+
+    def _merge(self):
+        for index, pending in enumerate(self._pending):
+            if pending:
+                self._serials[index] = _merge_sorted(self._serials[index],
+                                                     sorted(pending))
+                pending.clear()
+        self._pending_count = 0
+
+    def clear(self):
+        self._indexes.clear()
+        del self._prefixes[:]
+        del self._serials[:]
+        del self._pending[:]
+        self._pending_count = 0
+        self._strings.clear()
+
+    def __len__(self) -> int:
+        packed = sum(len(serials) for serials in self._serials)
+        return packed + self._pending_count + len(self._strings)
+
+    def __iter__(self):
+        groups = zip(self._prefixes, self._serials, self._pending)
+        for (prefix, width), serials, pending in groups:
+            for serial in serials:
+                yield unpack(prefix, width, serial)
+            for serial in sorted(pending):
+                yield unpack(prefix, width, serial)
+        yield from self._strings
@@ -1,11 +1,117 @@
+import functools
+
 from gs123.conversion import BarcodeConverter
 
+try:
+    import numpy
+except ImportError:  # the batch conversion falls back to pure Python
+    numpy = None
+
+# company prefix length: (partition, company prefix bits, SGTIN-96 item
+# reference bits, SSCC-96 serial reference bits) from the GS1 EPC Tag
+# Data Standard
+PARTITIONS = {
+    12: (0, 40, 4, 18),
+    11: (1, 37, 7, 21),
+    10: (2, 34, 10, 24),
+    9: (3, 30, 14, 28),
+    8: (4, 27, 17, 31),
+    7: (5, 24, 20, 34),
+    6: (6, 20, 24, 38),
+}
+SGTIN96_HEADER = 0x30
+SSCC96_HEADER = 0x31
+SGTIN96_SERIAL_BITS = 38
+SSCC96_RESERVED_BITS = 24
+MAX_SGTIN96_SERIAL = 2 ** SGTIN96_SERIAL_BITS - 1
+
+# the converter properties BatchBarcodeConverter can produce
+BATCH_PROPERTIES = (
+    'epc_urn',
+    'extension_prepended_serial_number_field',
+    'epc_hex',
+)
+
+
+def calculate_check_digit(digits: str) -> int:
+    """
+    Returns the GS1 check digit for a string of digits.
+    """
+    # summing the ascii codes is much faster than converting each digit
+    data = digits.encode('ascii')
+    odd, even = data[-1::-2], data[-2::-2]
+    total = 3 * (sum(odd) - 48 * len(odd)) + sum(even) - 48 * len(even)
+    return -total % 10
+
+
+def _get_partition(company_prefix_length: int):
+    try:
+        return PARTITIONS[company_prefix_length]
+    except KeyError:
+        raise BarcodeConverter.BarcodeNotValid(
+            'A company prefix of %s digits can not be encoded in 96 '
+            'bits.' % company_prefix_length)
+
+
+def encode_sgtin96(company_prefix: str, item_reference: str, serial: str,
+                   filter_value: int = 0) -> str:
+    """
+    Returns the SGTIN-96 encoding of an SGTIN as 24 hex digits.
+    :param company_prefix: The company prefix.
+    :param item_reference: The indicator digit and item reference.
+    :param serial: The serial number, which must be numeric, without
+    leading zeros and no more than 274877906943.
+    :param filter_value: The filter value, 0 to 7.
+    """
+    partition, company_prefix_bits, item_bits, _ = _get_partition(
+        len(company_prefix))
+    if not (serial.isascii() and serial.isdigit()) or (
+        len(serial) > 1 and serial[0] == '0') or int(
+            serial) > MAX_SGTIN96_SERIAL:
+        raise BarcodeConverter.BarcodeNotValid(
+            'The serial number %s can not be encoded as an '
+            'SGTIN-96.' % serial)
+    value = SGTIN96_HEADER << 3 | filter_value
+    value = value << 3 | partition
+    value = value << company_prefix_bits | int(company_prefix)
+    value = value << item_bits | int(item_reference)
+    value = value << SGTIN96_SERIAL_BITS | int(serial)
+    return '%024X' % value
+
+
+def encode_sscc96(company_prefix: str, serial_reference: str,
+                  filter_value: int = 0) -> str:
+    """
+    Returns the SSCC-96 encoding of an SSCC as 24 hex digits.
+    :param company_prefix: The company prefix.
+    :param serial_reference: The extension digit and serial reference.
+    :param filter_value: The filter value, 0 to 7.
+    """
+    partition, company_prefix_bits, _, serial_bits = _get_partition(
+        len(company_prefix))
+    value = SSCC96_HEADER << 3 | filter_value
+    value = value << 3 | partition
+    value = value << company_prefix_bits | int(company_prefix)
+    value = value << serial_bits | int(serial_reference)
+    value = value << SSCC96_RESERVED_BITS
+    return '%024X' % value
+
 
 class AntaresBarcodeConverter(BarcodeConverter):
     '''
     Adds an extra property to return a serial number (with 0 padding)
     and the extension digit at the beginning if it's an SSCC.
     '''
+
+    def __init__(self, barcode_val: str, company_prefix_length: int,
+                 max_serial_number_length: int = 14, filter_value: int = 0):
+        """
+        :param filter_value: The filter value of the epc_hex encoding.
+        """
+        super().__init__(barcode_val, company_prefix_length,
+                         max_serial_number_length)
+        self.filter_value = filter_value
+
     @property
     def extension_prepended_serial_number_field(self) -> str:
         """
@@ -14,3 +120,386 @@ class AntaresBarcodeConverter(BarcodeConverter):
         """
         ext = self.extension_digit or ''
         return str(ext) + self.serial_number_field
+
+    @property
+    def check_digit_valid(self) -> bool:
+        """
+        Whether the check digit of the GTIN-14 or SSCC-18 is correct.
+        """
+        value = self.gtin14 or self.sscc18
+        return calculate_check_digit(value[:-1]) == int(value[-1])
+
+    @property
+    def epc_hex(self) -> str:
+        """
+        Returns the SGTIN-96 or SSCC-96 encoding of the barcode as hex.
+        """
+        if self.gtin14:
+            return encode_sgtin96(
+                self.company_prefix,
+                self.indicator_digit + self.item_reference,
+                self.serial_number_field, self.filter_value)
+        return encode_sscc96(self.company_prefix,
+                             self.extension_prepended_serial_number_field,
+                             self.filter_value)
+
+
+@functools.lru_cache()
+def get_layouts(length: int, max_serial_number_length: int = 14) -> tuple:
+    """
+    Returns the barcode layouts a barcode of the given length can have as
+    (kind, application identifier, serial application identifier) three-
+    tuples.  The GTIN-14 or SSCC-18 follows the application identifier and
+    the serial number follows the serial application identifier.  These
+    are the layouts gs123 parses to the same fields, anything else (lot,
+    expiry, FNC1 and short serial numbers) is left to the
+    AntaresBarcodeConverter.
+    """
+    layouts = []
+    if 10 <= length - 18 <= 20 and length <= 18 + max_serial_number_length:
+        layouts.append(('sgtin', '01', '21'))
+    if 10 <= length - 22 <= 13:
+        layouts.append(('sgtin', '(01)', '(21)'))
+    if length == 20:
+        layouts.append(('sscc', '00', None))
+    elif length == 22:
+        layouts.append(('sscc', '(00)', None))
+    return tuple(layouts)
+
+
+# the check digit weights of the first 13 digits of a GTIN-14 and the first
+# 17 of an SSCC-18
+_CHECK_WEIGHTS = {}
+_POWERS = []
+_HEX_DIGITS = None
+if numpy is not None:
+    _CHECK_WEIGHTS = {
+        'sgtin': numpy.array([3, 1] * 6 + [3], dtype=numpy.uint16),
+        'sscc': numpy.array([3, 1] * 8 + [3], dtype=numpy.uint16),
+    }
+    _POWERS = numpy.array([10 ** i for i in range(12, -1, -1)],
+                          dtype=numpy.uint64)
+    # the two hex digits of each byte, packed in 16 bits
+    _HEX_DIGITS = numpy.frombuffer(
+        b''.join(b'%02X' % i for i in range(256)), dtype=numpy.uint16)
+
+
+def _check_digit_valid(fields) -> bool:
+    if isinstance(fields, AntaresBarcodeConverter):
+        return fields.check_digit_valid
+    value = fields[1]
+    return calculate_check_digit(value[:-1]) == int(value[-1])
+
+
+def _is_digit(matrix):
+    # the bytes below '0' wrap around to large values
+    return matrix - numpy.uint8(ord('0')) < 10
+
+
+def _is_letter(matrix):
+    return (matrix | numpy.uint8(0x20)) - numpy.uint8(ord('a')) < 26
+
+
+def _match_layout(matrix, layout):
+    """
+    Returns a mask of the rows of the matrix that have the layout.
+    """
+    kind, ai, serial_ai = layout
+    start = len(ai)
+    end = start + (14 if serial_ai else 18)
+    matches = numpy.empty(matrix.shape, dtype=bool)
+    matches[:, :start] = matrix[:, :start] == _constant(ai.encode(),
+                                                        matrix[:1])
+    matches[:, start:end] = _is_digit(matrix[:, start:end])
+    if serial_ai:
+        serial_start = end + len(serial_ai)
+        matches[:, end:serial_start] = matrix[:, end:serial_start] == \
+            _constant(serial_ai.encode(), matrix[:1])
+        serial = matrix[:, serial_start:]
+        matches[:, serial_start:] = _is_digit(serial) | _is_letter(serial)
+    return matches.all(axis=1)
+
+
+def _constant(value: bytes, matrix):
+    return numpy.broadcast_to(numpy.frombuffer(value, dtype=numpy.uint8),
+                              (len(matrix), len(value)))
+
+
+def _strip_zeros(serial):
+    """
+    Moves each serial number left past its leading zeros, the freed bytes
+    at the end are zeroed and dropped from the strings.
+    """
+    zeros = serial == ord('0')
+    if not zeros[:, 0].any():
+        return serial
+    width = serial.shape[1]
+    leading = numpy.where(zeros.all(axis=1), width,
+                          numpy.argmin(zeros, axis=1))
+    columns = numpy.arange(width) + leading[:, None]
+    stripped = numpy.take_along_axis(serial, numpy.minimum(columns,
+                                                           width - 1), axis=1)
+    stripped[columns >= width] = 0
+    return stripped
+
+
+def _to_integers(digits):
+    return (digits - numpy.uint8(ord('0'))).astype(numpy.uint64) @ _POWERS[
+        len(_POWERS) - digits.shape[1]:]
+
+
+def _to_hex(values, dtype: str):
+    """
+    Returns the hex digits of the values as a byte matrix.
+    :param dtype: The big-endian width of the values, '>u4' or '>u8'.
+    """
+    octets = values.astype(dtype).view(numpy.uint8)
+    return _HEX_DIGITS.take(octets).view(numpy.uint8).reshape(
+        len(values), -1)
+
+
+def _to_strings(*columns) -> list:
+    """
+    Joins byte matrices column-wise and returns their rows as strings,
+    without any trailing zero bytes.
+    """
+    matrix = numpy.hstack(columns).astype(numpy.uint32)
+    return matrix.view('U%d' % matrix.shape[1]).ravel().tolist()
+
+
+class BatchBarcodeConverter:
+    """
+    Converts lists of GTIN and SSCC barcodes to one of the BATCH_PROPERTIES
+    of the AntaresBarcodeConverter at once.  With NumPy installed the
+    barcodes are grouped by length and each group is parsed, checked and
+    converted with array operations; without it each barcode is converted
+    in pure Python.  Either way the results are the same as those of the
+    AntaresBarcodeConverter for each barcode.
+    """
+
+    def __init__(self, company_prefix_length: int,
+                 max_serial_number_length: int = 14, filter_value: int = 0,
+                 validate: bool = True, use_numpy: bool = None):
+        """
+        :param company_prefix_length: The length of the company prefix.
+        :param max_serial_number_length: See the BarcodeConverter.
+        :param filter_value: The filter value of the epc_hex encodings.
+        :param validate: If True, a barcode with a wrong check digit raises
+        BarcodeConverter.BarcodeNotValid.
+        :param use_numpy: Defaults to True if NumPy is installed.
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise ImportError('NumPy is not installed.')
+        self.company_prefix_length = int(company_prefix_length)
+        self.max_serial_number_length = int(max_serial_number_length)
+        self.filter_value = int(filter_value)
+        self.validate = validate
+        self.use_numpy = use_numpy
+
+    def convert(self, barcodes: list, prop_name: str = 'epc_urn') -> list:
+        """
+        Converts the barcodes.
+        :param barcodes: A list of barcode strings.
+        :param prop_name: One of the BATCH_PROPERTIES.
+        :return: A list with the converted value of each barcode.
+        """
+        if prop_name not in BATCH_PROPERTIES:
+            raise ValueError('%s can not be converted in batches, use one of '
+                             '%s.' % (prop_name, ', '.join(BATCH_PROPERTIES)))
+        if self.use_numpy:
+            return self._convert_arrays(barcodes, prop_name)
+        return [self._convert(barcode, prop_name) for barcode in barcodes]
+
+    def check_digits_valid(self, barcodes: list) -> list:
+        """
+        Returns whether the check digit of each barcode is correct.
+        """
+        return [_check_digit_valid(self._parse(barcode))
+                for barcode in barcodes]
+
+    def _parse(self, barcode: str):
+        """
+        Returns the fields of a barcode, (kind, GTIN-14 or SSCC-18, serial)
+        for the layouts from get_layouts and an AntaresBarcodeConverter
+        otherwise.
+        """
+        for kind, ai, serial_ai in get_layouts(
+                len(barcode), self.max_serial_number_length):
+            if not barcode.startswith(ai):
+                continue
+            start = len(ai)
+            end = start + (14 if serial_ai else 18)
+            value = barcode[start:end]
+            if not (value.isascii() and value.isdigit()):
+                continue
+            serial = None
+            if serial_ai:
+                serial = barcode[end + len(serial_ai):]
+                if not barcode.startswith(serial_ai, end) or not (
+                        serial.isascii() and serial.isalnum()):
+                    continue
+            return kind, value, serial
+        return AntaresBarcodeConverter(
+            barcode, self.company_prefix_length,
+            self.max_serial_number_length, self.filter_value)
+
+    def _convert(self, barcode: str, prop_name: str) -> str:
+        fields = self._parse(barcode)
+        if self.validate and not _check_digit_valid(fields):
+            raise BarcodeConverter.BarcodeNotValid(
+                'The barcode %s has an invalid check digit.' % barcode)
+        if isinstance(fields, AntaresBarcodeConverter):
+            return getattr(fields, prop_name)
+        kind, value, serial = fields
+        cpl = self.company_prefix_length
+        if kind == 'sgtin':
+            if prop_name == 'epc_urn':
+                return 'urn:epc:id:sgtin:%s.%s%s.%s' % (
+                    value[1:cpl + 1], value[0], value[cpl + 1:13],
+                    serial.lstrip('0'))
+            if prop_name == 'epc_hex':
+                return encode_sgtin96(value[1:cpl + 1],
+                                      value[0] + value[cpl + 1:13], serial,
+                                      self.filter_value)
+            return serial
+        if prop_name == 'epc_urn':
+            return 'urn:epc:id:sscc:%s.%s%s' % (
+                value[1:cpl + 1], value[0], value[cpl + 1:17])
+        if prop_name == 'epc_hex':
+            return encode_sscc96(value[1:cpl + 1],
+                                 value[0] + value[cpl + 1:17],
+                                 self.filter_value)
+        return value[0] + value[cpl + 1:17]
+
+    def _convert_arrays(self, barcodes: list, prop_name: str) -> list:
+        lengths = numpy.fromiter(map(len, barcodes), dtype=numpy.int64,
+                                 count=len(barcodes))
+        groups = numpy.unique(lengths)
+        if len(groups) == 1:
+            return self._convert_group(barcodes, int(groups[0]), prop_name)
+        results = [None] * len(barcodes)
+        for length in groups:
+            indexes = numpy.flatnonzero(lengths == length).tolist()
+            group = [barcodes[i] for i in indexes]
+            for i, result in zip(indexes, self._convert_group(
+                    group, int(length), prop_name)):
+                results[i] = result
+        return results
+
+    def _convert_group(self, barcodes: list, length: int,
+                       prop_name: str) -> list:
+        """
+        Converts barcodes of the same length.
+        """
+        layouts = get_layouts(length, self.max_serial_number_length)
+        try:
+            matrix = numpy.frombuffer(
+                ''.join(barcodes).encode('ascii'), dtype=numpy.uint8
+            ).reshape(len(barcodes), length)
+        except UnicodeEncodeError:
+            layouts = []
+        results = None
+        remaining = numpy.ones(len(barcodes), dtype=bool)
+        for layout in layouts:
+            rows = remaining & _match_layout(matrix, layout)
+            if not rows.any():
+                continue
+            if results is None and rows.all():
+                return self._convert_matrix(matrix, layout, prop_name)
+            else:
+                indexes = numpy.flatnonzero(rows)
+                converted = self._convert_matrix(matrix[indexes], layout,
+                                                 prop_name)
+                if results is None:
+                    results = [None] * len(barcodes)
+                for i, result in zip(indexes.tolist(), converted):
+                    results[i] = result
+            remaining &= ~rows
+        if results is None:
+            results = [None] * len(barcodes)
+        for i in numpy.flatnonzero(remaining).tolist():
+            results[i] = self._convert(barcodes[i], prop_name)
+        return results
+
+    def _convert_matrix(self, matrix, layout, prop_name: str) -> list:
+        """
+        Converts rows of barcode bytes that match the layout.
+        """
+        kind, ai, serial_ai = layout
+        start = len(ai)
+        end = start + (14 if serial_ai else 18)
+        value = matrix[:, start:end]
+        if self.validate:
+            digits = value - numpy.uint8(ord('0'))
+            total = digits[:, :-1] @ _CHECK_WEIGHTS[kind]
+            invalid = numpy.flatnonzero((total + digits[:, -1]) % 10)
+            if len(invalid):
+                raise BarcodeConverter.BarcodeNotValid(
+                    'The barcode %s has an invalid check digit.' %
+                    matrix[invalid[0]].tobytes().decode('ascii'))
+        cpl = self.company_prefix_length
+        company_prefix = value[:, 1:cpl + 1]
+        reference = numpy.hstack((value[:, :1], value[:, cpl + 1:-1]))
+        if kind == 'sgtin':
+            serial = matrix[:, end + len(serial_ai):]
+            if prop_name == 'epc_urn':
+                return _to_strings(_constant(b'urn:epc:id:sgtin:', matrix),
+                                   company_prefix, _constant(b'.', matrix),
+                                   reference, _constant(b'.', matrix),
+                                   _strip_zeros(serial))
+            if prop_name == 'epc_hex':
+                return self._encode(SGTIN96_HEADER, company_prefix,
+                                    reference, serial, matrix)
+            return _to_strings(serial)
+        if prop_name == 'epc_urn':
+            return _to_strings(_constant(b'urn:epc:id:sscc:', matrix),
+                               company_prefix, _constant(b'.', matrix),
+                               reference)
+        if prop_name == 'epc_hex':
+            return self._encode(SSCC96_HEADER, company_prefix, reference,
+                                None, matrix)
+        return _to_strings(reference)
+
+    def _encode(self, header: int, company_prefix, reference, serial,
+                matrix) -> list:
+        """
+        Returns SGTIN-96 (with a serial) or SSCC-96 (without) hex values.
+        """
+        partition, company_prefix_bits, _, _ = _get_partition(
+            self.company_prefix_length)
+        if serial is None:
+            reference_shift = SSCC96_RESERVED_BITS
+            serial = numpy.zeros(len(matrix), dtype=numpy.uint64)
+        else:
+            reference_shift = SGTIN96_SERIAL_BITS
+            serial = self._get_sgtin96_serials(serial, matrix)
+        # the 96 bits are built as a high 32 and a low 64 bit integer, the
+        # company prefix straddles the two
+        shift = 96 - 14 - company_prefix_bits
+        company_prefix = _to_integers(company_prefix)
+        top = (header << 6 | self.filter_value << 3 | partition) << 18
+        high = numpy.uint64(top) | (
+            company_prefix >> numpy.uint64(64 - shift))
+        low = (company_prefix << numpy.uint64(shift)) | (
+            _to_integers(reference) << numpy.uint64(reference_shift)) | serial
+        return _to_strings(_to_hex(high, '>u4'), _to_hex(low, '>u8'))
+
+    def _get_sgtin96_serials(self, serial, matrix):
+        width = serial.shape[1]
+        valid = _is_digit(serial).all(axis=1)
+        if width > 1:
+            valid &= serial[:, 0] != ord('0')
+        values = numpy.zeros(len(matrix), dtype=numpy.uint64)
+        if width > len(str(MAX_SGTIN96_SERIAL)):
+            valid[:] = False
+        else:
+            values[valid] = _to_integers(serial[valid])
+            valid &= values <= MAX_SGTIN96_SERIAL
+        invalid = numpy.flatnonzero(~valid)
+        if len(invalid):
+            raise BarcodeConverter.BarcodeNotValid(
+                'The serial number of %s can not be encoded as an '
+                'SGTIN-96.' % matrix[invalid[0]].tobytes().decode('ascii'))
+        return values
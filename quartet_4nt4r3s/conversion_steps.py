@@ -0,0 +1,72 @@
+"""
+The Antares barcode conversion step.  It builds on the gs123 conversion
+steps, so it is kept out of quartet_4nt4r3s.steps.
+"""
+from time import time
+
+from quartet_capture.rules import RuleContext
+from quartet_4nt4r3s.conversion import AntaresBarcodeConverter, \
+    BatchBarcodeConverter, BATCH_PROPERTIES
+from gs123.conversion import BarcodeConverter
+from gs123.steps import ListBarcodeConversionStep
+
+
+class AntaresBarcodeConversionStep(ListBarcodeConversionStep):
+    '''
+    Allows the return of the extension digit along with serial number field.
+    The epc_urn, extension_prepended_serial_number_field and epc_hex
+    properties are converted for the whole list at once with the
+    BatchBarcodeConverter.
+    '''
+
+    def __init__(self, db_task, **kwargs):
+        super().__init__(db_task, **kwargs)
+        self._declared_parameters.update({
+            'Validate Check Digits': 'If True, a barcode with an invalid '
+                                     'check digit fails the step. Default '
+                                     'is False.',
+            'Filter Value': 'The filter value of the SGTIN-96 and SSCC-96 '
+                            'encodings of the epc_hex property. Default '
+                            'is 0.',
+        })
+        self.validate_check_digits = self.get_boolean_parameter(
+            'Validate Check Digits', False)
+        self.filter_value = self.get_integer_parameter('Filter Value', 0)
+
+    def execute(self, data, rule_context: RuleContext):
+        to_process = data or rule_context.context.get(self.context_key)
+        batch = self.prop_name in BATCH_PROPERTIES
+        if not batch or not isinstance(to_process, list):
+            return super().execute(data, rule_context)
+        start = time()
+        converted = BatchBarcodeConverter(
+            self.company_prefix_length,
+            self.serial_number_length,
+            filter_value=self.filter_value,
+            validate=self.validate_check_digits
+        ).convert(to_process, self.prop_name)
+        self.info('Converted %s barcodes in %.3f seconds.', len(converted),
+                  time() - start)
+        if data:
+            return converted
+        rule_context.context[self.context_key] = converted
+
+    def convert(self, data):
+        """
+        Will convert the data parameter to a urn value and return.
+        Override this to return a different value from the BarcodeConverter.
+        :param data: The barcode value to convert.
+        :return: An EPC URN based on the inbound data.
+        """
+        # the lengths are step parameters and arrive as strings
+        converter = AntaresBarcodeConverter(
+            data,
+            int(self.company_prefix_length),
+            int(self.serial_number_length),
+            self.filter_value
+        )
+        if self.validate_check_digits and not converter.check_digit_valid:
+            raise BarcodeConverter.BarcodeNotValid(
+                'The barcode %s has an invalid check digit.' % data)
+        prop_val = converter.__getattribute__(self.prop_name)
+        return prop_val if isinstance(prop_val, str) else prop_val()
@@ -0,0 +1,94 @@
+"""
+Streams outbound EPCIS messages wrapped in a SOAP envelope.  The envelope
+template is rendered once with a marker in place of the EPCIS message and
+split around it, so the envelope prefix, the message and the suffix can be
+written to the transport one after the other without ever building the
+full envelope.
+"""
+import os
+from uuid import uuid4
+
+from jinja2.environment import Environment
+
+# the number of bytes of the message sent at a time
+DEFAULT_CHUNK_SIZE = 65536
+
+RFXCEL_SOAP_TEMPLATE = os.path.join(os.path.dirname(__file__), 'templates',
+                                    'soap', 'torfxcel_soap.xml')
+
+
+def get_rfxcel_soap_template() -> str:
+    """
+    Returns the content of the packaged rfXcel SOAP envelope template.
+    """
+    with open(RFXCEL_SOAP_TEMPLATE) as template_file:
+        return template_file.read()
+
+
+def iter_chunks(message, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                encoding: str = 'utf-8'):
+    """
+    Yields a message as chunks of bytes.
+    :param message: bytes, a str, a file-like object or an iterable of
+    bytes or str chunks.
+    :param chunk_size: The maximum size of each chunk for bytes, str and
+    file-like messages.
+    :param encoding: The encoding used for str data.
+    """
+    if isinstance(message, (bytes, bytearray)):
+        view = memoryview(message)
+        for i in range(0, len(view), chunk_size):
+            yield bytes(view[i:i + chunk_size])
+    elif isinstance(message, str):
+        for i in range(0, len(message), chunk_size):
+            yield message[i:i + chunk_size].encode(encoding)
+    elif hasattr(message, 'read'):
+        chunk = message.read(chunk_size)
+        while chunk:
+            yield chunk.encode(encoding) if isinstance(chunk, str) else chunk
+            chunk = message.read(chunk_size)
+    else:
+        for chunk in message:
+            yield chunk.encode(encoding) if isinstance(chunk, str) else chunk
+
+
+class SOAPEnvelope:
+    """
+    A SOAP envelope template split around the outbound EPCIS message.  The
+    template must output `rule_context.context.OUTBOUND_EPCIS_MESSAGE`
+    (unescaped) exactly once, as templates/soap/torfxcel_soap.xml does.
+    """
+
+    def __init__(self, template_content: str, context: dict,
+                 autoescape: bool = True):
+        """
+        :param template_content: The jinja2 envelope template.
+        :param context: The template context.  Any rule_context value is
+        replaced.
+        :param autoescape: Whether or not to autoescape the template.
+        """
+        environment = Environment(trim_blocks=True, lstrip_blocks=True,
+                                  autoescape=autoescape)
+        marker = uuid4().hex
+        context = dict(context)
+        context['rule_context'] = {
+            'context': {'OUTBOUND_EPCIS_MESSAGE': marker}
+        }
+        rendered = environment.from_string(template_content).render(context)
+        self.prefix, found, self.suffix = rendered.partition(marker)
+        if not found:
+            raise ValueError('The envelope template does not output the '
+                             'OUTBOUND_EPCIS_MESSAGE context value.')
+
+    def iter_bytes(self, message, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   encoding: str = 'utf-8'):
+        """
+        Yields the envelope prefix, the message in chunks and the envelope
+        suffix as bytes.
+        :param message: See iter_chunks.
+        :param chunk_size: See iter_chunks.
+        :param encoding: The encoding of the envelope and any str data.
+        """
+        yield self.prefix.encode(encoding)
+        yield from iter_chunks(message, chunk_size, encoding)
+        yield self.suffix.encode(encoding)
@@ -0,0 +1,98 @@
+"""
+Memory maps EPCIS documents stored on the local disk so that lxml reads
+them straight from the page cache instead of through Python's buffered
+file I/O.  The map is read-only and advised as sequential so the kernel
+reads ahead.  The pages of a map count towards the resident set of the
+process, so the pages that have been read are released every
+RELEASE_SIZE bytes; otherwise the whole document would end up resident.
+
+Files that are not on the local disk (remote storage backends, in-memory
+and temporary files) or that can not be mapped are parsed as before.
+"""
+import logging
+import mmap
+import os
+from contextlib import contextmanager
+
+from django.core.files.base import File
+
+logger = logging.getLogger(__name__)
+
+RELEASE_SIZE = 8 * 1024 * 1024
+
+
+class MappedReader:
+    """
+    Reads a memory map from start to end, releasing the pages behind it.
+    """
+
+    def __init__(self, mapped: mmap.mmap):
+        self.mapped = mapped
+        self._released = 0
+        self._release = hasattr(mapped, 'madvise') and hasattr(
+            mmap, 'MADV_DONTNEED')
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.mapped.read(size)
+        position = self.mapped.tell()
+        if self._release and position - self._released >= RELEASE_SIZE:
+            end = position - position % mmap.PAGESIZE
+            self.mapped.madvise(mmap.MADV_DONTNEED, self._released,
+                                end - self._released)
+            self._released = end
+        return data
+
+    def tell(self) -> int:
+        return self.mapped.tell()
+
+    @property
+    def closed(self) -> bool:
+        return self.mapped.closed
+
+
+def get_local_path(file: File):
+    """
+    Returns the path of a Django File on the local disk or None.  A
+    FieldFile is only mapped if its storage has local paths, it is never
+    opened to find out.
+    """
+    storage = getattr(file, 'storage', None)
+    if storage is not None:
+        try:
+            path = storage.path(file.name)
+        except NotImplementedError:
+            return None
+    else:
+        path = getattr(file.file, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return path
+    return None
+
+
+@contextmanager
+def open_mapped(file: File):
+    """
+    Yields a MappedReader for a Django File on the local disk, positioned
+    where the File is, or None if the file can not be mapped.  The map is
+    closed on exit.
+    """
+    path = get_local_path(file)
+    mapped = None
+    if path:
+        try:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            # empty files and some file systems can not be mapped
+            logger.info('Could not map %s: %s', path, e)
+    if mapped is None:
+        yield None
+        return
+    try:
+        if hasattr(mapped, 'madvise'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        if not file.closed:
+            mapped.seek(file.tell())
+        yield MappedReader(mapped)
+    finally:
+        mapped.close()
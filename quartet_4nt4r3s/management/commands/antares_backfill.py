@@ -0,0 +1,70 @@
+import time
+
+from django.core.management import base
+from django.utils.translation import gettext as _
+
+from quartet_4nt4r3s import backfill
+
+
+class Command(base.BaseCommand):
+    help = _('Parses archived Antares SOAP messages or EPCIS documents '
+             'with the Antares parser across a pool of processes.  Files '
+             'that share epcs are parsed in the order of their timestamps.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+',
+                            help='The files, directories or glob patterns '
+                                 'to parse.')
+        parser.add_argument('--pattern', default='*',
+                            help='The glob pattern of the files to parse in '
+                                 'a directory.  Default is *.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='The number of processes.  0 parses in this '
+                                 'process.  Default is the number of CPUs.')
+        parser.add_argument('--event-cache-size', type=int, default=1024,
+                            help='The event cache size of the parser.')
+        parser.add_argument('--compact-epcs', action='store_true',
+                            help='Keep the known epcs of the parser as '
+                                 'packed integers.')
+
+    def handle(self, *args, **options):
+        files = backfill.get_files(options['paths'], options['pattern'])
+        if not files:
+            raise base.CommandError(_('No files were found.'))
+        self.stdout.write(_('Parsing %s files.') % len(files))
+        start = time.perf_counter()
+        results = backfill.backfill(
+            files, options['workers'],
+            parser_kwargs={
+                'event_cache_size': options['event_cache_size'],
+                'compact_epcs': options['compact_epcs'],
+            },
+            on_result=self.write_result)
+        seconds = time.perf_counter() - start
+        parsed = [r for r in results if r.status == backfill.PARSED]
+        failed = [r for r in results if r.status == backfill.FAILED]
+        skipped = [r for r in results if r.status == backfill.SKIPPED]
+        events = sum(r.events for r in parsed)
+        size = sum(r.size for r in parsed) / 1e6
+        self.stdout.write(
+            _('Parsed %(parsed)s of %(total)s files, %(events)s events and '
+              '%(size).1f MB in %(seconds).1f seconds: %(files_rate).1f '
+              'files, %(events_rate).0f events and %(size_rate).1f MB a '
+              'second.  %(failed)s failed and %(skipped)s were skipped.') % {
+                'parsed': len(parsed), 'total': len(results),
+                'events': events, 'size': size, 'seconds': seconds,
+                'files_rate': len(parsed) / seconds,
+                'events_rate': events / seconds,
+                'size_rate': size / seconds,
+                'failed': len(failed), 'skipped': len(skipped)})
+        if failed or skipped:
+            raise base.CommandError(
+                _('%s files were not parsed.') % (len(failed) + len(skipped)))
+
+    def write_result(self, result: backfill.FileResult):
+        if result.status == backfill.PARSED:
+            self.stdout.write('%s: %s events in %.2f seconds' % (
+                result.path, result.events, result.seconds))
+        else:
+            self.stderr.write('%s: %s, %s' % (result.path, result.status,
+                                              result.error))
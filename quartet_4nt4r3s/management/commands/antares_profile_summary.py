@@ -0,0 +1,46 @@
+import glob
+import os
+
+from django.core.management import base
+from django.utils.translation import gettext as _
+
+from quartet_capture.models import TaskParameter
+from quartet_4nt4r3s import profiling
+
+
+class Command(base.BaseCommand):
+    help = _('Summarizes the hotspots and memory peaks of the profiles '
+             'saved for Antares messages.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='The .prof files to summarize.')
+        parser.add_argument('--task', action='append', default=[],
+                            help='The name of a profiled task.')
+        parser.add_argument('--latest', type=int, default=1,
+                            help='Without paths or tasks, the number of the '
+                                 'most recent profiles to summarize.')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='The number of functions to list.')
+        parser.add_argument('--sort', default='cumulative',
+                            help='The pstats sort key, e.g. cumulative or '
+                                 'tottime.')
+
+    def handle(self, *args, **options):
+        paths = list(options['paths'])
+        for task_name in options['task']:
+            param = TaskParameter.objects.filter(
+                task__name=task_name, name=profiling.RESULT_PARAMETER).first()
+            if not param:
+                raise base.CommandError(
+                    _('Task %s has not been profiled.') % task_name)
+            paths.append(param.value)
+        if not paths:
+            paths = sorted(
+                glob.glob(os.path.join(profiling.get_profile_dir(), '*.prof')),
+                key=os.path.getmtime)[-options['latest']:]
+        if not paths:
+            raise base.CommandError(_('No profiles were found in %s.') %
+                                    profiling.get_profile_dir())
+        self.stdout.write(profiling.summarize(paths, options['limit'],
+                                              options['sort']))
@@ -0,0 +1,60 @@
+from django.core.management import base
+from django.utils.translation import gettext as _
+
+from quartet_4nt4r3s import backfill, capture
+
+
+class Command(base.BaseCommand):
+    help = _('Replays the Antares requests recorded by the CaptureMiddleware '
+             'against another instance and reports the throughput, errors '
+             'and latency percentiles.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='The capture files, directories or glob '
+                                 'patterns.  Default is every file in the '
+                                 'capture directory.')
+        parser.add_argument('--url', required=True,
+                            help='The scheme, host and port of the instance '
+                                 'to replay against, e.g. '
+                                 'http://localhost:8000.')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='How many times faster than captured to '
+                                 'send the requests.  0 sends them as fast '
+                                 'as possible.  Default is 1.')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='The number of requests that can be open '
+                                 'at once.  Default is 8.')
+        parser.add_argument('--username',
+                            help='Replaces the redacted SOAP username.')
+        parser.add_argument('--password',
+                            help='Replaces the redacted SOAP password.')
+        parser.add_argument('--timeout', type=float, default=60,
+                            help='The seconds to wait for each response.  '
+                                 'Default is 60.')
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0:
+            raise base.CommandError(_('The speed can not be negative.'))
+        paths = options['paths'] or [capture.get_capture_dir()]
+        files = backfill.get_files(paths, '*.jsonl')
+        records = capture.load_records(files)
+        if not records:
+            raise base.CommandError(
+                _('No captured requests were found in %s.') %
+                ', '.join(paths))
+        span = records[-1]['time'] - records[0]['time']
+        self.stdout.write(
+            _('Replaying %(count)s requests captured over %(span).1f seconds '
+              'from %(files)s files.') % {
+                'count': len(records), 'span': span, 'files': len(files)})
+        results, elapsed = capture.replay(
+            records, options['url'], options['speed'],
+            options['concurrency'], options['username'],
+            options['password'], timeout=options['timeout'])
+        for result in results:
+            if result.failed:
+                self.stderr.write('%s %s: %s' % (
+                    result.record['method'], result.record['path'],
+                    result.error or result.status))
+        self.stdout.write(capture.summarize(results, elapsed))
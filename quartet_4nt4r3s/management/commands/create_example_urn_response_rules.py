@@ -1,19 +1,40 @@
 from quartet_4nt4r3s.management.commands import utils
 from django.core.management import base
 
+
 class Command(base.BaseCommand):
     help = 'Creates the response rules for internal ' \
            'and external sources to receive GTINs as URNs.'
 
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument(
+            '--native',
+            action='store_true',
+            help='Build the responses with the RFXCELResponseStep instead '
+                 'of rendering templates.'
+        )
+        group.add_argument(
+            '--fused',
+            action='store_true',
+            help='Convert the numbers and build the responses in one step '
+                 'with the RFXCELURNResponseStep.'
+        )
+
     def handle(self, *args, **options):
+        template_step_class = utils.TEMPLATE_STEP
+        if options.get('native'):
+            template_step_class = utils.NATIVE_RESPONSE_STEP
+        elif options.get('fused'):
+            template_step_class = utils.FUSED_RESPONSE_STEP
         print('Creating the response rule...')
-        utils.create_rfxcel_gtin_response_rule()
+        utils.create_rfxcel_gtin_response_rule(template_step_class)
         print('Complete...creating the response template...')
         utils.create_rfxcel_template()
         print('Complete...creating the sequential rule')
-        utils.create_sequential_rfxcel_gtin_response_rule()
+        utils.create_sequential_rfxcel_gtin_response_rule(template_step_class)
         print('Complete...creating the sequential sscc rule')
-        utils.create_sequential_rfxcel_sscc_response_rule()
+        utils.create_sequential_rfxcel_sscc_response_rule(template_step_class)
         print('Creating sequential templates...')
         utils.create_sequential_rfxcel_template()
         utils.create_sequential_sscc_rfxcel_template()
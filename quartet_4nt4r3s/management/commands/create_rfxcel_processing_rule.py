@@ -19,7 +19,8 @@ from quartet_capture import models
 
 
 class Command(BaseCommand):
-    help = _('Creates the default rfXcel and tracelink processing rules.')
+    help = _('Creates the default rfXcel, tracelink and Antares '
+             'dispatch processing rules.')
 
     def handle(self, *args, **options):
         if models.Rule.objects.filter(name='RFXCEL Number Request').count() == 0:
@@ -73,3 +74,20 @@ class Command(BaseCommand):
                                 'TracelinkNumberResponseParserStep')
             step4.order = 2
             step4.save()
+        dispatch_rules = models.Rule.objects.filter(
+            name='Antares EPCIS Dispatch')
+        if not dispatch_rules.exists():
+            rule3 = models.Rule()
+            rule3.name = 'Antares EPCIS Dispatch'
+            rule3.description = ('Unwraps Antares SOAP messages received in '
+                                 'fast-acknowledge mode and queues the '
+                                 'EPCIS rules.')
+            rule3.save()
+            step5 = models.Step()
+            step5.rule = rule3
+            step5.name = 'Dispatch EPCIS'
+            step5.description = ('Unwraps the EPCIS document and queues a '
+                                 'task for each matching rule.')
+            step5.step_class = 'quartet_4nt4r3s.steps.EPCISDispatchStep'
+            step5.order = 1
+            step5.save()
@@ -0,0 +1,52 @@
+from django.core.management import base
+from django.utils.translation import gettext as _
+
+from quartet_4nt4r3s.standin import StandInServer
+
+
+class Command(base.BaseCommand):
+    help = _('Runs a local stand-in for the serialbox allocate endpoint and '
+             'the rfXcel processMessages service for load testing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1',
+                            help='The address to listen on.')
+        parser.add_argument('--port', type=int, default=8001,
+                            help='The port to listen on.')
+        parser.add_argument('--latency', type=float,
+                            help='Seconds to wait before each response.')
+        parser.add_argument('--jitter', type=float,
+                            help='Maximum random seconds added to the '
+                                 'latency.')
+        parser.add_argument('--error-rate', type=float,
+                            help='Fraction (0 to 1) of requests answered '
+                                 'with a 503.')
+        parser.add_argument('--response-size', type=int,
+                            help='Number of ids in every allocation.')
+        parser.add_argument('--seed', type=int,
+                            help='Seed for reproducible latency and errors.')
+        parser.add_argument('--company-prefix-length', type=int,
+                            help='Digits of the company prefix in GTIN-14 '
+                                 'pool names.  Default is 7.')
+
+    def handle(self, *args, **options):
+        server = StandInServer(options['host'], options['port'],
+                               latency=options.get('latency'),
+                               jitter=options.get('jitter'),
+                               error_rate=options.get('error_rate'),
+                               response_size=options.get('response_size'),
+                               seed=options.get('seed'),
+                               company_prefix_length=options.get(
+                                   'company_prefix_length'))
+        self.stdout.write(_('Stand-in listening on %s. Set '
+                            'ANTARES_SERIALBOX_HOST and '
+                            'ANTARES_SERIALBOX_PORT to use it.') % server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(_('Served %(requests)s requests, %(errors)s '
+                                'errors, %(messages)s messages.') %
+                              server.counts)
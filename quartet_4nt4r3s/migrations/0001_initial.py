@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-19 06:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberResponse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(help_text='The serialbox username in the number request.', max_length=150, verbose_name='Username')),
+                ('event_id', models.CharField(help_text='The rfXcel eventId of the number request.', max_length=150, verbose_name='Event Id')),
+                ('credentials', models.CharField(help_text='A keyed hash of the password in the number request.', max_length=64, verbose_name='Credentials')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, help_text='When the numbers were allocated.', verbose_name='Created')),
+                ('content_type', models.CharField(help_text='The content type of the response.', max_length=100, verbose_name='Content Type')),
+                ('pass_through', models.BooleanField(default=False, help_text='Whether the body was sent to the client as is.', verbose_name='Pass Through')),
+                ('body', models.BinaryField(help_text='The serialbox response body.', verbose_name='Body')),
+            ],
+            options={
+                'verbose_name': 'Number Response',
+                'verbose_name_plural': 'Number Responses',
+                'unique_together': {('username', 'event_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_4nt4r3s', '0001_initial'),
+    ]
+
+    operations = [
+        # the responses stored before reservations are complete
+        migrations.AddField(
+            model_name='numberresponse',
+            name='complete',
+            field=models.BooleanField(default=True, help_text='Whether the response has been stored, False while the numbers are being allocated.', verbose_name='Complete'),
+        ),
+        migrations.AlterField(
+            model_name='numberresponse',
+            name='complete',
+            field=models.BooleanField(default=False, help_text='Whether the response has been stored, False while the numbers are being allocated.', verbose_name='Complete'),
+        ),
+    ]
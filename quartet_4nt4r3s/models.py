@@ -1,2 +1,57 @@
 # -*- coding: utf-8 -*-
+from django.db import models
+from django.utils.translation import gettext_lazy as _
 
+
+class NumberResponse(models.Model):
+    """
+    The response to an Antares number request, kept so a retry of the
+    same event is answered with the same numbers instead of a new
+    allocation.  See quartet_4nt4r3s.replay.
+    """
+    username = models.CharField(
+        max_length=150,
+        verbose_name=_("Username"),
+        help_text=_("The serialbox username in the number request."),
+    )
+    event_id = models.CharField(
+        max_length=150,
+        verbose_name=_("Event Id"),
+        help_text=_("The rfXcel eventId of the number request."),
+    )
+    credentials = models.CharField(
+        max_length=64,
+        verbose_name=_("Credentials"),
+        help_text=_("A keyed hash of the password in the number request."),
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name=_("Created"),
+        help_text=_("When the numbers were allocated."),
+    )
+    content_type = models.CharField(
+        max_length=100,
+        verbose_name=_("Content Type"),
+        help_text=_("The content type of the response."),
+    )
+    complete = models.BooleanField(
+        default=False,
+        verbose_name=_("Complete"),
+        help_text=_("Whether the response has been stored, False while the "
+                    "numbers are being allocated."),
+    )
+    pass_through = models.BooleanField(
+        default=False,
+        verbose_name=_("Pass Through"),
+        help_text=_("Whether the body was sent to the client as is."),
+    )
+    body = models.BinaryField(
+        verbose_name=_("Body"),
+        help_text=_("The serialbox response body."),
+    )
+
+    class Meta:
+        unique_together = ('username', 'event_id')
+        verbose_name = _("Number Response")
+        verbose_name_plural = _("Number Responses")
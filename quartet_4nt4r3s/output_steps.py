@@ -0,0 +1,469 @@
+"""
+The outbound steps: streaming templates, SOAP envelope transports and the
+TraceLink export.  They build on quartet_output and quartet_templates,
+which load requests, paramiko and celery, so they are kept out of
+quartet_4nt4r3s.steps.
+"""
+import posixpath
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from time import sleep, time
+from urllib.parse import urlparse
+from uuid import uuid4
+
+import paramiko
+import requests
+from jinja2.environment import Environment
+
+from quartet_capture.defaults import get_storage
+from quartet_capture.models import TaskParameter
+from quartet_capture.rules import RuleContext, Step
+from quartet_output.models import EPCISOutputCriteria
+from quartet_output.steps import TransportStep
+from quartet_output.transport.sftp import SftpTransportMixin
+from quartet_templates.models import Template
+from quartet_templates.steps import TemplateStep
+from quartet_4nt4r3s import envelope, splitting, tracelink, tracing, \
+    transport
+from quartet_4nt4r3s.rendering import RenderedTemplate, DEFAULT_BUFFER_SIZE
+
+
+class StreamingTemplateStep(TemplateStep):
+    """
+    Renders a template the same way as the quartet_templates TemplateStep
+    but returns a RenderedTemplate which renders the output in chunks as
+    it is iterated instead of one string.
+
+    The chunks only stay small if the next step iterates over the rule's
+    data, as the SOAPEnvelopeTransportStep does when it posts the rendered
+    message.  serialbox's allocate view turns a number response rule's data
+    into one string, use the RFXCELResponseStep or RFXCELURNResponseStep
+    for those rules.
+    """
+
+    def execute(self, data, rule_context: RuleContext):
+        template_name = self.get_parameter('Template Name',
+                                           raise_exception=True)
+        context_key = self.get_parameter('Context Key')
+        buffer_size = self.get_integer_parameter('Buffer Size',
+                                                 DEFAULT_BUFFER_SIZE)
+        self.info('Streaming template %s with a buffer size of %s.',
+                  template_name, buffer_size)
+        template = Template.objects.get(name=template_name)
+        environment = Environment(
+            trim_blocks=True,
+            lstrip_blocks=True,
+            autoescape=self.get_boolean_parameter('Auto Escape', True),
+        )
+        ret = RenderedTemplate(environment.from_string(template.content),
+                               self.get_context(data, rule_context),
+                               buffer_size)
+        if context_key:
+            self.info('Placing the rendered template into context key %s.',
+                      context_key)
+            rule_context.context[context_key] = ret
+        else:
+            data = ret
+        return data
+
+    def get_context(self, data, rule_context: RuleContext) -> dict:
+        """
+        The template variables of the TemplateStep, which builds them
+        inside its execute.  Override to add variables.
+        """
+        return {
+            'data': data,
+            'rule_context': rule_context,
+            'step_parameters': self.parameters,
+            'task_parameters': self.get_task_parameters(rule_context),
+            'epoch': time(),
+            'random': random.randint(1, sys.maxsize),
+            'UUID': str(uuid4()),
+            'datetime': datetime.isoformat(datetime.now()),
+        }
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        params['Buffer Size'] = ('The number of template fragments rendered '
+                                 'into each chunk. Default is 1000.')
+        return params
+
+
+class SOAPEnvelopeTransportStep(tracing.TracedTransportMixin, TransportStep):
+    """
+    A TransportStep that wraps the outbound EPCIS message in a SOAP
+    envelope while it is being sent.  Over http(s) the envelope prefix, the
+    message chunks and the envelope suffix are streamed to the endpoint, so
+    the envelope is never built in memory.  A multipart upload (the
+    body-raw step parameter is False) and the other protocols need the
+    whole message, so there it is built first.  The envelope is the packaged
+    rfXcel SOAP template unless the Template Name step parameter names a
+    QU4RTET template.  The step parameters and the output criteria
+    credentials (username and password) are available to the template.
+    """
+
+    def _send_message(self, data, protocol: str, rule_context: RuleContext,
+                      output_criteria):
+        stream = protocol.lower() in ['http', 'https']
+        if not stream:
+            self.info('Streaming is only supported over http, building the '
+                      'envelope in memory.')
+        super()._send_message(
+            self.get_message(data, rule_context, output_criteria, stream),
+            protocol, rule_context, output_criteria)
+
+    def get_message(self, data, rule_context: RuleContext, output_criteria,
+                    stream: bool = True):
+        """
+        Wraps the data in the SOAP envelope.
+        :param stream: Whether the protocol can send the message in chunks.
+        :return: An iterator of the message chunks if it can and the
+        body-raw step parameter is True, otherwise the message as bytes.
+        """
+        chunks = self.get_envelope(rule_context, output_criteria).iter_bytes(
+            data,
+            self.get_integer_parameter('Chunk Size',
+                                       envelope.DEFAULT_CHUNK_SIZE)
+        )
+        if stream and self.get_boolean_parameter('body-raw', True):
+            return chunks
+        return b''.join(chunks)
+
+    def get_envelope(self, rule_context: RuleContext, output_criteria):
+        template_name = self.get_parameter('Template Name')
+        if template_name:
+            content = Template.objects.get(name=template_name).content
+        else:
+            content = envelope.get_rfxcel_soap_template()
+        auth_info = output_criteria.authentication_info
+        return envelope.SOAPEnvelope(
+            content,
+            {
+                'username': auth_info.username if auth_info else '',
+                'password': auth_info.password if auth_info else '',
+                'step_parameters': self.parameters,
+                'task_parameters': self.get_task_parameters(rule_context),
+            },
+            self.get_boolean_parameter('Auto Escape', True)
+        )
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        params.update({
+            'Template Name': 'The name of the SOAP envelope template. '
+                             'Default is the packaged rfXcel SOAP template.',
+            'Auto Escape': 'Whether or not to auto escape the envelope '
+                           'template. Default is True.',
+            'Chunk Size': 'The number of bytes of the message sent at a '
+                          'time. Default is 65536.',
+            'deployment_id': 'The rfXcel system deployment id.',
+            'sender_sgln': 'The SGLN of the sender.'
+        })
+        return params
+
+
+class SplitSOAPEnvelopeTransportStep(SOAPEnvelopeTransportStep):
+    """
+    Splits the outbound EPCIS message into several documents by the Max
+    Events, Max EPCs and Max Bytes step parameters and sends each one in
+    its own SOAP envelope.  The events keep their document order and the
+    chunks are sent one at a time, so commissioning reaches rfXcel before
+    the aggregation and shipping events that depend on it.  The next chunk
+    is split and rendered while the current one is being sent and a failed
+    chunk is retried on its own.
+    """
+
+    def _send_message(self, data, protocol: str, rule_context: RuleContext,
+                      output_criteria):
+        soap_envelope = self.get_envelope(rule_context, output_criteria)
+        chunks = splitting.split_document(
+            data,
+            max_events=self.get_integer_parameter('Max Events', 0),
+            max_epcs=self.get_integer_parameter('Max EPCs', 0),
+            max_bytes=self.get_integer_parameter('Max Bytes', 0)
+        )
+        messages = ((chunk, b''.join(soap_envelope.iter_bytes(chunk.data)))
+                    for chunk in chunks)
+        sent = 0
+        for chunk, message in splitting.pipeline(
+            messages,
+            self.get_integer_parameter('Pipeline Depth',
+                                       splitting.DEFAULT_PIPELINE_DEPTH)
+        ):
+            self.info('Sending chunk %s with %s events and %s EPCs.',
+                      chunk.index, chunk.event_count, chunk.epc_count)
+            with tracing.span('antares.transport', task=rule_context.task_name,
+                              protocol=protocol, chunk=chunk.index):
+                self.send_chunk(message, chunk.index, protocol, rule_context,
+                                output_criteria)
+            sent += 1
+        self.info('Sent %s chunks.', sent)
+
+    def send_chunk(self, message: bytes, index: int, protocol: str,
+                   rule_context: RuleContext, output_criteria):
+        """
+        Sends one enveloped chunk, retrying it on connection and http
+        errors with an exponential back off.
+        """
+        retries = self.get_integer_parameter('Retries', 3)
+        delay = float(self.get_parameter('Retry Delay', 1))
+        attempt = 0
+        while True:
+            try:
+                return TransportStep._send_message(
+                    self, message, protocol, rule_context, output_criteria)
+            except (requests.exceptions.RequestException, OSError) as e:
+                if attempt >= retries:
+                    self.error('Chunk %s failed after %s attempts. Later '
+                               'chunks were not sent.', index, attempt + 1)
+                    raise
+                self.warning('Chunk %s failed (%s), retrying.', index, e)
+                sleep(delay * 2 ** attempt)
+                attempt += 1
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        params.update({
+            'Max Events': 'The maximum number of events in each message. '
+                          'Default is 0 (no limit).',
+            'Max EPCs': 'The maximum number of EPCs in each message. '
+                        'Default is 0 (no limit).',
+            'Max Bytes': 'The maximum size of the events in each message. '
+                         'Default is 0 (no limit).',
+            'Pipeline Depth': 'The number of messages rendered ahead of the '
+                              'transport. Default is 2.',
+            'Retries': 'The number of times a failed message is retried. '
+                       'Default is 3.',
+            'Retry Delay': 'The seconds to wait before the first retry. '
+                           'Doubles with each retry. Default is 1.'
+        })
+        return params
+
+
+class PooledTransportStep(transport.PooledHttpTransportMixin,
+                          tracing.TracedTransportMixin, TransportStep):
+    """
+    A TransportStep that posts through the shared, kept alive session of
+    the endpoint with a bounded number of concurrent posts per endpoint
+    (the ANTARES_TRANSPORT_CONCURRENCY setting, default 4).  When it is the
+    only step in its rule, after sending its own message it claims the
+    QUEUED tasks of the same rule and output criteria and sends their
+    messages concurrently, so an output backlog is drained by one task
+    instead of one task and connection per message.  Claimed tasks are
+    skipped when they are executed later.
+    """
+
+    def execute(self, data, rule_context: RuleContext):
+        coalesced_by = transport.get_coalesced_by(self.task)
+        if coalesced_by:
+            self.info('The message was already sent by task %s.',
+                      coalesced_by)
+            return
+        super().execute(data, rule_context)
+        if self.get_boolean_parameter('Coalesce Queued Tasks', True):
+            self.send_queued_messages()
+
+    def prepare_message(self, data, rule_context: RuleContext,
+                        output_criteria):
+        """
+        Override to transform the data of a claimed task before it is
+        sent.
+        :return: The data to send.
+        """
+        return data
+
+    def send_queued_messages(self):
+        """
+        Claims the queued tasks for the same endpoint and sends their
+        messages concurrently.
+        """
+        if not self.db_step or self.db_step.rule.step_set.count() != 1:
+            self.info('Queued tasks are only coalesced when this is the '
+                      'only step in the rule.')
+            return
+        criteria_name = TaskParameter.objects.get(
+            task=self.task, name='EPCIS Output Criteria').value
+        # load the endpoint and credentials here, the posts are made on
+        # threads that must not use the database
+        output_criteria = EPCISOutputCriteria.objects.select_related(
+            'end_point', 'authentication_info').get(name=criteria_name)
+        scheme = urlparse(output_criteria.end_point.urn).scheme.lower()
+        if scheme not in ['http', 'https']:
+            return
+        tasks = transport.claim_queued_tasks(
+            self.task, criteria_name,
+            self.get_integer_parameter('Coalesce Limit', 100))
+        if not tasks:
+            return
+        self.info('Sending the messages of %s queued tasks.', len(tasks))
+        storage = get_storage()
+        failed = 0
+        started = {}
+        concurrency = transport.get_concurrency()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = []
+            for task in tasks:
+                with storage.open('{0}.dat'.format(task.name)) as f:
+                    data = f.read()
+                context = RuleContext(task.rule.name, task.name)
+                started[task.name] = time()
+                futures.append((task, executor.submit(
+                    self.post_data,
+                    self.prepare_message(data, context, output_criteria),
+                    context, output_criteria,
+                    self.get_parameter('content-type', 'application/xml'),
+                    self.get_parameter('file-extension', 'xml'),
+                    self.get_boolean_parameter('put-data'),
+                    self.get_boolean_parameter('body-raw', True)
+                )))
+            for task, future in futures:
+                try:
+                    response = future.result()
+                    tracing.record('antares.transport',
+                                   tracing.get_correlation_id(task)
+                                   if tracing.is_enabled() else None,
+                                   started[task.name], time(),
+                                   task=task.name, coalesced_by=self.task.name)
+                    response.raise_for_status()
+                    self.info('Message sent by task %s.', self.task.name,
+                              task=task)
+                    transport.release_task(task, 'FINISHED')
+                except (requests.exceptions.RequestException, OSError) as e:
+                    failed += 1
+                    self.error('Could not send the message: %s', e,
+                               task=task)
+                    transport.release_task(task, 'FAILED')
+        if failed:
+            self.warning('%s of the queued messages could not be sent.',
+                         failed)
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        params.update({
+            'Coalesce Queued Tasks': 'Whether or not to send the messages '
+                                     'of queued tasks for the same '
+                                     'endpoint. Default is True.',
+            'Coalesce Limit': 'The maximum number of queued tasks sent by '
+                              'one task. Default is 100.'
+        })
+        return params
+
+
+class PooledSOAPEnvelopeTransportStep(PooledTransportStep,
+                                      SOAPEnvelopeTransportStep):
+    """
+    The PooledTransportStep for messages that are wrapped in the rfXcel
+    SOAP envelope by the SOAPEnvelopeTransportStep.
+    """
+
+    def prepare_message(self, data, rule_context: RuleContext,
+                        output_criteria):
+        return self.get_message(data, rule_context, output_criteria)
+
+
+class TraceLinkExportStep(Step, SftpTransportMixin):
+    """
+    Streams a TraceLink commissioning export of the EPCs in the data
+    straight to the sftp endpoint of the EPCIS Output Criteria task
+    parameter.  The document is written to the remote file as it is
+    generated, so memory use does not grow with the number of EPCs.
+    file:// endpoints write to a local directory instead.
+    """
+
+    def execute(self, data, rule_context: RuleContext):
+        param = TaskParameter.objects.get(task=self.task,
+                                          name='EPCIS Output Criteria')
+        output_criteria = EPCISOutputCriteria.objects.get(name=param.value)
+        file_name = '{0}.{1}'.format(
+            rule_context.task_name, self.get_parameter('file-extension', 'xml'))
+        with self.open_sftp(output_criteria) as (sftp, directory), \
+                tracing.span('antares.transport', task=rule_context.task_name,
+                             protocol='sftp'):
+            remote_path = posixpath.join(directory, file_name)
+            self.info('Writing the TraceLink export to %s.', remote_path)
+            with sftp.open(remote_path, 'wb') as stream:
+                if hasattr(stream, 'set_pipelined'):
+                    # don't wait for the server to acknowledge each write
+                    stream.set_pipelined(True)
+                with tracelink.TraceLinkWriter(
+                    stream,
+                    self.get_parameter('Sender GLN', ''),
+                    self.get_parameter('Receiver GLN', ''),
+                    self.get_parameter('Instance Identifier',
+                                       rule_context.task_name),
+                    batch_size=self.get_integer_parameter(
+                        'Batch Size', tracelink.DEFAULT_BATCH_SIZE)
+                ) as writer:
+                    writer.write_object_event(
+                        self.get_epcs(data),
+                        read_point=self.get_parameter('Read Point'),
+                        biz_location=self.get_parameter('Business Location'),
+                        lot_number=self.get_parameter('Lot Number'),
+                        expiration_date=self.get_parameter('Expiration Date'),
+                        packaging_item_code_type=self.get_parameter(
+                            'Packaging Item Code Type', 'GTIN-14')
+                    )
+        self.info('Wrote %s EPCs to the TraceLink export.', writer.epc_count)
+
+    def get_epcs(self, data):
+        """
+        Returns the EPCs in the data: a list or other iterable of EPC URNs
+        or str or bytes with one URN per line.
+        """
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        if isinstance(data, str):
+            return (line.strip() for line in data.splitlines()
+                    if line.strip())
+        return data
+
+    @contextmanager
+    def open_sftp(self, output_criteria):
+        """
+        Connects to the endpoint of the output criteria.
+        :return: A two-tuple of an SFTPClient (or a LocalSFTPClient for
+        file:// endpoints) and the directory to write to.
+        """
+        parsed_urn = urlparse(output_criteria.end_point.urn)
+        if parsed_urn.scheme.lower() == 'file':
+            yield tracelink.LocalSFTPClient(parsed_urn.path), ''
+            return
+        client = paramiko.SSHClient()
+        try:
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(parsed_urn.hostname, parsed_urn.port,
+                           **(self.sftp_get_auth(output_criteria) or {}),
+                           timeout=60)
+            yield client.open_sftp(), parsed_urn.path
+        finally:
+            client.close()
+
+    @property
+    def declared_parameters(self):
+        return {
+            'Sender GLN': 'The GLN of the sender.',
+            'Receiver GLN': 'The GLN of the receiver.',
+            'Instance Identifier': 'The SBDH instance identifier. Default '
+                                   'is the task name.',
+            'Read Point': 'The read point SGLN.',
+            'Business Location': 'The business location SGLN.',
+            'Lot Number': 'The lot number of the commissioned items.',
+            'Expiration Date': 'The expiration date (YYYY-MM-DD) of the '
+                               'commissioned items.',
+            'Packaging Item Code Type': 'The TraceLink packaging item code '
+                                        'type. Default is GTIN-14.',
+            'Batch Size': 'The number of EPCs written at a time. Default '
+                          'is 10000.',
+            'file-extension': 'The extension of the export file. Default is '
+                              'xml.'
+        }
+
+    def on_failure(self):
+        pass
@@ -1,42 +1,177 @@
 import copy
+import logging
 import re
+import sys
 from datetime import timedelta
 from dateutil import parser
 from pytz import timezone
 from EPCPyYes.core.v1_2 import events, events as yes_events
 from EPCPyYes.core.v1_2.CBV import business_steps, dispositions
+from django.db import transaction
+from quartet_epcis.models import entries, headers, events as db_events
 from quartet_epcis.parsing.business_parser import BusinessEPCISParser as BEP
+from quartet_epcis.parsing.parser import QuartetParser
+from quartet_4nt4r3s.compact import CompactEPCSet
+
+logger = logging.getLogger(__name__)
+
+# the number of identifiers sent in each existence query
+EXISTENCE_QUERY_SIZE = 500
 
 
 class BusinessEPCISParser(BEP):
 
     def __init__(self, stream, event_cache_size: int = 1024,
                  recursive_decommission: bool = True,
-                 increment_agg_dates=True, increment_val=1):
+                 increment_agg_dates=True, increment_val=1,
+                 entry_cache_size: int = None, flush_batch_size: int = None,
+                 on_checkpoint=None, resume_from: tuple = None,
+                 commit_interval: int = None, compact_epcs: bool = False):
         """
         The antares parser does some special things to overcome some weirdness
         in the antares epcis support.  During DELETE events for example, the
         parser will first commission epcs before deleting them since the
         antares system never sends commission events for decommissioned epcs.
+        Only the epcs that are not already commissioned in QU4RTET are
+        commissioned; the parser keeps a set of known epcs for the duration
+        of the parse which is seeded with one bulk query per DELETE event.
         In addition, the antares system will also aggregate all levels using
         the same timestamp which causes all kinds of problems with other
         systems.  This parser will increment each commissioning event timestamp
         by one second as they are parsed to make up for this.
+        The caches are flushed to the database between events whenever the
+        number of cached events or entries reaches its limit.
+        If a commit_interval or an on_checkpoint callback is supplied the
+        parse is no longer one transaction: the events are committed in
+        chunks, each along with a call to the callback, so a failed parse
+        can be resumed with resume_from.  A chunk that fails is rolled back
+        and its cached data is discarded.
         :param stream:  See BusinessEPCParser docs.
-        :param event_cache_size:  See BusinessEPCParser docs.
+        :param event_cache_size:  The number of events to cache before
+        flushing to the database.
         :param recursive_decommission: See BusinessEPCParser docs.
         :param increment_agg_dates: Whether or not to increase the dates.
         :param increment_val: The amount to increment each aggregation
         event time date in seconds.
+        :param entry_cache_size: The number of entries to cache before
+        flushing to the database.  None for no limit.
+        :param flush_batch_size: The batch size used for the bulk inserts
+        of events and entry events during a flush.  None to let the
+        database backend decide.
+        :param on_checkpoint: A callable that receives the message id and
+        the number of events committed.  Called inside the transaction of
+        each chunk.
+        :param resume_from: A two-tuple of message id and event index from
+        a previous checkpoint.  Events up to and including the index are
+        skipped and the events are added to the existing message.
+        :param commit_interval: The number of events to commit in each
+        transaction.  If None and on_checkpoint is supplied, each cache
+        flush is committed.
+        :param compact_epcs: Keep the known epcs in a CompactEPCSet, which
+        stores numeric SGTIN and SSCC serials as integers, instead of a set
+        of strings.  Cuts the memory used for them several-fold on large
+        documents.
         """
         super().__init__(stream, event_cache_size, recursive_decommission)
         self.increment_agg_dates = increment_agg_dates
         self.increment_val = increment_val
+        self.known_epcs = CompactEPCSet() if compact_epcs else set()
+        self.entry_cache_size = entry_cache_size
+        self.flush_batch_size = flush_batch_size
+        self.cached_event_count = 0
+        self.flush_count = 0
+        self.on_checkpoint = on_checkpoint
+        self.message_id, self.resume_index = resume_from or (None, 0)
+        self.event_index = 0
+        self.commit_interval = commit_interval
+        self.commit_count = 0
+        self._committed_index = self.resume_index
+        self._uncommitted_flush = False
+        self._transaction = None
+
+    def parse(self):
+        if not (self.commit_interval or self.on_checkpoint):
+            return super().parse()
+        self._begin_chunk()
+        try:
+            if self.message_id:
+                self._message = headers.Message.objects.get(
+                    id=self.message_id)
+            else:
+                self._message = headers.Message()
+                self._message.save()
+            # skip the QuartetParser's single transaction
+            super(QuartetParser, self).parse()
+            self._commit_chunk(last=True)
+        except BaseException:
+            self._rollback_chunk()
+            raise
+        return self._message.id
+
+    def handle_sbdh(self, header):
+        # the header was committed with the first checkpoint
+        if not self.resume_index:
+            super().handle_sbdh(header)
+
+    def parse_object_event_element(self, event, object_element):
+        if not self._skip_event():
+            super().parse_object_event_element(event, object_element)
+            self._end_event()
+
+    def parse_aggregation_event_element(self, event, aggregation_element):
+        if not self._skip_event():
+            super().parse_aggregation_event_element(event,
+                                                    aggregation_element)
+            self._end_event()
+        else:
+            # keep the aggregation dates the same as the first attempt
+            self.increment_val += 1
+
+    def parse_transaction_event_element(self, event, transaction_element):
+        if not self._skip_event():
+            super().parse_transaction_event_element(event,
+                                                    transaction_element)
+            self._end_event()
+
+    def parse_transformation_event_element(self, event,
+                                           transformation_element):
+        if not self._skip_event():
+            super().parse_transformation_event_element(
+                event, transformation_element)
+            self._end_event()
+
+    def _skip_event(self):
+        """
+        Counts the events in the document and returns True for any that
+        were committed before the checkpoint being resumed from.
+        """
+        self.event_index += 1
+        return self.event_index <= self.resume_index
+
+    def _end_event(self):
+        """
+        Called once an event element has been completely handled.  Flushes
+        the caches if they are full and commits the chunk if it is
+        complete.
+        """
+        self._check_cache_limits()
+        if not self._transaction:
+            return
+        if self.commit_interval:
+            pending = self.event_index - self._committed_index
+            complete = pending >= self.commit_interval
+        else:
+            complete = self._uncommitted_flush
+        if complete:
+            self._commit_chunk()
 
     def handle_object_event(self, epcis_event: yes_events.ObjectEvent):
         if epcis_event.action == events.Action.delete.value:
             self._pre_commission_event(epcis_event)
         super().handle_object_event(epcis_event)
+        if epcis_event.action == events.Action.delete.value:
+            # decommissioned epcs are no longer known
+            self.known_epcs.difference_update(epcis_event.epc_list)
 
     def handle_aggregation_event(self, epcis_event: events.AggregationEvent):
         self.convert_dates(epcis_event, self.increment_agg_dates,
@@ -44,12 +179,119 @@ class BusinessEPCISParser(BEP):
         self.increment_val += 1
         super().handle_aggregation_event(epcis_event)
 
+    def _append_event_to_cache(self, db_event):
+        super()._append_event_to_cache(db_event)
+        self.cached_event_count += 1
+
+    def _check_cache_limits(self):
+        """
+        Flushes the caches if either the event or the entry cache has
+        reached its configured size.  Only called once an event element has
+        been completely handled.
+        """
+        entry_count = len(self.entry_cache)
+        if self.cached_event_count >= self.event_cache_size or (
+                self.entry_cache_size and entry_count >= self.entry_cache_size):
+            self.clear_cache()
+
+    def clear_cache(self):
+        """
+        Bulk inserts the cached events and entry events using the
+        configured flush batch size before handing off to the base class
+        for the rest of the caches.
+        """
+        logger.debug('Flushing %s events and %s entries.',
+                     self.cached_event_count, len(self.entry_cache))
+        if self.event_cache or self.entry_cache or self.entry_event_cache:
+            self.flush_count += 1
+        if self.flush_batch_size:
+            db_events.Event.objects.bulk_create(
+                self._get_sorted_event_cache(),
+                batch_size=self.flush_batch_size)
+            self.event_cache.clear()
+        entry_events = self.entry_event_cache
+        self.entry_event_cache = []
+        super().clear_cache()
+        # entries are saved by the base class so the entry events go last
+        entries.EntryEvent.objects.bulk_create(
+            entry_events, batch_size=self.flush_batch_size)
+        self.cached_event_count = 0
+        self._uncommitted_flush = True
+
+    def _begin_chunk(self):
+        self._transaction = transaction.atomic()
+        self._transaction.__enter__()
+
+    def _commit_chunk(self, last=False):
+        """
+        Flushes the caches, records the checkpoint and commits everything
+        parsed since the last commit.  Unless this is the last chunk, a
+        transaction is started for the next one.
+        """
+        self.clear_cache()
+        if self.on_checkpoint:
+            self.on_checkpoint(self._message.id, self.event_index)
+        atomic, self._transaction = self._transaction, None
+        atomic.__exit__(None, None, None)
+        self.commit_count += 1
+        self._committed_index = self.event_index
+        self._uncommitted_flush = False
+        if not last:
+            self._begin_chunk()
+
+    def _rollback_chunk(self):
+        """
+        Rolls back the current chunk and discards anything that was cached
+        for it.
+        """
+        logger.warning('Rolling back the events parsed after event %s.',
+                       self._committed_index)
+        if self._transaction:
+            atomic, self._transaction = self._transaction, None
+            atomic.__exit__(*sys.exc_info())
+        self.event_cache.clear()
+        self.entry_cache.clear()
+        self.decommissioned_entry_cache.clear()
+        for cache in (self.entry_event_cache, self.quantity_element_cache,
+                      self.error_declaration_cache,
+                      self.business_transaction_cache, self.ilmd_cache,
+                      self.source_cache, self.destination_cache,
+                      self.source_event_cache, self.destination_event_cache):
+            del cache[:]
+        self.cached_event_count = 0
+        self.known_epcs.clear()
+
     def _pre_commission_event(self, epcis_event: yes_events.ObjectEvent):
+        unknown_epcs = self._get_unknown_epcs(epcis_event.epc_list)
+        if not unknown_epcs:
+            return
         oe = copy.copy(epcis_event)
+        oe.epc_list = unknown_epcs
         oe.action = events.Action.add.value
         oe.biz_step = business_steps.BusinessSteps.commissioning.value
         oe.disposition = dispositions.Disposition.active
         self.handle_object_event(oe)
+        self.known_epcs.update(unknown_epcs)
+
+    def _get_unknown_epcs(self, epcs: list) -> list:
+        """
+        Returns the epcs that have never been commissioned (or are
+        decommissioned) in QU4RTET.  Any epcs that have not been seen yet
+        during this parse are looked up in bulk and the ones found are
+        added to the known epcs set.
+        :param epcs: The epcs to check.
+        :return: A list of the unknown epcs in their original order.
+        """
+        known, cached = self.known_epcs, self.entry_cache
+        unchecked = [epc for epc in epcs if epc not in known and epc not in cached]
+        for i in range(0, len(unchecked), EXISTENCE_QUERY_SIZE):
+            self.known_epcs.update(
+                entries.Entry.objects.filter(
+                    identifier__in=unchecked[i:i + EXISTENCE_QUERY_SIZE],
+                    decommissioned=False
+                ).values_list('identifier', flat=True)
+            )
+        return [epc for epc in unchecked if epc not in self.known_epcs]
 
     def format_datetime(self, dt_string, increment_dates=False,
                         increment_val=0):
@@ -58,12 +300,12 @@ class BusinessEPCISParser(BEP):
             if increment_dates:
                 dt_obj = dt_obj + timedelta(seconds=increment_val)
             return dt_obj.strftime('%Y-%m-%dT%H:%M:%SZ')
-        except:
+        except Exception:
             return dt_string
 
     def convert_dates(self, event, increment_dates=False, increment_val=0):
-        if event.event_time.endswith(
-            '+00:00') and event.event_timezone_offset != '+00:00':
+        utc = event.event_time.endswith('+00:00')
+        if utc and event.event_timezone_offset != '+00:00':
             converted_dt_string = re.sub(r"\+00:00$",
                                          event.event_timezone_offset,
                                          event.event_time)
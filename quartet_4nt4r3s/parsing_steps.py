@@ -0,0 +1,207 @@
+"""
+The Antares EPCIS parsing step.  It builds on the quartet_epcis parsing
+step and parsers, so it is kept out of quartet_4nt4r3s.steps.
+"""
+import contextlib
+import functools
+import io
+import os
+
+from django.core.files.base import File
+
+from quartet_epcis.parsing.steps import EPCISParsingStep as EPS
+from quartet_capture.rules import RuleContext
+from quartet_4nt4r3s import checkpoint, filemap, profiling, tracing
+from quartet_4nt4r3s.parser import BusinessEPCISParser
+
+# rough sizes of an event and an epc in an EPCIS document and of their
+# cached model instances, used to size the parser caches
+EVENT_DOCUMENT_BYTES = 1024
+ENTRY_DOCUMENT_BYTES = 64
+EVENT_MEMORY_BYTES = 16384
+ENTRY_MEMORY_BYTES = 2048
+
+
+class EPCISParsingStep(EPS):
+    """
+    Parses inbound Antares EPCIS using the antares BusinessEPCISParser.
+    The parser caches can be sized through the step parameters or, with
+    the Auto Size Caches parameter, from the size of the document and the
+    memory available on the host.  With the Resumable Parsing parameter
+    each flush is committed with a checkpoint on the task so that a retried
+    task continues after the last committed event.  The Profile parameter
+    (or the antares-profile task parameter) saves a cProfile and
+    tracemalloc profile of the parse.
+    """
+
+    def __init__(self, db_task, **kwargs):
+        super().__init__(db_task, **kwargs)
+        self.event_cache_size = self.get_integer_parameter(
+            'Event Cache Size', 1024)
+        self.entry_cache_size = self.get_integer_parameter(
+            'Entry Cache Size', 0) or None
+        self.flush_batch_size = self.get_integer_parameter(
+            'Flush Batch Size', 0) or None
+        self.auto_size_caches = self.get_boolean_parameter(
+            'Auto Size Caches', False)
+        self.resumable = self.get_boolean_parameter(
+            'Resumable Parsing', False)
+        self.commit_interval = self.get_integer_parameter(
+            'Commit Interval', 0) or None
+        self.profile = self.get_boolean_parameter('Profile', False)
+        self.compact_epcs = self.get_boolean_parameter('Compact EPCs', False)
+        self.memory_map_files = self.get_boolean_parameter(
+            'Memory Map Files', False)
+
+    def execute(self, data, rule_context: RuleContext):
+        if self.profile or profiling.is_task_profiled(self.task):
+            with profiling.profile('parse-%s' % rule_context.task_name,
+                                   self.task) as result:
+                self.parse_data(data, rule_context)
+            if result:
+                self.info('Saved the parse profile to %s.',
+                          result.stats_path)
+        else:
+            self.parse_data(data, rule_context)
+
+    def parse_data(self, data, rule_context: RuleContext):
+        increment_agg_dates = self.get_boolean_parameter(
+            'Increment Aggregation Dates', True)
+        self.info('Increment Aggregation Dates set to %s.', str(increment_agg_dates))
+        self.info('Loose Enforcement of busines rules set to %s',
+                  self.loose_enforcement)
+        self.info('Parsing message %s.dat', rule_context.task_name)
+        if self.auto_size_caches:
+            self.event_cache_size, self.entry_cache_size = get_cache_sizes(
+                data.size if isinstance(data, File) else len(data),
+                get_available_memory()
+            )
+        self.info('Event cache size %s, entry cache size %s and flush batch '
+                  'size %s.', self.event_cache_size, self.entry_cache_size,
+                  self.flush_batch_size)
+        parser_kwargs = {
+            'event_cache_size': self.event_cache_size,
+            'increment_agg_dates': increment_agg_dates,
+            'entry_cache_size': self.entry_cache_size,
+            'flush_batch_size': self.flush_batch_size,
+            'commit_interval': self.commit_interval,
+            'compact_epcs': self.compact_epcs,
+        }
+        if self.resumable:
+            resume_from = checkpoint.get_checkpoint(self.task)
+            if resume_from:
+                self.info('Resuming message %s after event %s.',
+                          *resume_from)
+            parser_kwargs['resume_from'] = resume_from
+            parser_kwargs['on_checkpoint'] = functools.partial(
+                checkpoint.save_checkpoint, self.task)
+        with contextlib.ExitStack() as stack:
+            try:
+                if isinstance(data, File):
+                    parser = BusinessEPCISParser(self.open_file(data, stack),
+                                                 **parser_kwargs)
+                else:
+                    parser = BusinessEPCISParser(io.BytesIO(data),
+                                                 **parser_kwargs)
+            except TypeError:
+                try:
+                    parser = BusinessEPCISParser(io.BytesIO(data.encode()),
+                                                 **parser_kwargs)
+                except AttributeError:
+                    self.error("Could not convert the data into a format "
+                               "that could be handled.")
+                    raise
+            with tracing.span('antares.parse',
+                              task=rule_context.task_name) as span:
+                parser.parse()
+                if span:
+                    span.attributes.update(events=parser.event_index,
+                                           flushes=parser.flush_count)
+        if self.resumable:
+            checkpoint.clear_checkpoint(self.task)
+        if self.commit_interval:
+            self.info('Committed %s transactions.', parser.commit_count)
+        self.info('Parsing complete with %s cache flushes.', parser.flush_count)
+
+    def open_file(self, data: File, stack: contextlib.ExitStack):
+        """
+        Returns a memory map of the file to parse if it is on the local
+        disk, otherwise the file itself.  The map is closed by the stack.
+        """
+        if self.memory_map_files:
+            mapped = stack.enter_context(filemap.open_mapped(data))
+            if mapped is not None:
+                self.info('Parsing a memory map of %s.', data.name)
+                return mapped
+        return data
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        params.update({
+            'Increment Aggregation Dates': 'Whether or not to increment '
+                                           'aggregation event times. '
+                                           'Default is True.',
+            'Event Cache Size': 'The number of events to cache before '
+                                'flushing to the database. Default is 1024.',
+            'Entry Cache Size': 'The number of entries to cache before '
+                                'flushing to the database. Default is 0 '
+                                '(no limit).',
+            'Flush Batch Size': 'The batch size used for the bulk inserts of '
+                                'events and entry events. Default is 0 '
+                                '(database default).',
+            'Auto Size Caches': 'If True, the event and entry cache sizes are '
+                                'calculated from the size of the document '
+                                'and the available memory. Default is False.',
+            'Resumable Parsing': 'If True, each cache flush is committed '
+                                 'with a checkpoint and a retried task '
+                                 'resumes after the last committed event. '
+                                 'Default is False.',
+            'Commit Interval': 'The number of events to commit in each '
+                               'transaction. A failed transaction is rolled '
+                               'back and the parse stops. Default is 0 (the '
+                               'whole document in one transaction).',
+            'Profile': 'If True, a cProfile and tracemalloc profile of the '
+                       'parse is saved to the ANTARES_PROFILE_DIR. Default '
+                       'is False.',
+            'Compact EPCs': 'If True, the epcs the parser has seen are kept '
+                            'as packed integers instead of strings, which '
+                            'uses much less memory on large documents. '
+                            'Default is False.',
+            'Memory Map Files': 'If True, files on the local disk are '
+                                'memory mapped and parsed straight from '
+                                'the page cache. Default is False.'
+        })
+        return params
+
+
+def get_available_memory():
+    """
+    Returns the available physical memory in bytes or None if it can not
+    be determined on this platform.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_cache_sizes(document_size: int, available_memory: int = None):
+    """
+    Estimates event and entry cache sizes for a document.  The caches are
+    sized to hold the whole document where possible and are capped at a
+    quarter of the available memory.  The event cache never drops below
+    the parser default.
+    :param document_size: The size of the EPCIS document in bytes.
+    :param available_memory: The available memory in bytes.
+    :return: A two-tuple of event cache size and entry cache size.
+    """
+    event_cache_size = max(document_size // EVENT_DOCUMENT_BYTES, 1)
+    entry_cache_size = max(document_size // ENTRY_DOCUMENT_BYTES, 1)
+    if available_memory:
+        budget = available_memory // 4
+        event_cache_size = min(event_cache_size,
+                               budget // 2 // EVENT_MEMORY_BYTES)
+        entry_cache_size = min(entry_cache_size,
+                               budget // 2 // ENTRY_MEMORY_BYTES)
+    return max(event_cache_size, 1024), max(entry_cache_size, 1024)
@@ -0,0 +1,192 @@
+"""
+Opt-in profiling of a single Antares message.  A profiled execution saves
+the cProfile stats (<name>.prof) and the tracemalloc peak and top
+allocations (<name>.json) under the ANTARES_PROFILE_DIR directory.
+
+Profiling is requested with:
+
+* the `Profile` step parameter of the EPCISParsingStep,
+* the `antares-profile` task parameter (set to True) on a task,
+* the `profile=true` query parameter on the Antares SOAP views when the
+  request comes from a staff user.  The tasks created for the message get
+  the task parameter so they are profiled too.
+
+Use the antares_profile_summary management command to list the hotspots.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from io import StringIO
+
+from django.conf import settings
+
+from quartet_capture.models import Task, TaskParameter
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PARAMETER = 'antares-profile'
+RESULT_PARAMETER = 'antares-profile-result'
+TOP_ALLOCATIONS = 25
+
+_local = threading.local()
+_tracing_lock = threading.Lock()
+_tracing_count = 0
+_started_tracing = False
+
+
+def get_profile_dir() -> str:
+    return getattr(settings, 'ANTARES_PROFILE_DIR',
+                   os.path.join(tempfile.gettempdir(), 'antares-profiles'))
+
+
+def is_task_profiled(task: Task) -> bool:
+    """
+    Whether the antares-profile task parameter of a task is True.
+    """
+    return TaskParameter.objects.filter(
+        task=task, name=PROFILE_PARAMETER, value__iexact='true').exists()
+
+
+def task_parameters() -> dict:
+    """
+    The task parameters that request profiling of a task.
+    """
+    return {PROFILE_PARAMETER: 'True'}
+
+
+class ProfileResult:
+    """
+    The files written for a profiled execution.
+    """
+
+    def __init__(self, name: str):
+        safe_name = re.sub(r'[^\w.-]', '_', name)
+        base = os.path.join(get_profile_dir(), '%s-%d' % (
+            safe_name, time.time() * 1000))
+        self.stats_path = base + '.prof'
+        self.memory_path = base + '.json'
+        self.peak = 0
+        self.duration = 0.0
+
+
+def start_tracing():
+    """
+    Starts tracemalloc for a profile.  tracemalloc traces the whole
+    process, so it is started by the first of the profiles running at the
+    same time and stopped by the last, see stop_tracing.  The peak is
+    only reset by the first, the peak of overlapping profiles covers
+    them all.
+    """
+    global _tracing_count, _started_tracing
+    with _tracing_lock:
+        if not _tracing_count:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracing = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        _tracing_count += 1
+
+
+def stop_tracing():
+    """
+    Stops tracemalloc when the last running profile ends, unless it was
+    already tracing before the first one started.
+    """
+    global _tracing_count, _started_tracing
+    with _tracing_lock:
+        _tracing_count -= 1
+        if not _tracing_count and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+@contextmanager
+def profile(name: str, task: Task = None):
+    """
+    Profiles a with block.  Nested calls in the same thread are not
+    profiled again, the outer profile covers them.
+    :param name: Used to name the result files.
+    :param task: If given, the stats path is saved to its
+    antares-profile-result task parameter.
+    :return: The ProfileResult, or None for a nested call.
+    """
+    if getattr(_local, 'active', False):
+        yield None
+        return
+    _local.active = True
+    result = ProfileResult(name)
+    start_tracing()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        result.duration = time.perf_counter() - start
+        result.peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot()
+        stop_tracing()
+        _local.active = False
+        save(result, profiler, snapshot, name)
+        if task is not None:
+            TaskParameter.objects.update_or_create(
+                task=task, name=RESULT_PARAMETER,
+                defaults={'value': result.stats_path,
+                          'description': 'The cProfile stats of the task.'})
+
+
+def save(result: ProfileResult, profiler: cProfile.Profile,
+         snapshot: tracemalloc.Snapshot, name: str):
+    os.makedirs(os.path.dirname(result.stats_path), exist_ok=True)
+    profiler.dump_stats(result.stats_path)
+    top = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__)
+    ]).statistics('lineno')[:TOP_ALLOCATIONS]
+    with open(result.memory_path, 'w') as memory_file:
+        json.dump({
+            'name': name,
+            'duration': result.duration,
+            'peak_bytes': result.peak,
+            'top_allocations': [
+                {'location': str(stat.traceback), 'size': stat.size,
+                 'count': stat.count} for stat in top
+            ]
+        }, memory_file, indent=2)
+    logger.info('Saved the profile of %s to %s (%.3fs, peak %s bytes).',
+                name, result.stats_path, result.duration, result.peak)
+
+
+def summarize(paths: list, limit: int = 20, sort: str = 'cumulative') -> str:
+    """
+    Combines the stats files and returns the top functions and, for each
+    file with a memory summary, its peak and top allocations.
+    :param paths: The .prof files.
+    :param limit: The number of functions and allocations to list.
+    :param sort: The pstats sort key, e.g. cumulative or tottime.
+    """
+    output = StringIO()
+    stats = pstats.Stats(*paths, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    for path in paths:
+        memory_path = os.path.splitext(path)[0] + '.json'
+        if not os.path.exists(memory_path):
+            continue
+        with open(memory_path) as memory_file:
+            memory = json.load(memory_file)
+        output.write('%s: %.3fs, peak %s bytes\n' % (
+            memory['name'], memory['duration'], memory['peak_bytes']))
+        for allocation in memory['top_allocations'][:limit]:
+            output.write('    %10d bytes %8d blocks  %s\n' % (
+                allocation['size'], allocation['count'],
+                allocation['location']))
+    return output.getvalue()
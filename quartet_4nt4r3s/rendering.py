@@ -0,0 +1,50 @@
+import logging
+
+from jinja2 import Template as JinjaTemplate
+
+logger = logging.getLogger(__name__)
+
+# the number of template fragments joined into each chunk
+DEFAULT_BUFFER_SIZE = 1000
+
+
+class RenderedTemplate:
+    """
+    A lazily rendered jinja2 template.  Iterating over it renders the
+    template in chunks- for the rfXcel number responses this is the
+    header, the id list a chunk of ids at a time and then the footer- so
+    only one chunk of output is held in memory at a time and the first
+    chunk can be sent before the rest is rendered.  That only holds for a
+    consumer that iterates, str() and bytes() (and a DRF renderer, which
+    calls str()) build the whole document.
+    """
+
+    def __init__(self, template: JinjaTemplate, context: dict,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE):
+        """
+        :param template: The compiled jinja2 template.
+        :param context: The template context.
+        :param buffer_size: The number of template fragments in each chunk.
+        """
+        self.template = template
+        self.context = context
+        self.buffer_size = buffer_size
+
+    def __iter__(self):
+        stream = self.template.stream(self.context)
+        if self.buffer_size > 1:
+            stream.enable_buffering(self.buffer_size)
+        return iter(stream)
+
+    def iter_bytes(self, encoding='utf-8'):
+        """
+        Yields the rendered chunks encoded as bytes.
+        """
+        for chunk in self:
+            yield chunk.encode(encoding)
+
+    def __str__(self):
+        return ''.join(self)
+
+    def __bytes__(self):
+        return b''.join(self.iter_bytes())
@@ -0,0 +1,166 @@
+"""
+Answers retried Antares number requests with the response to the original
+request.  When the ANTARES_REPLAY_RETENTION setting (in seconds) is set,
+each number request with an rfXcel eventId reserves a row under the
+serialbox username and eventId before anything is allocated.  The
+response is stored in the row once serialbox has answered, even if the
+client has gone away by then.  A request for the same username and
+eventId within the retention window:
+
+* gets the stored body back as is, without an allocation, as long as its
+  password matches,
+* waits up to ANTARES_REPLAY_WAIT seconds (default 30) while the original
+  allocation is still running, and gets a 503 if it has not finished, so
+  Antares retries again later instead of allocating a second range.
+
+A reservation whose allocation failed is released so the next retry
+allocates.  One that is still open after ANTARES_REPLAY_RESERVATION_TIMEOUT
+seconds (default 300), for example because the process died, is taken over
+by the next retry.
+
+Responses older than the retention window are ignored and deleted when a
+new request is reserved.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from quartet_4nt4r3s.models import NumberResponse
+
+logger = logging.getLogger(__name__)
+
+# the seconds between checks of a reservation that is being waited on
+POLL_INTERVAL = 0.1
+
+
+class AllocationInProgress(Exception):
+    """
+    The original request for an eventId is still being allocated.
+    """
+
+
+def get_retention() -> int:
+    """
+    The seconds responses are kept for, 0 if replay is off.
+    """
+    return getattr(settings, 'ANTARES_REPLAY_RETENTION', 0)
+
+
+def get_wait() -> float:
+    return getattr(settings, 'ANTARES_REPLAY_WAIT', 30)
+
+
+def get_reservation_timeout() -> float:
+    return getattr(settings, 'ANTARES_REPLAY_RESERVATION_TIMEOUT', 300)
+
+
+def hash_credentials(password: str) -> str:
+    return salted_hmac('quartet_4nt4r3s.replay', password or '',
+                       algorithm='sha256').hexdigest()
+
+
+class Reservation:
+    """
+    The NumberResponse row reserved for a request, or the stored response
+    to replay.  Without a row (replay is off, the request has no eventId
+    or its password does not match the stored one) complete and release
+    do nothing.
+    """
+
+    def __init__(self, number_response: NumberResponse = None,
+                 replayed: NumberResponse = None):
+        """
+        :param number_response: The reserved row.
+        :param replayed: The stored response to return instead of
+        allocating.
+        """
+        self.number_response = number_response
+        self.replayed = replayed
+
+    def _own_row(self):
+        # the row as long as it has not been taken over or completed
+        return NumberResponse.objects.filter(
+            pk=self.number_response.pk, complete=False,
+            created=self.number_response.created)
+
+    def complete(self, body: bytes, content_type: str, pass_through: bool):
+        """
+        Stores the response so retries can be replayed.
+        :param body: The serialbox response body.
+        :param content_type: Its content type.
+        :param pass_through: Whether the body was sent to the client as is.
+        """
+        if self.number_response is None:
+            return
+        if not self._own_row().update(body=body, content_type=content_type,
+                                      pass_through=pass_through,
+                                      complete=True):
+            logger.warning('The reservation for event %s of %s was taken '
+                           'over, its response is not stored.',
+                           self.number_response.event_id,
+                           self.number_response.username)
+
+    def release(self):
+        """
+        Deletes the reservation after a failed allocation so the next
+        retry allocates.
+        """
+        if self.number_response is not None:
+            self._own_row().delete()
+
+
+def reserve(username: str, password: str, event_id: str) -> Reservation:
+    """
+    Reserves the response row for a number request, or returns the stored
+    response of an earlier request for the same eventId.  Waits while that
+    request is still being allocated.
+    :raises AllocationInProgress: If it has not finished after
+    ANTARES_REPLAY_WAIT seconds.
+    """
+    if not get_retention() or not event_id:
+        return Reservation()
+    username = username or ''
+    credentials = hash_credentials(password)
+    NumberResponse.objects.filter(
+        created__lt=timezone.now() - timedelta(seconds=get_retention())
+    ).delete()
+    deadline = time.monotonic() + get_wait()
+    while True:
+        try:
+            with transaction.atomic():
+                return Reservation(NumberResponse.objects.create(
+                    username=username, event_id=event_id,
+                    credentials=credentials, body=b'', content_type='',
+                    complete=False))
+        except IntegrityError:
+            pass
+        existing = NumberResponse.objects.filter(
+            username=username, event_id=event_id).first()
+        if existing is None:
+            # released since, reserve it again
+            continue
+        if not constant_time_compare(existing.credentials, credentials):
+            logger.warning('Not replaying event %s for %s, the password does '
+                           'not match.', event_id, username)
+            return Reservation()
+        if existing.complete:
+            return Reservation(replayed=existing)
+        if existing.created < timezone.now() - timedelta(
+                seconds=get_reservation_timeout()):
+            if NumberResponse.objects.filter(
+                    pk=existing.pk, complete=False,
+                    created=existing.created).update(created=timezone.now()):
+                logger.warning('Taking over the abandoned reservation for '
+                               'event %s of %s.', event_id, username)
+                existing.refresh_from_db()
+                return Reservation(existing)
+            continue
+        if time.monotonic() >= deadline:
+            raise AllocationInProgress(
+                'Event %s is still being allocated.' % event_id)
+        time.sleep(POLL_INTERVAL)
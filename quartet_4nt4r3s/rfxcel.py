@@ -0,0 +1,288 @@
+"""
+The rfXcel syncAllocateTraceIdsResponse formats.  The jinja2 templates are
+installed by the create_example_urn_response_rules management command for
+use with the quartet_templates TemplateStep; build_response produces the
+same XML without a template for the RFXCELResponseStep and
+build_urn_response does the same straight from serialbox numbers for the
+RFXCELURNResponseStep.
+"""
+from io import StringIO
+from itertools import islice
+
+from markupsafe import escape
+
+template_data = """
+<ns5:syncAllocateTraceIdsResponse xmlns="http://xmlns.rfxcel.com/traceability/api/3"
+    xmlns:ns10="http://xmlns.rfxcel.com/traceability/QueryTraceIdDetailService/1"
+    xmlns:ns2="http://xmlns.rfxcel.com/traceability/3"
+    xmlns:ns3="http://www.w3.org/2004/11/xmlmime"
+    xmlns:ns4="http://xmlns.rfxcel.com/traceability/messagingService/3"
+    xmlns:ns5="http://xmlns.rfxcel.com/traceability/serializationService/3"
+    xmlns:ns6="http://xmlns.rfxcel.com/traceability/identifier/3"
+    xmlns:ns7="http://xmlns.rfxcel.com/traceability/serializationQueryService/3"
+    xmlns:ns8="http://xmlns.rfxcel.com/traceability/QueryLotSummaryService/1"
+    xmlns:ns9="http://xmlns.rfxcel.com/traceability/QuerySimpleEpcListService/1"
+    contentStructVer="3.1.3" createDateTime="2017-10-17T04:56:47.062-05:00"
+    requestId="{{ task_parameters.requestId }}" responseId="{{ UUID }}">
+    <result>
+        <ns2:code>1</ns2:code>
+        <ns2:msg xml:lang="en">SUCCESS</ns2:msg>
+    </result>
+    <ns5:sysEventId>{{ epoch | int}}</ns5:sysEventId>
+    <ns5:eventId>{{ task_parameters.eventId }}</ns5:eventId>
+    <ns5:orgId qlfr="ORG_DEF">urn:epc:id:sgln:0358716.00000.0</ns5:orgId>
+    <ns5:itemId qlfr="GTIN">{{ task_parameters.pool }}</ns5:itemId>
+    <ns5:siteHierId qlfr="ORG_DEF">Manufacturing</ns5:siteHierId>
+    <ns5:siteId qlfr="SGLN" type="LOCATION">urn:epc:id:sgln:0358716.00000.0</ns5:siteId>
+    <ns5:allocIdSetCont>
+        <ns6:idFormatId>JCP IDF SGTIN 12 NUM RAN</ns6:idFormatId>
+        <ns6:idEncScheme>SGTIN_96</ns6:idEncScheme>
+        <ns6:idGenMethod>RANDOM</ns6:idGenMethod>
+        <ns6:idSetCont dataStruct="LIST">
+            <ns6:idTextFormatId>PURE_ID_URI</ns6:idTextFormatId>
+            <ns6:idList>
+                {% for serial_number in data %}
+                <ns2:id>{{serial_number}}</ns2:id>
+                {% endfor %}
+            </ns6:idList>
+        </ns6:idSetCont>
+    </ns5:allocIdSetCont>
+</ns5:syncAllocateTraceIdsResponse>
+"""
+
+sequential_gtin_teplate_data = """
+<ns5:syncAllocateTraceIdsResponse xmlns="http://xmlns.rfxcel.com/traceability/api/3"
+    xmlns:ns10="http://xmlns.rfxcel.com/traceability/QueryTraceIdDetailService/1"
+    xmlns:ns2="http://xmlns.rfxcel.com/traceability/3"
+    xmlns:ns3="http://www.w3.org/2004/11/xmlmime"
+    xmlns:ns4="http://xmlns.rfxcel.com/traceability/messagingService/3"
+    xmlns:ns5="http://xmlns.rfxcel.com/traceability/serializationService/3"
+    xmlns:ns6="http://xmlns.rfxcel.com/traceability/identifier/3"
+    xmlns:ns7="http://xmlns.rfxcel.com/traceability/serializationQueryService/3"
+    xmlns:ns8="http://xmlns.rfxcel.com/traceability/QueryLotSummaryService/1"
+    xmlns:ns9="http://xmlns.rfxcel.com/traceability/QuerySimpleEpcListService/1"
+    contentStructVer="3.1.3" createDateTime="2017-10-17T04:56:47.062-05:00"
+    requestId="{{ task_parameters.requestId }}" responseId="{{ UUID }}">
+    <result>
+        <ns2:code>1</ns2:code>
+        <ns2:msg xml:lang="en">SUCCESS</ns2:msg>
+    </result>
+    <ns5:sysEventId>{{ epoch | int}}</ns5:sysEventId>
+    <ns5:eventId>{{ task_parameters.eventId }}</ns5:eventId>
+    <ns5:orgId qlfr="ORG_DEF">urn:epc:id:sgln:0358716.00000.0</ns5:orgId>
+    <ns5:itemId qlfr="GTIN">{{ task_parameters.pool }}</ns5:itemId>
+    <ns5:siteHierId qlfr="ORG_DEF">Manufacturing</ns5:siteHierId>
+    <ns5:siteId qlfr="SGLN" type="LOCATION">urn:epc:id:sgln:0358716.00000.0</ns5:siteId>
+    <ns5:allocIdSetCont>
+        <ns6:idFormatId>JCP IDF SGTIN 12 NUM RAN</ns6:idFormatId>
+        <ns6:idEncScheme>SGTIN_96</ns6:idEncScheme>
+        <ns6:idGenMethod>SEQUENTIAL</ns6:idGenMethod>
+        <ns6:idSetCont dataStruct="LIST">
+            <ns6:idTextFormatId>PURE_ID_URI</ns6:idTextFormatId>
+            <ns6:idList>
+                {% for serial_number in data %}
+                <ns2:id>{{serial_number}}</ns2:id>
+                {% endfor %}
+            </ns6:idList>
+        </ns6:idSetCont>
+    </ns5:allocIdSetCont>
+</ns5:syncAllocateTraceIdsResponse>
+"""
+
+sequential_sscc_teplate_data = """
+<ns5:syncAllocateTraceIdsResponse xmlns="http://xmlns.rfxcel.com/traceability/api/3"
+    xmlns:ns10="http://xmlns.rfxcel.com/traceability/QueryTraceIdDetailService/1"
+    xmlns:ns2="http://xmlns.rfxcel.com/traceability/3"
+    xmlns:ns3="http://www.w3.org/2004/11/xmlmime"
+    xmlns:ns4="http://xmlns.rfxcel.com/traceability/messagingService/3"
+    xmlns:ns5="http://xmlns.rfxcel.com/traceability/serializationService/3"
+    xmlns:ns6="http://xmlns.rfxcel.com/traceability/identifier/3"
+    xmlns:ns7="http://xmlns.rfxcel.com/traceability/serializationQueryService/3"
+    xmlns:ns8="http://xmlns.rfxcel.com/traceability/QueryLotSummaryService/1"
+    xmlns:ns9="http://xmlns.rfxcel.com/traceability/QuerySimpleEpcListService/1"
+    contentStructVer="3.1.3" createDateTime="2017-10-17T04:56:47.062-05:00"
+    requestId="{{ task_parameters.requestId }}" responseId="{{ UUID }}">
+    <result>
+        <ns2:code>1</ns2:code>
+        <ns2:msg xml:lang="en">SUCCESS</ns2:msg>
+    </result>
+    <ns5:sysEventId>{{ epoch | int}}</ns5:sysEventId>
+    <ns5:eventId>{{ task_parameters.eventId }}</ns5:eventId>
+    <ns5:orgId qlfr="ORG_DEF">urn:epc:id:sgln:0358716.00000.0</ns5:orgId>
+    <ns5:itemId qlfr="SSCC">{{ task_parameters.pool }}</ns5:itemId>
+    <ns5:siteHierId qlfr="ORG_DEF">Manufacturing</ns5:siteHierId>
+    <ns5:siteId qlfr="SGLN" type="LOCATION">urn:epc:id:sgln:0358716.00000.0</ns5:siteId>
+    <ns5:allocIdSetCont>
+        <ns6:idFormatId>SSCC 7 DIGIT IDF</ns6:idFormatId>
+        <ns6:idEncScheme>SSCC_96</ns6:idEncScheme>
+        <ns6:idGenMethod>SEQUENTIAL</ns6:idGenMethod>
+        <ns6:idSetCont dataStruct="LIST">
+            <ns6:idTextFormatId>PURE_ID_URI</ns6:idTextFormatId>
+            <ns6:idList>
+                {% for serial_number in data %}
+                <ns2:id>{{serial_number}}</ns2:id>
+                {% endfor %}
+            </ns6:idList>
+        </ns6:idSetCont>
+    </ns5:allocIdSetCont>
+</ns5:syncAllocateTraceIdsResponse>
+"""
+
+
+RESPONSE_HEADER = """
+<ns5:syncAllocateTraceIdsResponse xmlns="http://xmlns.rfxcel.com/traceability/api/3"
+    xmlns:ns10="http://xmlns.rfxcel.com/traceability/QueryTraceIdDetailService/1"
+    xmlns:ns2="http://xmlns.rfxcel.com/traceability/3"
+    xmlns:ns3="http://www.w3.org/2004/11/xmlmime"
+    xmlns:ns4="http://xmlns.rfxcel.com/traceability/messagingService/3"
+    xmlns:ns5="http://xmlns.rfxcel.com/traceability/serializationService/3"
+    xmlns:ns6="http://xmlns.rfxcel.com/traceability/identifier/3"
+    xmlns:ns7="http://xmlns.rfxcel.com/traceability/serializationQueryService/3"
+    xmlns:ns8="http://xmlns.rfxcel.com/traceability/QueryLotSummaryService/1"
+    xmlns:ns9="http://xmlns.rfxcel.com/traceability/QuerySimpleEpcListService/1"
+    contentStructVer="3.1.3" createDateTime="2017-10-17T04:56:47.062-05:00"
+    requestId="{request_id}" responseId="{response_id}">
+    <result>
+        <ns2:code>1</ns2:code>
+        <ns2:msg xml:lang="en">SUCCESS</ns2:msg>
+    </result>
+    <ns5:sysEventId>{sys_event_id}</ns5:sysEventId>
+    <ns5:eventId>{event_id}</ns5:eventId>
+    <ns5:orgId qlfr="ORG_DEF">urn:epc:id:sgln:0358716.00000.0</ns5:orgId>
+    <ns5:itemId qlfr="{item_qualifier}">{pool}</ns5:itemId>
+    <ns5:siteHierId qlfr="ORG_DEF">Manufacturing</ns5:siteHierId>
+    <ns5:siteId qlfr="SGLN" type="LOCATION">urn:epc:id:sgln:0358716.00000.0</ns5:siteId>
+    <ns5:allocIdSetCont>
+        <ns6:idFormatId>{id_format}</ns6:idFormatId>
+        <ns6:idEncScheme>{encoding_scheme}</ns6:idEncScheme>
+        <ns6:idGenMethod>{generation_method}</ns6:idGenMethod>
+        <ns6:idSetCont dataStruct="LIST">
+            <ns6:idTextFormatId>PURE_ID_URI</ns6:idTextFormatId>
+            <ns6:idList>
+"""
+
+RESPONSE_FOOTER = """            </ns6:idList>
+        </ns6:idSetCont>
+    </ns5:allocIdSetCont>
+</ns5:syncAllocateTraceIdsResponse>"""
+
+ID_PREFIX = '                <ns2:id>'
+ID_SUFFIX = '</ns2:id>\n'
+ID_SEPARATOR = ID_SUFFIX + ID_PREFIX
+
+# the number of serial numbers converted and written at a time
+DEFAULT_CHUNK_SIZE = 10000
+
+# characters that would be escaped by the autoescaping template
+ESCAPED_CHARACTERS = '&<>"\''
+
+# item id qualifier, id format, encoding scheme and generation method
+RESPONSE_FORMATS = {
+    'Random GTIN': ('GTIN', 'JCP IDF SGTIN 12 NUM RAN', 'SGTIN_96',
+                    'RANDOM'),
+    'Sequential GTIN': ('GTIN', 'JCP IDF SGTIN 12 NUM RAN', 'SGTIN_96',
+                        'SEQUENTIAL'),
+    'Sequential SSCC': ('SSCC', 'SSCC 7 DIGIT IDF', 'SSCC_96', 'SEQUENTIAL'),
+}
+
+
+def render_header(task_parameters: dict, response_format: str,
+                  epoch: float, response_id: str) -> str:
+    """
+    Renders everything before the first id of a response.
+    :param task_parameters: The task parameters of the allocation.
+    :param response_format: One of the RESPONSE_FORMATS keys.
+    :param epoch: The time of the response in seconds since the epoch.
+    :param response_id: The response UUID.
+    :return: The header as a string.
+    """
+    item_qualifier, id_format, encoding_scheme, generation_method = \
+        RESPONSE_FORMATS[response_format]
+    return RESPONSE_HEADER.format(
+        request_id=escape(task_parameters.get('requestId', '')),
+        response_id=escape(response_id),
+        sys_event_id=int(epoch),
+        event_id=escape(task_parameters.get('eventId', '')),
+        item_qualifier=item_qualifier,
+        pool=escape(task_parameters.get('pool', '')),
+        id_format=id_format,
+        encoding_scheme=encoding_scheme,
+        generation_method=generation_method,
+    )
+
+
+def render_ids(ids) -> str:
+    """
+    Renders the id elements of a response with a single join.  The ids are
+    only escaped one by one if any of them contains a character that
+    needs escaping.
+    :param ids: The list of ids (URNs).
+    :return: The id elements as a string.
+    """
+    if not ids:
+        return ''
+    joined = ''.join(ids)
+    if any(character in joined for character in ESCAPED_CHARACTERS):
+        ids = [str(escape(id)) for id in ids]
+    return ''.join((ID_PREFIX, ID_SEPARATOR.join(ids), ID_SUFFIX))
+
+
+def build_response(ids, task_parameters: dict, response_format: str,
+                   epoch: float, response_id: str) -> str:
+    """
+    Builds a syncAllocateTraceIdsResponse identical to the output of the
+    matching template rendered by the quartet_templates TemplateStep.
+    :param ids: The list of ids (URNs).
+    :param task_parameters: The task parameters of the allocation.
+    :param response_format: One of the RESPONSE_FORMATS keys.
+    :param epoch: The time of the response in seconds since the epoch.
+    :param response_id: The response UUID.
+    :return: The response XML.
+    """
+    return ''.join((
+        render_header(task_parameters, response_format, epoch, response_id),
+        render_ids(ids),
+        RESPONSE_FOOTER
+    ))
+
+
+def build_urn_response(numbers, urn_prefix: str, task_parameters: dict,
+                       response_format: str, epoch: float, response_id: str,
+                       serial_number_length: int = None,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """
+    Builds a syncAllocateTraceIdsResponse directly from serialbox numbers.
+    The numbers are turned into URNs a chunk at a time and written to the
+    response so that the full list of URNs is never built.
+    :param numbers: An iterable of serial numbers (ints).
+    :param urn_prefix: Everything in the URN before the serial number, for
+    example urn:epc:id:sgtin:0342195.130809.
+    :param task_parameters: The task parameters of the allocation.
+    :param response_format: One of the RESPONSE_FORMATS keys.
+    :param epoch: The time of the response in seconds since the epoch.
+    :param response_id: The response UUID.
+    :param serial_number_length: If supplied, serial numbers are zero
+    padded to this length.
+    :param chunk_size: The number of serial numbers converted at a time.
+    :return: The response XML.
+    """
+    stream = StringIO()
+    stream.write(
+        render_header(task_parameters, response_format, epoch, response_id))
+    urn_prefix = str(escape(urn_prefix))
+    separator = ID_SEPARATOR + urn_prefix
+    numbers = iter(numbers)
+    chunk = list(islice(numbers, chunk_size))
+    while chunk:
+        if serial_number_length:
+            serial_numbers = [str(number).zfill(serial_number_length)
+                              for number in chunk]
+        else:
+            serial_numbers = map(str, chunk)
+        stream.write(ID_PREFIX)
+        stream.write(urn_prefix)
+        stream.write(separator.join(serial_numbers))
+        stream.write(ID_SUFFIX)
+        chunk = list(islice(numbers, chunk_size))
+    stream.write(RESPONSE_FOOTER)
+    return stream.getvalue()
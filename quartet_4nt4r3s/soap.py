@@ -0,0 +1,129 @@
+import logging
+from io import BytesIO
+from django.conf import settings
+from lxml import etree
+
+from quartet_capture.models import Filter, TaskParameter
+
+logger = logging.getLogger(__name__)
+
+SOAP_ENVELOPE_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+WSSE_NS = ('http://docs.oasis-open.org/wss/2004/01/'
+           'oasis-200401-wss-wssecurity-secext-1.0.xsd')
+EPCIS_NS = 'urn:epcglobal:epcis:xsd:1'
+
+SOAP_BODY_TAG = '{%s}Body' % SOAP_ENVELOPE_NS
+USERNAME_TAG = '{%s}Username' % WSSE_NS
+PASSWORD_TAG = '{%s}Password' % WSSE_NS
+EPCIS_DOCUMENT_TAG = '{%s}EPCISDocument' % EPCIS_NS
+
+
+def parse_credentials(message: bytes):
+    """
+    Reads the WS-Security username and password out of a SOAP message
+    incrementally.  Parsing stops as soon as both values are found or the
+    SOAP Body is reached, so the cost does not depend on the size of the
+    EPCIS payload.
+    :param message: The raw SOAP message.
+    :return: A two-tuple of username and password (either may be None).
+    """
+    username = None
+    password = None
+    context = etree.iterparse(BytesIO(message), events=('start', 'end'),
+                              remove_comments=True)
+    for event, element in context:
+        if event == 'start':
+            if element.tag == SOAP_BODY_TAG:
+                break
+            continue
+        if element.tag == USERNAME_TAG:
+            username = element.text
+        elif element.tag == PASSWORD_TAG:
+            password = element.text
+        if username is not None and password is not None:
+            break
+    return username, password
+
+
+def extract_epcis_document(soap_body) -> str:
+    """
+    Pulls the EPCISDocument out of an already parsed SOAP Body element.
+    :param soap_body: The SOAP Body lxml element.
+    :return: The EPCIS document as a string.
+    """
+    epcis_document = etree.tostring(soap_body.find('.//%s' % EPCIS_DOCUMENT_TAG))
+    if isinstance(epcis_document, bytes):
+        epcis_document = epcis_document.decode('utf-8')
+    return epcis_document
+
+
+def unwrap_epcis_document(message) -> str:
+    """
+    Streams through a raw SOAP message (or a bare EPCIS document) and
+    returns the first EPCISDocument found without building the rest of
+    the SOAP tree.
+    :param message: The raw message as bytes, str or a file-like object.
+    :return: The EPCIS document as a string.
+    """
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    if isinstance(message, bytes):
+        message = BytesIO(message)
+    context = etree.iterparse(message, events=('end',),
+                              tag=EPCIS_DOCUMENT_TAG, huge_tree=True)
+    for event, element in context:
+        return etree.tostring(element).decode('utf-8')
+    raise ValueError('No EPCISDocument element was found in the message.')
+
+
+def get_antares_rules(epcis_document: str) -> list:
+    """
+    Looks up the rules that should process an inbound Antares EPCIS
+    document using the DEFAULT_ANTARES_FILTER setting, falling back to
+    the DEFAULT_ANTARES_RULE setting if the filter does not exist.
+    :param epcis_document: The EPCIS document.
+    :return: A list of rule names.
+    """
+    # quartet_capture.tasks loads celery, import it when it's used
+    from quartet_capture.tasks import get_rules_by_filter
+    try:
+        default_filter = getattr(settings, 'DEFAULT_ANTARES_FILTER',
+                                 'Antares')
+        logger.info('Default antares filter is %s', default_filter)
+        rules = get_rules_by_filter(default_filter, epcis_document)
+        logger.info('Rules in filter: %s', rules)
+    except Filter.DoesNotExist:
+        rules = [getattr(settings, 'DEFAULT_ANTARES_RULE', 'EPCIS')]
+        logger.debug('No filter could be found using rule %s.', rules)
+    return rules
+
+
+def queue_epcis_tasks(epcis_document: str, rules: list, user_id: int = None,
+                      run_immediately=False, task_parameters: dict = None):
+    """
+    Creates a task for each of the rules supplied using the EPCIS document
+    as the task data.
+    :param epcis_document: The EPCIS document.
+    :param rules: The names of the rules to create tasks for.
+    :param user_id: The id of the user the message was received from.
+    :param run_immediately: Whether or not to bypass the task queue.
+    :param task_parameters: Names and values of task parameters to add to
+    each task.
+    :return: A list of the created tasks.
+    """
+    from quartet_capture.tasks import create_and_queue_task
+    tasks = []
+    for rule in rules:
+        tasks.append(create_and_queue_task(data=epcis_document,
+                                           rule_name=rule,
+                                           task_type="Input",
+                                           run_immediately=run_immediately,
+                                           initial_status="WAITING",
+                                           task_parameters=[
+                                               TaskParameter(name=name,
+                                                             value=value)
+                                               for name, value in
+                                               (task_parameters or {}).items()
+                                           ],
+                                           user_id=user_id))
+    return tasks
@@ -0,0 +1,174 @@
+"""
+Splits outbound EPCIS documents into smaller documents so large shipments
+can be sent to rfXcel as several processMessages envelopes.  The events
+are kept in document order- commissioning, then aggregation, then
+shipping- and each document repeats the header of the original.
+"""
+import logging
+import queue
+import threading
+from io import BytesIO
+from uuid import uuid4
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+EVENT_LIST_TAG = 'EventList'
+EPC_TAG = 'epc'
+
+# the number of split documents rendered ahead of the transport
+DEFAULT_PIPELINE_DEPTH = 2
+
+
+class EventChunk:
+    """
+    An EPCIS document holding a run of consecutive events from a larger
+    document.
+    """
+
+    def __init__(self, index: int, data: bytes, event_count: int,
+                 epc_count: int):
+        """
+        :param index: The position of the chunk in the original document.
+        :param data: The EPCIS document.
+        :param event_count: The number of events in the document.
+        :param epc_count: The number of EPCs in the document's events.
+        """
+        self.index = index
+        self.data = data
+        self.event_count = event_count
+        self.epc_count = epc_count
+
+
+def _local_name(tag) -> str:
+    return etree.QName(tag).localname if isinstance(tag, str) else ''
+
+
+def _count_epcs(event) -> int:
+    return sum(1 for element in event.iter()
+               if _local_name(element.tag) == EPC_TAG)
+
+
+def _make_wrapper(root, header, event_list):
+    """
+    Builds a copy of the document's root element and header holding an
+    empty EventList and splits its serialized form into the text before
+    and after the events.
+    """
+    marker = uuid4().hex
+    new_root = etree.Element(root.tag, attrib=dict(root.attrib),
+                             nsmap=root.nsmap)
+    if header is not None:
+        new_root.append(header)
+    body = etree.SubElement(new_root, event_list.getparent().tag)
+    new_list = etree.SubElement(body, event_list.tag)
+    new_list.append(etree.Comment(marker))
+    prefix, _, suffix = etree.tostring(
+        new_root, xml_declaration=False, encoding='utf-8'
+    ).partition(('<!--%s-->' % marker).encode())
+    return prefix, suffix
+
+
+def split_document(data, max_events: int = None, max_epcs: int = None,
+                   max_bytes: int = None):
+    """
+    Streams through an EPCIS document and yields EventChunks, none of which
+    exceeds the limits supplied unless a single event does on its own.
+    :param data: The EPCIS document as bytes, str or a file-like object.
+    :param max_events: The maximum number of events in a chunk.
+    :param max_epcs: The maximum number of EPCs in a chunk.
+    :param max_bytes: The maximum size of the events in a chunk.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray)):
+        data = BytesIO(data)
+    context = etree.iterparse(data, events=('start', 'end'),
+                              huge_tree=True, remove_blank_text=True)
+    root = None
+    header = None
+    wrapper = None
+    events = []
+    epc_count = 0
+    byte_count = 0
+    index = 0
+    for action, element in context:
+        if root is None:
+            root = element
+            continue
+        parent = element.getparent()
+        if action != 'end' or parent is None:
+            continue
+        if parent is root and _local_name(element.tag) != 'EPCISBody':
+            header = element
+            continue
+        if _local_name(parent.tag) != EVENT_LIST_TAG:
+            continue
+        if wrapper is None:
+            wrapper = _make_wrapper(root, header, parent)
+        event = etree.tostring(element)
+        event_epcs = _count_epcs(element)
+        parent.remove(element)
+        limits = (max_events and len(events) + 1 > max_events,
+                  max_epcs and epc_count + event_epcs > max_epcs,
+                  max_bytes and byte_count + len(event) > max_bytes)
+        if events and any(limits):
+            yield EventChunk(index, b''.join([wrapper[0], *events,
+                                              wrapper[1]]),
+                             len(events), epc_count)
+            index += 1
+            events = []
+            epc_count = 0
+            byte_count = 0
+        events.append(event)
+        epc_count += event_epcs
+        byte_count += len(event)
+    if events:
+        yield EventChunk(index, b''.join([wrapper[0]] + events + [wrapper[1]]),
+                         len(events), epc_count)
+
+
+def pipeline(chunks, depth: int = DEFAULT_PIPELINE_DEPTH):
+    """
+    Produces the items of an iterable on a background thread, up to depth
+    items ahead of the consumer, so the next chunk is being split and
+    rendered while the current one is being sent.  Exceptions raised by the
+    iterable are re-raised in the consumer.  The iterable must not use the
+    database.
+    :param chunks: The iterable to consume.
+    :param depth: The number of items produced ahead of the consumer.
+    """
+    items = queue.Queue(maxsize=max(depth, 1))
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    return
+                items.put(chunk)
+        except Exception as e:
+            items.put(e)
+            return
+        items.put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # unblock the producer if it is waiting on a full queue
+        while producer.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
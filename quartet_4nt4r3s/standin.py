@@ -0,0 +1,233 @@
+"""
+A local stand-in for the serialbox allocate endpoint and the rfXcel
+processMessages service, for load testing the Antares endpoints and the
+outbound transport without real upstream systems.  The latency, error rate
+and response size are configurable and the random numbers are seeded so
+runs are reproducible.
+
+Start it with the run_antares_standin management command or from a test:
+
+    with StandInServer(latency=0.05, error_rate=0.01) as server:
+        settings.ANTARES_SERIALBOX_HOST = server.host
+        settings.ANTARES_SERIALBOX_PORT = server.port
+"""
+import logging
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+from django.conf import settings
+
+from quartet_4nt4r3s import rfxcel
+
+logger = logging.getLogger(__name__)
+
+ALLOCATE_PATH = re.compile(r'^/serialbox/allocate/(?P<pool>[^/]+)/'
+                           r'(?P<count>\d+)/?$')
+
+PROCESS_MESSAGES_RESPONSE = (
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><ns4:processMessagesResponse contentStructVer="2.5" '
+    'createDateTime="{created}" requestId="any-request" responseId="" '
+    'xmlns:ns2="http://xmlns.rfxcel.com/traceability/3" '
+    'xmlns:ns4="http://xmlns.rfxcel.com/traceability/messagingService/3">'
+    '<result><ns2:code>2</ns2:code><ns2:msg xml:lang="en">RECEIVED</ns2:msg>'
+    '</result></ns4:processMessagesResponse></soap:Body></soap:Envelope>'
+)
+
+
+def get_defaults() -> dict:
+    """
+    The stand-in options from the ANTARES_STANDIN setting, for example
+    {'latency': 0.05, 'jitter': 0.02, 'error_rate': 0.01,
+    'response_size': 1000, 'seed': 1, 'company_prefix_length': 7}.
+    """
+    return dict(getattr(settings, 'ANTARES_STANDIN', {}))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # the headers and body are separate writes, without this keep alive
+    # responses wait on delayed acks
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        match = ALLOCATE_PATH.match(parsed.path)
+        if not match:
+            return self.send_body(404, b'Not Found', 'text/plain')
+        if self.simulate():
+            return
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        pool = match.group('pool')
+        count = self.server.response_size or int(match.group('count'))
+        body = rfxcel.build_response(
+            self.server.make_ids(pool, count),
+            {'requestId': params.get('requestId', ''),
+             'eventId': params.get('eventId', ''), 'pool': pool},
+            'Random GTIN', time.time(), str(uuid4())
+        ).encode('utf-8')
+        self.send_body(200, body)
+
+    def do_POST(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            body = self.read_chunked()
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.simulate():
+            return
+        if b'processMessages' not in body:
+            return self.send_body(400, b'Expected a processMessages message.',
+                                  'text/plain')
+        self.server.count('messages')
+        self.send_body(200, PROCESS_MESSAGES_RESPONSE.format(
+            created=datetime.now(timezone.utc).isoformat()).encode('utf-8'))
+
+    def simulate(self) -> bool:
+        """
+        Waits out the simulated latency and sends a 503 at the configured
+        error rate.
+        :return: True if an error was sent.
+        """
+        delay, error = self.server.next_outcome()
+        if delay:
+            time.sleep(delay)
+        if error:
+            self.send_body(503, b'Simulated error.', 'text/plain')
+        return error
+
+    def read_chunked(self) -> bytes:
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return b''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def send_body(self, status: int, body: bytes,
+                  content_type: str = 'application/xml'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    The stand-in http server.  Use it as a context manager or call start()
+    and stop() to run it on a background thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = None, jitter: float = None,
+                 error_rate: float = None, response_size: int = None,
+                 seed: int = None, company_prefix_length: int = None):
+        """
+        Options left as None come from the ANTARES_STANDIN setting.
+        :param host: The address to listen on.
+        :param port: The port to listen on, 0 for any free port.
+        :param latency: The seconds to wait before responding.
+        :param jitter: The maximum random seconds added to the latency.
+        :param error_rate: The fraction (0 to 1) of requests answered with
+        a 503.
+        :param response_size: The number of ids in each allocation, no
+        matter how many were requested.
+        :param seed: The seed for the error and jitter random numbers.
+        :param company_prefix_length: The number of digits of the company
+        prefix in the GTIN-14 pool names.  Default is 7.
+        """
+        defaults = get_defaults()
+        self.latency = latency if latency is not None else defaults.get(
+            'latency', 0)
+        self.jitter = jitter if jitter is not None else defaults.get(
+            'jitter', 0)
+        self.error_rate = error_rate if error_rate is not None else \
+            defaults.get('error_rate', 0)
+        self.response_size = response_size or defaults.get('response_size')
+        self.random = random.Random(
+            seed if seed is not None else defaults.get('seed'))
+        self.company_prefix_length = company_prefix_length or defaults.get(
+            'company_prefix_length', 7)
+        self.counts = {'requests': 0, 'errors': 0, 'messages': 0}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._serial = 0
+        super().__init__((host, port), StandInHandler)
+
+    @property
+    def host(self) -> str:
+        return self.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return 'http://%s:%s' % (self.host, self.port)
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def next_outcome(self):
+        """
+        Counts a request and draws its latency and whether it fails.
+        :return: A two-tuple of the seconds to wait and True for an error.
+        """
+        with self._lock:
+            self.counts['requests'] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            error = self.random.random() < self.error_rate
+            if error:
+                self.counts['errors'] += 1
+        return delay, error
+
+    def make_ids(self, pool: str, count: int) -> list:
+        """
+        Returns unique SGTIN or SSCC URNs for a pool named after a GTIN-14
+        or an extension digit and company prefix.
+        """
+        with self._lock:
+            start = self._serial
+            self._serial += count
+        if len(pool) == 14:
+            end = 1 + self.company_prefix_length
+            prefix = 'urn:epc:id:sgtin:%s.%s%s.' % (pool[1:end], pool[0],
+                                                    pool[end:13])
+            return ['%s%d' % (prefix, i) for i in range(start, start + count)]
+        prefix = 'urn:epc:id:sscc:%s.%s' % (pool[1:], pool[:1])
+        width = max(16 - len(pool), 1)
+        return ['%s%0*d' % (prefix, width, i % 10 ** width)
+                for i in range(start, start + count)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        logger.info('Stand-in listening on %s.', self.url)
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
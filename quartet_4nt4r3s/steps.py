@@ -1,59 +1,199 @@
-import io
+import importlib
+from time import time
+from uuid import uuid4
 
-from django.core.files.base import File
+from quartet_capture.rules import RuleContext, Step
+from quartet_4nt4r3s import profiling, rfxcel, soap, tracing
 
-from quartet_epcis.parsing.steps import EPCISParsingStep as EPS
-from quartet_capture.rules import RuleContext
-from quartet_4nt4r3s.conversion import AntaresBarcodeConverter
-from quartet_4nt4r3s.parser import BusinessEPCISParser
-from gs123.steps import ListBarcodeConversionStep
+# the steps that build on heavy packages live in their own modules:
+# parsing_steps loads the quartet_epcis parsers, conversion_steps the gs123
+# steps and output_steps quartet_output, quartet_templates, requests and
+# paramiko.  Rules can still name any of them as quartet_4nt4r3s.steps.<class>,
+# the module __getattr__ below (Python 3.7+) imports it on first use.
+LAZY_STEPS = {
+    'EPCISParsingStep': 'parsing_steps',
+    'AntaresBarcodeConversionStep': 'conversion_steps',
+    'StreamingTemplateStep': 'output_steps',
+    'SOAPEnvelopeTransportStep': 'output_steps',
+    'SplitSOAPEnvelopeTransportStep': 'output_steps',
+    'PooledTransportStep': 'output_steps',
+    'PooledSOAPEnvelopeTransportStep': 'output_steps',
+    'TraceLinkExportStep': 'output_steps',
+}
 
 
-class EPCISParsingStep(EPS):
+def __getattr__(name):
+    if name in LAZY_STEPS:
+        module = importlib.import_module(
+            'quartet_4nt4r3s.%s' % LAZY_STEPS[name])
+        return getattr(module, name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+class EPCISDispatchStep(Step):
+    """
+    Handles raw Antares SOAP messages stored by the EPCIS report view when
+    it is in fast-acknowledge mode.  Unwraps the EPCIS document, selects
+    the rules using the Antares filter and queues a task for each.
+    The `run-immediately` and `user-id` task parameters are supplied by
+    the view.
+    """
+
     def execute(self, data, rule_context: RuleContext):
-        increment_agg_dates = self.get_boolean_parameter(
-            'Increment Aggregation Dates', True)
-        self.info('Increment Aggregation Dates set to %s.', str(increment_agg_dates))
-        self.info('Loose Enforcement of busines rules set to %s',
-                  self.loose_enforcement)
-        self.info('Parsing message %s.dat', rule_context.task_name)
-        try:
-            if isinstance(data, File):
-                parser = BusinessEPCISParser(
-                    data,
-                    increment_agg_dates=increment_agg_dates
-                )
-            else:
-                parser = BusinessEPCISParser(
-                    io.BytesIO(data),
-                    increment_agg_dates=increment_agg_dates
-                )
-        except TypeError:
-            try:
-                parser = BusinessEPCISParser(io.BytesIO(data.encode()))
-            except AttributeError:
-                self.error("Could not convert the data into a format that "
-                           "could be handled.")
-                raise
-        parser.parse()
-        self.info('Parsing complete.')
+        task_parameters = self.get_task_parameters(rule_context)
+        run_immediately = task_parameters.get(
+            'run-immediately', 'False').lower() == 'true'
+        user_id = task_parameters.get('user-id')
+        queued_parameters = {}
+        if task_parameters.get(profiling.PROFILE_PARAMETER,
+                               '').lower() == 'true':
+            queued_parameters.update(profiling.task_parameters())
+        self.info('Unwrapping the EPCIS document from the SOAP message.')
+        with tracing.span('antares.dispatch', task=rule_context.task_name):
+            epcis_document = soap.unwrap_epcis_document(data)
+            rules = soap.get_antares_rules(epcis_document)
+        self.info('Queuing the EPCIS document for rules %s.', rules)
+        with tracing.span('antares.queue', rules=rules):
+            tasks = soap.queue_epcis_tasks(
+                epcis_document, rules, int(user_id) if user_id else None,
+                run_immediately, queued_parameters)
+        self.info('Created tasks %s.', [task.name for task in tasks])
+
+    @property
+    def declared_parameters(self):
+        return {}
+
+    def on_failure(self):
+        pass
+
+
+class RFXCELResponseStep(Step):
+    """
+    Builds the rfXcel syncAllocateTraceIdsResponse for a list of ids
+    without a template.  The output is identical to the templates
+    installed by the create_example_urn_response_rules command.  Set the
+    Response Format step parameter to Random GTIN, Sequential GTIN or
+    Sequential SSCC.
+    """
+
+    def execute(self, data, rule_context: RuleContext):
+        response_format = self.get_response_format()
+        self.info('Building a %s response for %s ids.', response_format,
+                  len(data))
+        return rfxcel.build_response(
+            data,
+            self.get_task_parameters(rule_context),
+            response_format,
+            time(),
+            str(uuid4())
+        )
 
+    def get_response_format(self):
+        response_format = self.get_parameter('Response Format',
+                                             raise_exception=True)
+        if response_format not in rfxcel.RESPONSE_FORMATS:
+            raise ValueError('Unknown response format %s.  Use one of %s.' %
+                             (response_format,
+                              ', '.join(rfxcel.RESPONSE_FORMATS)))
+        return response_format
 
-class AntaresBarcodeConversionStep(ListBarcodeConversionStep):
-    '''
-    Allows the return of the extension digit along with serial number field.
-    '''
+    @property
+    def declared_parameters(self):
+        return {
+            'Response Format': 'Random GTIN, Sequential GTIN or Sequential '
+                               'SSCC.'
+        }
 
-    def convert(self, data):
+    def on_failure(self):
+        pass
+
+
+class RFXCELURNResponseStep(RFXCELResponseStep):
+    """
+    Combines the quartet_integrations ListToUrnConversionStep and the
+    RFXCELResponseStep.  The serialbox numbers are converted to URNs in
+    chunks and written straight into the response, so the full list of
+    URNs is never built.  If the Company Prefix Length step parameter is
+    0 the length is looked up in the master data.
+    """
+
+    def execute(self, data, rule_context: RuleContext):
+        response_format = self.get_response_format()
+        cp_length = self.get_integer_parameter('Company Prefix Length', 0)
+        chunk_size = self.get_integer_parameter('Chunk Size',
+                                                rfxcel.DEFAULT_CHUNK_SIZE)
+        task_parameters = self.get_task_parameters(rule_context)
+        pool = task_parameters['pool']
+        if not cp_length:
+            cp_length = self.get_company_prefix_length(pool)
+        rule_context.context['company_prefix_length'] = cp_length
+        rule_context.context['pool'] = pool
+        serial_number_length = None
+        from gs123.conversion import BarcodeConverter
+        if len(pool) == 14:
+            converter = BarcodeConverter('01%s21%s' % (pool, '000000000001'),
+                                         cp_length)
+            company_prefix = converter.company_prefix
+            urn_prefix = 'urn:epc:id:sgtin:%s.%s%s.' % (
+                company_prefix, converter.indicator_digit,
+                converter.item_reference)
+        else:
+            try:
+                converter = BarcodeConverter('00%s' % pool, cp_length)
+                company_prefix = converter.company_prefix
+                extension_digit = converter.extension_digit
+            except BarcodeConverter.BarcodeNotValid:
+                company_prefix = pool[1:]
+                extension_digit = pool[:1]
+            serial_number_length = 16 - len(company_prefix)
+            urn_prefix = 'urn:epc:id:sscc:%s.%s' % (company_prefix,
+                                                    extension_digit)
+        rule_context.context['company_prefix'] = company_prefix
+        numbers = self.get_number_list(data, pool)
+        self.info('Building a %s response for %s numbers.', response_format,
+                  len(numbers))
+        return rfxcel.build_urn_response(
+            numbers,
+            urn_prefix,
+            task_parameters,
+            response_format,
+            time(),
+            str(uuid4()),
+            serial_number_length,
+            chunk_size
+        )
+
+    def get_company_prefix_length(self, pool: str) -> int:
         """
-        Will convert the data parameter to a urn value and return.
-        Override this to return a different value from the BarcodeConverter.
-        :param data: The barcode value to convert.
-        :return: An EPC URN based on the inbound data.
+        Looks up the company prefix length of the pool's GTIN or SSCC in
+        the master data.
         """
-        prop_val = AntaresBarcodeConverter(
-            data,
-            self.company_prefix_length,
-            self.serial_number_length
-        ).__getattribute__(self.prop_name)
-        return prop_val if isinstance(prop_val, str) else prop_val()
+        from quartet_masterdata.db import DBProxy
+        try:
+            return DBProxy().get_company_prefix_length(pool)
+        except DBProxy.InvalidBarcode:
+            return len(pool) - 1
+
+    def get_number_list(self, numbers, pool: str):
+        """
+        Sequential pools return a start and end number; these are turned
+        into a range.  Any other list is returned as is.
+        """
+        from serialbox.models import Pool
+        if Pool.objects.filter(machine_name=pool,
+                               sequentialregion__active=True).exists():
+            self.info('Sequential pool detected.')
+            return range(int(numbers[0]), int(numbers[1]) + 1)
+        return numbers
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        params.update({
+            'Company Prefix Length': 'The length of the company prefix. If '
+                                     'set to 0 it is looked up in the '
+                                     'master data.',
+            'Chunk Size': 'The number of serial numbers converted at a '
+                          'time. Default is 10000.'
+        })
+        return params
@@ -0,0 +1,284 @@
+"""
+Writes TraceLink EPCIS exports to a binary stream a piece at a time: the
+SBDH header, then each event with its EPC list written in batches, then the
+footer.  Nothing but the current batch of EPCs is held in memory, so
+exports of millions of EPCs can be written to a local file, a pipe or an
+open SFTP file.
+
+The document, its layout and the ObjectEvent come from the packaged
+templates/sftp/TraceLink.xml.  The template is filled in with lxml and split
+at the event list and at the EPC list, so edits to the template show up in
+the exports.
+"""
+import copy
+import logging
+import os
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import islice
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# the number of EPCs formatted and written at a time
+DEFAULT_BATCH_SIZE = 10000
+
+COMMISSIONING = 'urn:epcglobal:cbv:bizstep:commissioning'
+ACTIVE = 'urn:epcglobal:cbv:disp:active'
+
+TRACELINK_TEMPLATE = os.path.join(os.path.dirname(__file__), 'templates',
+                                  'sftp', 'TraceLink.xml')
+
+# put where the template is split, never part of an export
+SPLIT_MARKER = '@@TRACELINK-SPLIT@@'
+
+
+@lru_cache(maxsize=None)
+def get_tracelink_template():
+    """
+    Parses the packaged TraceLink template once.  Use copy_template to get
+    a tree that can be filled in.
+    """
+    return etree.parse(TRACELINK_TEMPLATE)
+
+
+def copy_template():
+    """
+    Returns a copy of the root of the TraceLink template without its
+    xsi:schemaLocation, which points at a local file.
+    """
+    root = copy.deepcopy(get_tracelink_template().getroot())
+    for name in list(root.attrib):
+        if name.endswith('}schemaLocation'):
+            del root.attrib[name]
+    etree.cleanup_namespaces(root)
+    return root
+
+
+def remove_element(element):
+    """
+    Removes an element and the whitespace before it, keeping the
+    indentation of what follows.
+    """
+    previous = element.getprevious()
+    parent = element.getparent()
+    if previous is None:
+        parent.text = element.tail
+    else:
+        previous.tail = element.tail
+    parent.remove(element)
+
+
+def set_text(root, path: str, value: str):
+    """
+    Sets the text of the element at path, or removes the element if there
+    is no value.
+    """
+    element = root.find(path, root.nsmap)
+    if value:
+        element.text = value
+    else:
+        remove_element(element)
+
+
+def render_document(sender_gln: str, receiver_gln: str,
+                    instance_identifier: str,
+                    creation_date: datetime = None):
+    """
+    Renders the document around the events.
+    :return: The document up to the start of the event list and the rest
+    of it after the events.
+    """
+    root = copy_template()
+    creation_date = format_time(creation_date)
+    root.set('creationDate', creation_date)
+    header = root.find('EPCISHeader/sbdh:StandardBusinessDocumentHeader',
+                       root.nsmap)
+    for path, value in (
+            ('sbdh:Sender/sbdh:Identifier', sender_gln),
+            ('sbdh:Receiver/sbdh:Identifier', receiver_gln),
+            ('sbdh:DocumentIdentification/sbdh:InstanceIdentifier',
+             str(instance_identifier)),
+            ('sbdh:DocumentIdentification/sbdh:CreationDateAndTime',
+             creation_date)):
+        header.find(path, root.nsmap).text = value
+    event_list = root.find('EPCISBody/EventList')
+    closing = event_list[-1].tail
+    event_list[:] = []
+    event_list.text = SPLIT_MARKER + closing
+    start, end = etree.tostring(root, encoding='unicode').split(SPLIT_MARKER)
+    declaration = '<?xml version="%s"?>\n' % (
+        get_tracelink_template().docinfo.xml_version)
+    return declaration + start, end + '\n'
+
+
+def render_object_event(event_time: datetime = None,
+                        event_timezone_offset: str = '+00:00',
+                        action: str = 'ADD', biz_step: str = COMMISSIONING,
+                        disposition: str = ACTIVE, read_point: str = None,
+                        biz_location: str = None, lot_number: str = None,
+                        expiration_date: str = None,
+                        packaging_item_code_type: str = 'GTIN-14'):
+    """
+    Renders an ObjectEvent around its EPC list.  Optional elements without
+    a value are left out.
+    :return: The event up to the start of the EPC list, the rest of it
+    after the EPCs and the format of an EPC element.
+    """
+    root = copy_template()
+    event_list = root.find('EPCISBody/EventList')
+    event = event_list.find('ObjectEvent')
+    set_text(event, 'eventTime', format_time(event_time))
+    set_text(event, 'eventTimeZoneOffset', event_timezone_offset)
+    set_text(event, 'action', action)
+    set_text(event, 'bizStep', biz_step)
+    set_text(event, 'disposition', disposition)
+    for path, value in (('readPoint', read_point),
+                        ('bizLocation', biz_location)):
+        if value:
+            set_text(event, path + '/id', value)
+        else:
+            remove_element(event.find(path))
+    if lot_number or expiration_date:
+        set_text(event, 'extension/ilmd/cbvmda:lotNumber', lot_number)
+        set_text(event, 'extension/ilmd/cbvmda:itemExpirationDate',
+                 expiration_date)
+    else:
+        remove_element(event.find('extension'))
+    extensions = event.find('tl:dispositionAssignedEventExtensions',
+                            root.nsmap)
+    if packaging_item_code_type:
+        extensions.find('tl:itemDetail/tl:packagingItemCode',
+                        root.nsmap).set('type', packaging_item_code_type)
+    else:
+        remove_element(extensions)
+    epc_list = event.find('epcList')
+    epc_element = epc_list.text + '<epc>%s</epc>'
+    closing = epc_list[-1].tail
+    epc_list[:] = []
+    epc_list.text = SPLIT_MARKER + closing
+    # the event is cut out of the whole document so it does not get copies
+    # of the namespace declarations
+    text = etree.tostring(root, encoding='unicode')
+    end_tag = '</ObjectEvent>'
+    text = text[text.index('<ObjectEvent'):
+                text.index(end_tag) + len(end_tag)]
+    start, end = text.split(SPLIT_MARKER)
+    return event_list.text + start, end, epc_element
+
+
+def format_time(value: datetime = None) -> str:
+    """
+    Formats a datetime (default now) the way TraceLink expects.
+    """
+    value = value or datetime.now(timezone.utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class TraceLinkWriter:
+    """
+    Writes a TraceLink EPCIS document to a binary stream.  Use it as a
+    context manager or call close() to write the end of the document.
+    """
+
+    def __init__(self, stream, sender_gln: str, receiver_gln: str,
+                 instance_identifier: str, creation_date: datetime = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 encoding: str = 'utf-8'):
+        """
+        :param stream: A binary file-like object to write to.
+        :param sender_gln: The GLN of the sender for the SBDH.
+        :param receiver_gln: The GLN of the receiver for the SBDH.
+        :param instance_identifier: The SBDH instance identifier.
+        :param creation_date: The creation date of the document.
+        :param batch_size: The number of EPCs written at a time.
+        :param encoding: The document encoding.
+        """
+        self.stream = stream
+        self.batch_size = batch_size
+        self.encoding = encoding
+        self.epc_count = 0
+        self.event_count = 0
+        header, self._footer = render_document(
+            sender_gln, receiver_gln, instance_identifier, creation_date)
+        self._write(header)
+
+    def _write(self, text: str):
+        self.stream.write(text.encode(self.encoding))
+
+    def write_object_event(self, epcs, event_time: datetime = None,
+                           event_timezone_offset: str = '+00:00',
+                           action: str = 'ADD',
+                           biz_step: str = COMMISSIONING,
+                           disposition: str = ACTIVE,
+                           read_point: str = None, biz_location: str = None,
+                           lot_number: str = None,
+                           expiration_date: str = None,
+                           packaging_item_code_type: str = 'GTIN-14'):
+        """
+        Writes an ObjectEvent.  The EPCs are consumed and written a batch
+        at a time so they can come from a generator.
+        :param epcs: An iterable of EPC URNs.
+        """
+        start, end, epc_element = render_object_event(
+            event_time, event_timezone_offset, action, biz_step, disposition,
+            read_point, biz_location, lot_number, expiration_date,
+            packaging_item_code_type)
+        self._write(start)
+        epcs = iter(epcs)
+        batch = list(islice(epcs, self.batch_size))
+        while batch:
+            self._write(''.join([epc_element % escape(epc) for epc in batch]))
+            self.epc_count += len(batch)
+            batch = list(islice(epcs, self.batch_size))
+        self._write(end)
+        self.event_count += 1
+
+    def close(self):
+        """
+        Writes the end of the document.  Does not close the stream.
+        """
+        self._write(self._footer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+class LocalSFTPClient:
+    """
+    A stand-in for a paramiko SFTPClient that reads and writes files under
+    a local directory.  Used for file:// endpoints, for example in tests or
+    when the export is picked up by another process.
+    """
+
+    def __init__(self, root: str):
+        """
+        :param root: The local directory remote paths are relative to.
+        """
+        self.root = root
+
+    def _local_path(self, path: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+        root = os.path.normpath(self.root)
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError('The path %s is outside of %s.' % (path,
+                                                                self.root))
+        return path
+
+    def open(self, filename: str, mode: str = 'r', bufsize: int = -1):
+        path = self._local_path(filename)
+        if 'w' in mode or 'a' in mode:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if 'b' not in mode:
+            # like paramiko, files are always binary
+            mode += 'b'
+        return open(path, mode, bufsize)
+
+    def close(self):
+        pass
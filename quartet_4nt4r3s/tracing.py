@@ -0,0 +1,316 @@
+"""
+Correlation ids and timing spans for following one Antares message from
+the view through its tasks, the parse and the output transport.
+
+When the ANTARES_TRACING setting is True:
+
+* the view derives a correlation id from the SOAP requestId (or a uuid),
+* every task created while a correlation id is bound gets it as the
+  `antares-correlation-id` task parameter, so it follows the message into
+  the dispatch, parsing and output tasks,
+* each task and each stage (`antares.report`, `antares.queue`,
+  `antares.dispatch`, `antares.parse`, `antares.transport`) emits a span
+  to the exporter named by the ANTARES_TRACE_EXPORTER setting.
+
+Exporters are classes with an `export(span)` method.  JSONLogExporter (the
+default) logs one JSON object per span to the `quartet_4nt4r3s.tracing`
+logger.  OTLPFileExporter appends OpenTelemetry (OTLP/JSON) lines to the
+file in the ANTARES_TRACE_FILE setting.
+"""
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from uuid import uuid4
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from lxml import etree
+
+from quartet_capture.models import Task, TaskParameter
+
+logger = logging.getLogger(__name__)
+
+CORRELATION_PARAMETER = 'antares-correlation-id'
+DEFAULT_EXPORTER = 'quartet_4nt4r3s.tracing.JSONLogExporter'
+
+# (key, correlation id) pairs for the requests and tasks running in this
+# thread, innermost last, the id may be None
+_bound = contextvars.ContextVar('antares_correlation', default=())
+_exporters = {}
+_exporter_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'ANTARES_TRACING', False)
+
+
+class Span:
+    """
+    A timed stage of the processing of one message.
+    """
+
+    def __init__(self, name: str, correlation_id: str, attributes: dict):
+        self.name = name
+        self.correlation_id = correlation_id
+        self.span_id = uuid4().hex[:16]
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'correlation_id': self.correlation_id,
+            'span_id': self.span_id,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': round(self.duration * 1000, 3),
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class JSONLogExporter:
+    """
+    Logs each span as a JSON object at INFO.
+    """
+
+    def export(self, span: Span):
+        logger.info(json.dumps(span.as_dict(), default=str))
+
+
+class OTLPFileExporter:
+    """
+    Appends each span to a file as an OTLP/JSON `resourceSpans` line that
+    OpenTelemetry collectors and tools can import.  The correlation id is
+    used as the trace id.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or getattr(settings, 'ANTARES_TRACE_FILE',
+                                    'antares-traces.jsonl')
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        otlp_span = {
+            'traceId': _trace_id(span.correlation_id),
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(int(span.start * 1e9)),
+            'endTimeUnixNano': str(int((span.end or time.time()) * 1e9)),
+            'attributes': [
+                {'key': key, 'value': {'stringValue': str(value)}}
+                for key, value in dict(
+                    span.attributes,
+                    **{'antares.correlation_id': span.correlation_id}
+                ).items()
+            ],
+            'status': {'code': 2, 'message': span.error} if span.error
+            else {'code': 1},
+        }
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [{
+                'key': 'service.name',
+                'value': {'stringValue': 'quartet_4nt4r3s'}
+            }]},
+            'scopeSpans': [{'scope': {'name': __name__},
+                            'spans': [otlp_span]}]
+        }]})
+        with self._lock, open(self.path, 'a') as trace_file:
+            trace_file.write(line + os.linesep)
+
+
+def _trace_id(correlation_id: str) -> str:
+    # uuids are used as they are, anything else is hashed so every span of
+    # a message gets the same trace id
+    hex_id = (correlation_id or '').replace('-', '').lower()
+    if len(hex_id) == 32 and all(c in '0123456789abcdef' for c in hex_id):
+        return hex_id
+    return hashlib.md5((correlation_id or '').encode('utf-8')).hexdigest()
+
+
+def get_exporter():
+    """
+    Returns the exporter named by the ANTARES_TRACE_EXPORTER setting, one
+    instance per process.
+    """
+    path = getattr(settings, 'ANTARES_TRACE_EXPORTER', DEFAULT_EXPORTER)
+    with _exporter_lock:
+        exporter = _exporters.get(path)
+        if exporter is None:
+            exporter = _exporters[path] = import_string(path)()
+        return exporter
+
+
+def export(span: Span):
+    try:
+        get_exporter().export(span)
+    except Exception:
+        # tracing must never break the processing of a message
+        logger.exception('Could not export span %s.', span.name)
+
+
+def record(name: str, correlation_id: str, start: float, end: float,
+           **attributes):
+    """
+    Exports a span for a stage that was timed elsewhere.
+    :param start: The start time in seconds since the epoch.
+    :param end: The end time in seconds since the epoch.
+    """
+    if not is_enabled():
+        return
+    recorded = Span(name, correlation_id, attributes)
+    recorded.start = start
+    recorded.end = end
+    export(recorded)
+
+
+def bind(key: str, correlation_id: str):
+    """
+    Makes a correlation id current for this thread until unbind is called
+    with the same key.
+    :param key: The name of the task or request binding the id.
+    :param correlation_id: The correlation id, may be None.
+    """
+    others = tuple(b for b in _bound.get() if b[0] != key)
+    _bound.set(others + ((key, correlation_id),))
+
+
+def unbind(key: str):
+    _bound.set(tuple(b for b in _bound.get() if b[0] != key))
+
+
+def current_correlation_id():
+    """
+    Returns the innermost bound correlation id, None if nothing is bound or
+    the innermost binding has no id.  A task without a correlation id does
+    not pass on the id of the request or task that is running it.
+    """
+    bindings = _bound.get()
+    return bindings[-1][1] if bindings else None
+
+
+@contextmanager
+def bound(correlation_id: str):
+    """
+    Binds a correlation id for the duration of a with block.
+    """
+    key = uuid4().hex
+    bind(key, correlation_id)
+    try:
+        yield correlation_id
+    finally:
+        unbind(key)
+
+
+@contextmanager
+def span(name: str, correlation_id: str = None, **attributes):
+    """
+    Times a with block and exports it as a span if tracing is enabled.
+    :param name: The name of the stage.
+    :param correlation_id: Defaults to the current correlation id.
+    :param attributes: Any extra values to record.
+    """
+    if not is_enabled():
+        yield None
+        return
+    current = Span(name, correlation_id or current_correlation_id(),
+                   attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = '%s: %s' % (type(e).__name__, e)
+        raise
+    finally:
+        current.end = time.time()
+        export(current)
+
+
+class TracedTransportMixin:
+    """
+    Records an `antares.transport` span for each message a TransportStep
+    sends.  Put this ahead of the TransportStep in the bases of a step.
+    """
+
+    def _send_message(self, data, protocol, rule_context, output_criteria):
+        with span('antares.transport', task=rule_context.task_name,
+                  protocol=protocol):
+            return super()._send_message(data, protocol, rule_context,
+                                         output_criteria)
+
+
+def get_correlation_id(task: Task):
+    """
+    Returns the correlation id of a task or None.
+    """
+    return TaskParameter.objects.filter(
+        task=task, name=CORRELATION_PARAMETER
+    ).values_list('value', flat=True).first()
+
+
+def get_request_id(message: bytes) -> str:
+    """
+    Returns the requestId attribute of the first element in the SOAP Body
+    of a message, reading no further than that element, or a new uuid if
+    there isn't one.
+    :param message: The raw SOAP message.
+    """
+    try:
+        in_body = False
+        for event, element in etree.iterparse(BytesIO(message),
+                                              events=('start',)):
+            if in_body:
+                request_id = element.get('requestId')
+                if request_id:
+                    return request_id
+                break
+            in_body = etree.QName(element).localname == 'Body'
+    except etree.XMLSyntaxError:
+        pass
+    return str(uuid4())
+
+
+def on_task_saved(sender, instance: Task, created: bool, **kwargs):
+    """
+    Task post_save handler.  New tasks inherit the current correlation id
+    and running tasks bind theirs.  A task is unbound by the first save
+    that moves it out of RUNNING, including the QUEUED of a task that ran
+    out of time.  The span for the time it ran is exported by the save
+    that sets its end time, failed and timed out tasks are saved with their
+    new status before that.
+    """
+    if not is_enabled():
+        return
+    if created:
+        correlation_id = current_correlation_id()
+        if correlation_id:
+            TaskParameter.objects.get_or_create(
+                task=instance, name=CORRELATION_PARAMETER,
+                defaults={'value': correlation_id,
+                          'description': 'The correlation id of the '
+                                         'Antares message.'})
+    elif instance.status == 'RUNNING':
+        bind(instance.name, get_correlation_id(instance))
+    else:
+        unbind(instance.name)
+        # start and end are only set on the instance that ran the task
+        start = getattr(instance, 'start', None)
+        end = getattr(instance, 'end', None)
+        if start and end and end >= start:
+            correlation_id = get_correlation_id(instance)
+            if correlation_id:
+                record('task', correlation_id, start.timestamp(),
+                       end.timestamp(), task=instance.name,
+                       rule=instance.rule_id, status=instance.status)
@@ -0,0 +1,185 @@
+"""
+Pooled http transport for outbound Antares and rfXcel messages.  Every
+endpoint gets one shared `requests.Session` per process, so connections
+are kept alive between messages, and a semaphore that bounds the number of
+concurrent posts to it.  The sessions keep no cookies, since messages
+for different senders share them, and forked processes (Celery prefork
+workers) start with no sessions so they never share a connection with
+their parent.
+"""
+import logging
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from requests.adapters import HTTPAdapter
+
+from quartet_capture.models import Task, TaskParameter
+from quartet_output.transport.http import HttpTransportMixin, user_agent
+
+logger = logging.getLogger(__name__)
+
+COALESCED_PARAMETER = 'antares-coalesced-by'
+
+_lock = threading.Lock()
+_sessions = {}
+_semaphores = {}
+
+
+def _endpoint_key(urn: str) -> str:
+    parse_result = urlparse(urn)
+    return '%s://%s' % (parse_result.scheme.lower(),
+                        parse_result.netloc.lower())
+
+
+def get_concurrency() -> int:
+    """
+    The maximum number of concurrent posts to a single endpoint.
+    """
+    return getattr(settings, 'ANTARES_TRANSPORT_CONCURRENCY', 4)
+
+
+def get_session(urn: str) -> requests.Session:
+    """
+    Returns the shared session for the endpoint (scheme and host) of the
+    urn, creating it on first use.
+    :param urn: The endpoint url.
+    """
+    key = _endpoint_key(urn)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            pool_size = getattr(settings, 'ANTARES_TRANSPORT_POOL_SIZE',
+                                max(get_concurrency(), 10))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['user-agent'] = user_agent
+            session.cookies.set_policy(DefaultCookiePolicy(
+                allowed_domains=[]))
+            _sessions[key] = session
+        return session
+
+
+def get_semaphore(urn: str) -> threading.BoundedSemaphore:
+    """
+    Returns the semaphore bounding the concurrent posts to the endpoint of
+    the urn.
+    :param urn: The endpoint url.
+    """
+    key = _endpoint_key(urn)
+    with _lock:
+        semaphore = _semaphores.get(key)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(get_concurrency())
+            _semaphores[key] = semaphore
+        return semaphore
+
+
+def close_sessions():
+    """
+    Closes and forgets all of the shared sessions.
+    """
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _after_fork():
+    global _lock
+    # the parent's connections and a lock it may have held are unusable
+    _lock = threading.Lock()
+    _sessions.clear()
+    _semaphores.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class PooledHttpTransportMixin(HttpTransportMixin):
+    """
+    Posts and puts data through the shared session of the endpoint while
+    holding its semaphore.  Put this ahead of the TransportStep in the
+    bases of a step.
+    """
+
+    def post_data(self, data, rule_context, output_criteria,
+                  content_type='application/xml', file_extension='xml',
+                  http_put=False, body_raw=True):
+        urn = output_criteria.end_point.urn
+        if body_raw:
+            files = data
+        elif http_put:
+            files = {'file': ('{0}.{1}'.format(rule_context.task_name,
+                                               file_extension), data)}
+        else:
+            files = {'file': data}
+        session = get_session(urn)
+        func = session.put if http_put else session.post
+        with get_semaphore(urn):
+            logger.debug('Sending data for task %s to %s.',
+                         rule_context.task_name, urn)
+            return func(urn, files, auth=self.get_auth(output_criteria),
+                        headers={'content-type': content_type})
+
+
+def claim_queued_tasks(task: Task, criteria_name: str, limit: int) -> list:
+    """
+    Claims QUEUED tasks of the same rule that send to the same output
+    criteria so their messages can be sent by the task running now.  A
+    claimed task is set to RUNNING and marked with the name of the
+    claiming task so it is skipped if it is executed later.
+    :param task: The running task.
+    :param criteria_name: The name of the EPCIS output criteria.
+    :param limit: The maximum number of tasks to claim.
+    :return: A list of the claimed tasks, oldest first.
+    """
+    names = TaskParameter.objects.filter(
+        task__rule=task.rule, task__status='QUEUED',
+        name='EPCIS Output Criteria', value=criteria_name
+    ).exclude(task=task).order_by(
+        'task__status_changed').values_list('task__name', flat=True)[:limit]
+    claimed = []
+    for name in names:
+        with transaction.atomic():
+            queued = Task.objects.filter(name=name, status='QUEUED')
+            if not queued.update(status='RUNNING'):
+                # another worker got to it first
+                continue
+            TaskParameter.objects.create(
+                task_id=name, name=COALESCED_PARAMETER, value=task.name,
+                description='The task that sent this message.')
+        claimed.append(Task.objects.get(name=name))
+    return claimed
+
+
+def release_task(task: Task, status: str):
+    """
+    Sets the final status of a claimed task.  Failed tasks lose their
+    coalesced marker so they are sent again if they are restarted.
+    :param task: A task returned by claim_queued_tasks.
+    :param status: FINISHED or FAILED.
+    """
+    if status != 'FINISHED':
+        TaskParameter.objects.filter(task=task,
+                                     name=COALESCED_PARAMETER).delete()
+    task.status = status
+    task.save()
+
+
+def get_coalesced_by(task: Task):
+    """
+    Returns the name of the task that already sent this task's message or
+    None.
+    :param task: The task being executed.
+    """
+    return TaskParameter.objects.filter(
+        task=task, name=COALESCED_PARAMETER
+    ).values_list('value', flat=True).first()
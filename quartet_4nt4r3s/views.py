@@ -1,26 +1,41 @@
+import hashlib
 import logging
-import requests
 import uuid
+from contextlib import contextmanager
 from django.conf import settings
 from django.contrib.auth import authenticate
+from django.http import HttpResponse, StreamingHttpResponse
 from django.template import loader
 from io import BytesIO
-from lxml import etree
-from requests.auth import HTTPBasicAuth
 from rest_framework import status
 from rest_framework import views
 from rest_framework.negotiation import DefaultContentNegotiation
 from rest_framework.response import Response
 from rest_framework import exceptions
 
-from list_based_flavorpack.models import ProcessingParameters
-from quartet_capture.models import Filter
-from quartet_capture.tasks import create_and_queue_task, get_rules_by_filter
-from serialbox.models import Pool
+from quartet_capture.errors import RuleNotFound
+from quartet_capture.models import TaskParameter
+
+from quartet_4nt4r3s import coalescing, profiling, replay, soap, tracing
 
 logger = logging.getLogger(__name__)
 
 
+def get_serialbox_url(scheme: str = 'http') -> str:
+    """
+    Returns the scheme, host and port of serialbox from the
+    ANTARES_SERIALBOX_SCHEME, ANTARES_SERIALBOX_HOST and
+    ANTARES_SERIALBOX_PORT settings, e.g. http://127.0.0.1:8000.
+    :param scheme: The scheme if ANTARES_SERIALBOX_SCHEME is not set.
+    """
+    scheme = getattr(settings, 'ANTARES_SERIALBOX_SCHEME', scheme)
+    host = getattr(settings, 'ANTARES_SERIALBOX_HOST', '127.0.0.1')
+    port = getattr(settings, 'ANTARES_SERIALBOX_PORT', None)
+    if port:
+        return '%s://%s:%s' % (scheme, host, port)
+    return '%s://%s' % (scheme, host)
+
+
 class DefaultXMLContent(DefaultContentNegotiation):
 
     def select_renderer(self, request, renderers, format_suffix):
@@ -66,6 +81,34 @@ class AntaresAPI(views.APIView):
         else:
             return None
 
+    def profile_requested(self, request) -> bool:
+        """
+        Whether the `profile` query parameter is true and the request comes
+        from a staff user, either the authenticated request user or the
+        user in the SOAP credentials.
+        """
+        if str(request.query_params.get('profile')).lower() != 'true':
+            return False
+        user = request.user if request.user.is_authenticated else \
+            self.auth_user(*soap.parse_credentials(request.body))
+        if user and user.is_staff:
+            return True
+        logger.warning('Ignoring a profile request from a non staff user.')
+        return False
+
+    @contextmanager
+    def profiling(self, request, name: str):
+        """
+        Profiles the request if profile_requested is True.
+        :return: Whether or not the request is being profiled.
+        """
+        self.profiled = self.profile_requested(request)
+        if not self.profiled:
+            yield False
+            return
+        with profiling.profile('%s-%s' % (name, uuid.uuid4().hex)):
+            yield True
+
 
 class AntaresNumberRequest(AntaresAPI):
     """
@@ -85,19 +128,35 @@ class AntaresNumberRequest(AntaresAPI):
     For instance a pool.machine_name equal to 10342195308095 would be matched if the itemId in the inbound xml
     is the following:
      <ns:itemId qlfr="GTIN">10342195308095</ns:itemId>
+
+    If the `pass-through` query parameter (or the ANTARES_PASS_THROUGH
+    setting) is true, the serialbox response is streamed back to the
+    client as is, with its original status code and content type.  A staff
+    user can add `profile=true` to profile the request.
+
+    With the ANTARES_COALESCE_WINDOW setting, concurrent requests for the
+    same pool share one serialbox allocation, see
+    quartet_4nt4r3s.coalescing.  With the ANTARES_REPLAY_RETENTION setting,
+    a retried eventId gets the original response back, or waits while the
+    original is still being allocated, see quartet_4nt4r3s.replay.
     """
 
     def post(self, request, format=None):
+        with self.profiling(request, 'number-request'):
+            return self.process_request(request)
+
+    def process_request(self, request):
+        from lxml import etree
+        from serialbox.models import Pool
+        reservation = replay.Reservation()
         try:
             root = etree.iterparse(BytesIO(request.body), events=('end',),
                                    remove_comments=True)
             parsed_data = self.parse_root(root)
             username = parsed_data.get('username')
             password = parsed_data.get('password')
-            scheme = getattr(settings, 'ANTARES_SERIALBOX_SCHEME', request.scheme)
-            host = getattr(settings, 'ANTARES_SERIALBOX_HOST', '127.0.0.1')
-            port = getattr(settings, 'ANTARES_SERIALBOX_PORT', None)
-            logger.debug('Using scheme, host, port %s, %s, %s', scheme, host, port)
+            serialbox_url = get_serialbox_url(request.scheme)
+            logger.debug('Using serialbox at %s', serialbox_url)
             id_count = parsed_data.get('count')
 
             if parsed_data.get('is_gtin'):
@@ -105,30 +164,137 @@ class AntaresNumberRequest(AntaresAPI):
             elif parsed_data.get('is_sscc'):
                 item_id = '{0}{1}'.format(parsed_data.get('extension_digit'),parsed_data.get('company_prefix'))
 
+            event_id = parsed_data.get('event_id')
+            try:
+                reservation = replay.reserve(username, password, event_id)
+            except replay.AllocationInProgress as e:
+                logger.info(str(e))
+                return Response(str(e), status.HTTP_503_SERVICE_UNAVAILABLE)
+            if reservation.replayed:
+                logger.info('Replaying the response to event %s.', event_id)
+                return self.replay_response(reservation.replayed)
             pool = self.match_item_with_pool_machine_name(item_id)
             if not pool:
                 # match region/pool with item_id.
                 pool = self.match_item_with_param(item_id)
-            event_id = parsed_data.get('event_id')
             payload = {'format': 'xml', 'eventId': event_id, 'requestId': event_id}
-            if not port:
-                url = "%s://%s/serialbox/allocate/%s/%d/?format=xml" % (
-                    scheme, host, pool.machine_name, int(id_count))
-            else:
-                url = "%s://%s:%s/serialbox/allocate/%s/%d/?format=xml" % (
-                    scheme, host, port, pool.machine_name, int(id_count))
-            api_response = requests.get(url, params=payload,
-                                        auth=HTTPBasicAuth(username, password),
-                                        verify=False)
+            pass_through = str(request.query_params.get(
+                'pass-through',
+                getattr(settings, 'ANTARES_PASS_THROUGH', False)
+            )).lower() == 'true'
+            # the transport loads requests, don't load it with the views
+            from quartet_4nt4r3s import transport
+            session = transport.get_session(serialbox_url)
+
+            def allocate(count, stream=False):
+                url = "%s/serialbox/allocate/%s/%d/?format=xml" % (
+                    serialbox_url, pool.machine_name, count)
+                return session.get(url, params=payload,
+                                   auth=(username, password),
+                                   verify=False, stream=stream)
+
+            coalesced = None
+            if coalescing.coalescer.coalesces(pool):
+                coalesced = coalescing.coalescer.allocate(
+                    (serialbox_url, pool.machine_name, username,
+                     hashlib.sha256((password or '').encode()).hexdigest()),
+                    int(id_count), event_id, allocate)
+            if coalesced:
+                if coalesced.status == 200:
+                    reservation.complete(coalesced.body,
+                                         coalesced.content_type, pass_through)
+                else:
+                    reservation.release()
+                # answered the same way as a request sent on its own
+                if pass_through:
+                    return HttpResponse(coalesced.body,
+                                        status=coalesced.status,
+                                        content_type=coalesced.content_type)
+                return Response(coalesced.body.decode('utf-8'),
+                                coalesced.status)
+            api_response = allocate(int(id_count), stream=pass_through)
             logger.debug(api_response)
-            ret = Response(api_response.text, api_response.status_code)
+            content_type = api_response.headers.get('Content-Type',
+                                                    'application/xml')
+
+            def store(body):
+                if body is not None and api_response.status_code == 200:
+                    reservation.complete(body, content_type, pass_through)
+                else:
+                    reservation.release()
+
+            if pass_through:
+                ret = self.stream_response(
+                    api_response,
+                    store if reservation.number_response else None)
+            else:
+                store(api_response.content)
+                ret = Response(api_response.text, api_response.status_code)
         except Pool.DoesNotExist as pdn:
+            reservation.release()
             raise exceptions.NotFound(str(pdn))
         except Exception as e:
+            reservation.release()
             raise exceptions.APIException(str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return ret
 
+    def stream_response(self, api_response, on_complete=None):
+        """
+        Streams the raw serialbox response to the client without decoding
+        or re-rendering it.  The upstream connection is closed once the
+        body has been sent or the client goes away.
+        :param on_complete: If supplied, called with the whole body once
+        it has been read, or with None if it could not be.  If the client
+        goes away first, the rest of the body is read for it anyway.
+        """
+        chunk_size = getattr(settings, 'ANTARES_PASS_THROUGH_CHUNK_SIZE',
+                             65536)
+        content = iter(api_response.iter_content(chunk_size))
+
+        def stream():
+            chunks = []
+            body = None
+            try:
+                for chunk in content:
+                    if on_complete:
+                        chunks.append(chunk)
+                    yield chunk
+                body = b''.join(chunks)
+            except GeneratorExit:
+                if on_complete:
+                    # the ids are allocated all the same, keep them for
+                    # the retry
+                    try:
+                        chunks.extend(content)
+                        body = b''.join(chunks)
+                    except Exception:
+                        logger.exception('Could not read the rest of the '
+                                         'serialbox response.')
+                raise
+            finally:
+                api_response.close()
+                if on_complete:
+                    on_complete(body)
+
+        return StreamingHttpResponse(
+            stream(),
+            status=api_response.status_code,
+            content_type=api_response.headers.get('Content-Type',
+                                                  'application/xml')
+        )
+
+    def replay_response(self, number_response):
+        """
+        Returns a stored response the way the original was returned.
+        :param number_response: A quartet_4nt4r3s.models.NumberResponse.
+        """
+        body = bytes(number_response.body)
+        if number_response.pass_through:
+            return HttpResponse(body,
+                                content_type=number_response.content_type)
+        return Response(body.decode('utf-8'), status.HTTP_200_OK)
+
     def parse_root(self, root):
         parsed_data = {'is_gtin': False, 'is_sscc': False}
         for event, element in root:
@@ -164,6 +330,7 @@ class AntaresNumberRequest(AntaresAPI):
         print('parse_body called')
 
     def match_item_with_param(self, item_id):
+        from list_based_flavorpack.models import ProcessingParameters
         try:
             return ProcessingParameters.objects.get(key="item_value",
                                                     value=item_id).list_based_region.pool
@@ -171,6 +338,7 @@ class AntaresNumberRequest(AntaresAPI):
             return None
 
     def match_item_with_pool_machine_name(self, item_id):
+        from serialbox.models import Pool
         return Pool.objects.get(machine_name=item_id)
 
 
@@ -180,10 +348,48 @@ class AntaresEPCISReport(AntaresAPI):
     Takes in a SOAP request with an EPCIS report,
     tosses away the SOAP piece and saves the EPCIS document to a file,
     also kicks off a rule.
+
+    If the `fast-acknowledge` query parameter (or the
+    ANTARES_FAST_ACKNOWLEDGE setting) is true, only the SOAP header is
+    parsed to authenticate the sender.  The raw message is then stored
+    in a task for the ANTARES_DISPATCH_RULE and RECEIVED is returned
+    right away; unwrapping the EPCIS document and rule selection happen
+    in that task.
+
+    With the ANTARES_TRACING setting the SOAP requestId becomes the
+    correlation id of the tasks created for the message.  A staff user can
+    add `profile=true` to profile the request and the tasks it creates.
     """
 
     def post(self, request, format=None):
+        with self.profiling(request, 'report'):
+            if not tracing.is_enabled():
+                return self.process_report(request)
+            with tracing.bound(tracing.get_request_id(request.body)):
+                with tracing.span('antares.report', size=len(request.body)):
+                    return self.process_report(request)
+
+    def process_report(self, request):
+        run_immediately = str(request.query_params.get(
+            'run-immediately', False)).lower() == 'true'
+        fast_acknowledge = request.query_params.get(
+            'fast-acknowledge',
+            getattr(settings, 'ANTARES_FAST_ACKNOWLEDGE', False))
+        if str(fast_acknowledge).lower() == 'true':
+            username, password = soap.parse_credentials(request.body)
+            user = self.auth_user(username=username, password=password)
+            if user:
+                try:
+                    self.queue_dispatch_task(request.body, user,
+                                             run_immediately)
+                    return self.received_response()
+                except RuleNotFound:
+                    logger.warning('The Antares dispatch rule could not be '
+                                   'found, unwrapping the message inline.')
+            else:
+                return self.unauthorized_response()
         # get the message from the request
+        from lxml import etree
         root = etree.fromstring(request.body)
         header = root.find('{http://schemas.xmlsoap.org/soap/envelope/}Header')
         body = root.find('{http://schemas.xmlsoap.org/soap/envelope/}Body')
@@ -193,42 +399,59 @@ class AntaresEPCISReport(AntaresAPI):
                                      './/{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}Password')
         user = self.auth_user(username=username, password=password)
         if user:
-            data = {"uuid_msg_id": uuid.uuid1(),
-                    "created_date_time": "2018-10-10"}
-            template = loader.get_template("soap/received.xml")
-            xml = template.render(data)
-            run_immediately = request.query_params.get('run-immediately',
-                                                       False)
             self.trigger_epcis_task(body, user, run_immediately)
-            return Response(xml, status=status.HTTP_200_OK)
+            return self.received_response()
         else:
-            template = loader.get_template("soap/unauthorized.xml")
-            xml = template.render({})
-            return Response(xml, status=status.HTTP_401_UNAUTHORIZED)
+            return self.unauthorized_response()
+
+    def received_response(self):
+        data = {"uuid_msg_id": uuid.uuid1(),
+                "created_date_time": "2018-10-10"}
+        template = loader.get_template("soap/received.xml")
+        xml = template.render(data)
+        return Response(xml, status=status.HTTP_200_OK)
+
+    def unauthorized_response(self):
+        template = loader.get_template("soap/unauthorized.xml")
+        xml = template.render({})
+        return Response(xml, status=status.HTTP_401_UNAUTHORIZED)
 
     def trigger_epcis_task(self, soap_body, user, run_immediately=False):
         """
         Triggers an EPCIS rule task using the EPCISDocument.
         """
-        epcis_document = etree.tostring(
-            soap_body.find('.//{urn:epcglobal:epcis:xsd:1}EPCISDocument'))
-        if isinstance(epcis_document, bytes):
-            epcis_document = epcis_document.decode('utf-8')
-        try:
-            default_filter = getattr(settings, 'DEFAULT_ANTARES_FILTER',
-                                     'Antares')
-            logger.info('Default antares filter is %s', default_filter)
-            rules = get_rules_by_filter(default_filter, epcis_document)
-            logger.info('Rules in filter: %', rules)
-        except Filter.DoesNotExist:
-            rules = [getattr(settings, 'DEFAULT_ANTARES_RULE', 'EPCIS')]
-            logger.debug('No filter could be found using rule %s.', rules)
-
-        for rule in rules:
-            create_and_queue_task(data=epcis_document,
-                                  rule_name=rule,
+        epcis_document = soap.extract_epcis_document(soap_body)
+        rules = soap.get_antares_rules(epcis_document)
+        with tracing.span('antares.queue', rules=rules):
+            soap.queue_epcis_tasks(epcis_document, rules, user.id,
+                                   run_immediately, self.task_parameters())
+
+    def task_parameters(self) -> dict:
+        """
+        Extra task parameters for the tasks created for the message.
+        """
+        return profiling.task_parameters() if getattr(
+            self, 'profiled', False) else {}
+
+    def queue_dispatch_task(self, message, user, run_immediately=False):
+        """
+        Stores the raw SOAP message in a task for the Antares dispatch rule
+        which will unwrap the EPCIS document and queue the EPCIS rules.
+        """
+        task_parameters = [
+            TaskParameter(name='run-immediately', value=str(run_immediately)),
+            TaskParameter(name='user-id', value=str(user.id)),
+        ] + [TaskParameter(name=name, value=value)
+             for name, value in self.task_parameters().items()]
+        rule_name = getattr(settings, 'ANTARES_DISPATCH_RULE',
+                            'Antares EPCIS Dispatch')
+        # quartet_capture.tasks loads celery, import it when it's used
+        from quartet_capture.tasks import create_and_queue_task
+        with tracing.span('antares.queue', rules=[rule_name]):
+            create_and_queue_task(data=message,
+                                  rule_name=rule_name,
                                   task_type="Input",
                                   run_immediately=run_immediately,
                                   initial_status="WAITING",
-                                  task_parameters=[],
+                                  task_parameters=task_parameters,
                                   user_id=user.id)
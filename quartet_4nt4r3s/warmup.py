@@ -0,0 +1,196 @@
+"""
+Pre-warms the code paths of the Antares views and steps when a process
+starts, so the first number request or EPCIS report after a deploy or a
+worker restart is not much slower than the ones after it.
+
+The ANTARES_WARM_UP setting turns it on.  True runs every stage, a list
+of stage names runs only those:
+
+* `imports` - the views, steps and quartet_capture.tasks modules, which
+  are otherwise loaded by the first request or task,
+* `templates` - the SOAP response templates,
+* `lxml` - parses a rendered SOAP response the way the views parse
+  inbound messages,
+* `serialbox` - opens the shared session and a connection to the
+  serialbox at ANTARES_SERIALBOX_HOST,
+* `pools` - runs the pool resolution of the number request view,
+* `rules` - runs the Antares filter and rule resolution.
+
+Only `imports` and `templates` run when Django starts.  The other stages
+use the database or open connections, which a preforking server or the
+celery prefork pool would share with its children (the transport drops
+the parent's sessions after a fork anyway).  They run once in each
+process, before its first request (request_started) or when a celery
+worker process starts (worker_process_init).
+
+A stage that fails is logged and skipped, it never stops the process from
+starting.  The time each stage took is logged at INFO.
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.template import loader
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('imports', 'templates', 'lxml', 'serialbox', 'pools', 'rules')
+# the stages that are safe to run before the process forks
+STARTUP_STAGES = ('imports', 'templates')
+DISPATCH_UID = 'antares-warm-up'
+
+_warmed = False
+_lock = threading.Lock()
+
+MODULES = (
+    'quartet_capture.tasks',
+    'quartet_4nt4r3s.views',
+    'quartet_4nt4r3s.steps',
+    'quartet_4nt4r3s.output_steps',
+)
+
+TEMPLATES = ('soap/received.xml', 'soap/unauthorized.xml')
+
+
+def get_stages() -> tuple:
+    """
+    The stages named by the ANTARES_WARM_UP setting.
+    """
+    value = getattr(settings, 'ANTARES_WARM_UP', False)
+    if value is True:
+        return STAGES
+    return tuple(value or ())
+
+
+def warm_imports():
+    for module in MODULES:
+        importlib.import_module(module)
+
+
+def warm_templates():
+    for template_name in TEMPLATES:
+        loader.get_template(template_name)
+
+
+def warm_lxml():
+    from quartet_4nt4r3s import tracing
+    message = loader.render_to_string(
+        'soap/received.xml',
+        {'uuid_msg_id': 'warm-up', 'created_date_time': 'warm-up'}
+    ).encode('utf-8')
+    etree.fromstring(message)
+    for event, element in etree.iterparse(BytesIO(message), events=('end',),
+                                          remove_comments=True):
+        pass
+    tracing.get_request_id(message)
+
+
+def warm_serialbox():
+    from quartet_4nt4r3s import transport
+    from quartet_4nt4r3s.views import get_serialbox_url
+    url = get_serialbox_url()
+    response = transport.get_session(url).get(
+        '%s/serialbox/' % url, verify=False,
+        timeout=getattr(settings, 'ANTARES_WARM_UP_TIMEOUT', 5))
+    # any response will do, the connection stays in the session's pool
+    response.close()
+
+
+def warm_pools():
+    from serialbox.models import Pool
+    from quartet_4nt4r3s.views import AntaresNumberRequest
+    view = AntaresNumberRequest()
+    machine_name = Pool.objects.values_list('machine_name',
+                                            flat=True).first()
+    if machine_name:
+        view.match_item_with_param(machine_name)
+        view.match_item_with_pool_machine_name(machine_name)
+
+
+def warm_rules():
+    from quartet_4nt4r3s import soap
+    soap.get_antares_rules('<warm-up/>')
+
+
+STAGE_FUNCTIONS = {
+    'imports': warm_imports,
+    'templates': warm_templates,
+    'lxml': warm_lxml,
+    'serialbox': warm_serialbox,
+    'pools': warm_pools,
+    'rules': warm_rules,
+}
+
+
+def warm_up(stages=None) -> dict:
+    """
+    Runs the warm-up stages and logs how long each took.
+    :param stages: The names of the stages to run, by default those in the
+    ANTARES_WARM_UP setting.
+    :return: A dictionary of the seconds each stage that ran took.
+    """
+    timings = {}
+    start = time.perf_counter()
+    for stage in get_stages() if stages is None else stages:
+        if stage not in STAGE_FUNCTIONS:
+            logger.warning('Unknown Antares warm-up stage %s.', stage)
+            continue
+        stage_start = time.perf_counter()
+        try:
+            STAGE_FUNCTIONS[stage]()
+        except Exception as e:
+            # the tables may not exist yet, e.g. before the first migrate
+            logger.warning('Antares warm-up stage %s failed: %s', stage, e)
+            continue
+        timings[stage] = time.perf_counter() - stage_start
+    if timings:
+        logger.info('Antares warm-up took %.3fs (%s).',
+                    time.perf_counter() - start,
+                    ', '.join('%s %.3fs' % item for item in timings.items()))
+    return timings
+
+
+def install():
+    """
+    Runs the start up stages named by the ANTARES_WARM_UP setting and
+    connects warm_up_process to the first request and celery worker
+    process start of each process.
+    """
+    from celery.signals import worker_process_init
+    from django.core.signals import request_started
+    warm_up([stage for stage in get_stages() if stage in STARTUP_STAGES])
+    request_started.connect(warm_up_process, dispatch_uid=DISPATCH_UID)
+    worker_process_init.connect(warm_up_process, weak=False,
+                                dispatch_uid=DISPATCH_UID)
+
+
+def warm_up_process(**kwargs):
+    """
+    Signal handler that runs the remaining stages named by the
+    ANTARES_WARM_UP setting, once per process.
+    """
+    global _warmed
+    if _warmed:
+        return
+    with _lock:
+        if _warmed:
+            return
+        _warmed = True
+    warm_up([stage for stage in get_stages()
+             if stage not in STARTUP_STAGES])
+
+
+def _after_fork():
+    global _lock, _warmed
+    # a forked child warms up its own connections
+    _lock = threading.Lock()
+    _warmed = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -68,6 +68,7 @@ setup(
     data_files=get_data_files('quartet_4nt4r3s/templates/soap/'),
     include_package_data=True,
     install_requires=[],
+    python_requires='>=3.7',
     license="GPLv3",
     zip_safe=False,
     keywords='quartet_4nt4r3s',
@@ -80,8 +81,9 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: GNU General Public License v3',
         'Natural Language :: English',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
     ],
 )
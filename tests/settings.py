@@ -62,3 +62,11 @@ else:
 DEFAULT_ANTARES_RULE='epcis'
 
 MEDIA_ROOT = '/tmp'
+
+# the local serialbox/rfXcel stand-in, see quartet_4nt4r3s.standin
+ANTARES_STANDIN = {
+    'latency': 0,
+    'jitter': 0,
+    'error_rate': 0,
+    'seed': 1,
+}
@@ -12,13 +12,21 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
+import io
 import os
 import logging
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.base import File
 from django.test import TestCase
 from quartet_epcis.db_api.queries import EPCISDBProxy
 from quartet_epcis.models import events, choices, headers, entries
 from quartet_epcis.parsing import errors
 from quartet_epcis.parsing.parser import QuartetParser
+from quartet_4nt4r3s import backfill, conversion, filemap
+from quartet_4nt4r3s.compact import CompactEPCSet
 from quartet_4nt4r3s.parser import BusinessEPCISParser
 
 db_proxy = EPCISDBProxy()
@@ -44,6 +52,243 @@ class BusinessRulesTestCase(TestCase):
         self.assertEqual(len(evs), 1)
         self.assertEqual(len(evs[0].epc_list), 16)
 
+    def test_delete_known_epcs(self):
+        '''
+        Deletes one epc that is already commissioned and one that is not;
+        only the unknown epc should be pre-commissioned.
+        '''
+        self._parse_test_data()
+        self._parse_test_data(test_file='data/known-comm-delete.xml')
+        known = 'urn:epc:id:sgtin:0342195.030809.110269387573'
+        unknown = 'urn:epc:id:sgtin:0342195.030809.999999999999'
+        commissioning = 'urn:epcglobal:cbv:bizstep:commissioning'
+        self.assertEqual(entries.EntryEvent.objects.filter(
+            identifier=known,
+            event__biz_step=commissioning).count(), 1)
+        self.assertEqual(entries.EntryEvent.objects.filter(
+            identifier=unknown,
+            event__biz_step=commissioning).count(), 1)
+        self.assertTrue(entries.Entry.objects.get(
+            identifier=known).decommissioned)
+        self.assertTrue(entries.Entry.objects.get(
+            identifier=unknown).decommissioned)
+
+    def test_delete_known_epcs_compact(self):
+        '''
+        The known epcs work the same when they are kept compact.
+        '''
+        self._parse_test_data()
+        curpath = os.path.dirname(__file__)
+        parser = BusinessEPCISParser(
+            os.path.join(curpath, 'data/known-comm-delete.xml'),
+            compact_epcs=True
+        )
+        parser.parse()
+        self.assertIsInstance(parser.known_epcs, CompactEPCSet)
+        self.assertEqual(entries.EntryEvent.objects.filter(
+            identifier='urn:epc:id:sgtin:0342195.030809.999999999999',
+            event__biz_step='urn:epcglobal:cbv:bizstep:commissioning'
+        ).count(), 1)
+        self.assertEqual(entries.EntryEvent.objects.filter(
+            identifier='urn:epc:id:sgtin:0342195.030809.110269387573',
+            event__biz_step='urn:epcglobal:cbv:bizstep:commissioning'
+        ).count(), 1)
+
+    def test_compact_epc_set(self):
+        epcs = ['urn:epc:id:sgtin:0342195.030809.900654902111',
+                'urn:epc:id:sgtin:0342195.030809.000000000012',
+                'urn:epc:id:sgtin:0342195.030809.12',
+                'urn:epc:id:sscc:0342195.0000000001',
+                'urn:epc:id:sgtin:0342195.030809.AB-12',
+                'urn:epc:id:sgtin:0342195.030809.99999999999999999999']
+        compact = CompactEPCSet(epcs[:3], merge_size=2)
+        compact.update(epcs[3:] + epcs[:1])
+        self.assertEqual(len(compact), 6)
+        self.assertEqual(sorted(compact), sorted(epcs))
+        for epc in epcs:
+            self.assertIn(epc, compact)
+        self.assertNotIn('urn:epc:id:sgtin:0342195.030809.012', compact)
+        compact.difference_update(epcs[1:4])
+        self.assertEqual(sorted(compact), sorted(epcs[:1] + epcs[4:]))
+        compact.clear()
+        self.assertEqual(len(compact), 0)
+
+    def test_epc_hex_encoding(self):
+        # the examples from the GS1 EPC Tag Data Standard
+        self.assertEqual(
+            conversion.encode_sgtin96('0614141', '812345', '6789', 3),
+            '3074257BF7194E4000001A85')
+        self.assertEqual(
+            conversion.encode_sscc96('0614141', '1234567890', 3),
+            '3174257BF4499602D2000000')
+        converter = conversion.AntaresBarcodeConverter(
+            '0180614141123458216789', 7, filter_value=3)
+        self.assertTrue(converter.check_digit_valid)
+        self.assertEqual(converter.epc_hex, '3074257BF7194E4000001A85')
+        with self.assertRaises(conversion.BarcodeConverter.BarcodeNotValid):
+            conversion.encode_sgtin96('0614141', '812345', '06789')
+
+    def test_batch_barcode_conversion(self):
+        barcodes = ['01003421950308072100000000000',
+                    '01103421950308042190065490211',
+                    '(01)00342195030807(21)ABCdef1234',
+                    '00003421950000000015',
+                    '(00)103421950000000012',
+                    '0100342195030807210000012345171901011034A1']
+        modes = [False] + ([True] if conversion.numpy else [])
+        for use_numpy in modes:
+            converter = conversion.BatchBarcodeConverter(
+                7, filter_value=1, use_numpy=use_numpy)
+            for prop_name in ('epc_urn',
+                              'extension_prepended_serial_number_field'):
+                self.assertEqual(
+                    converter.convert(barcodes, prop_name),
+                    [getattr(conversion.AntaresBarcodeConverter(
+                        barcode, 7, filter_value=1), prop_name)
+                     for barcode in barcodes])
+            self.assertEqual(
+                converter.convert(barcodes[1:2] + barcodes[3:5], 'epc_hex'),
+                ['303414E2CC64AA14F8525123', '313414E2CC00000001000000',
+                 '313414E2CC3B9ACA01000000'])
+            self.assertEqual(converter.convert(barcodes[:1])[0],
+                             'urn:epc:id:sgtin:0342195.003080.')
+            bad = barcodes[1][:15] + '5' + barcodes[1][16:]
+            self.assertEqual(converter.check_digits_valid([bad] + barcodes),
+                             [False] + [True] * len(barcodes))
+            not_valid = conversion.BarcodeConverter.BarcodeNotValid
+            self.assertRaises(not_valid, converter.convert, barcodes + [bad])
+            self.assertRaises(not_valid, converter.convert, barcodes[:1],
+                              'epc_hex')
+            converter.validate = False
+            self.assertEqual(converter.convert([bad]),
+                             ['urn:epc:id:sgtin:0342195.103080.90065490211'])
+
+    def test_small_cache_flushes(self):
+        '''
+        Parses with a tiny event cache so that the caches are flushed
+        between events.
+        '''
+        curpath = os.path.dirname(__file__)
+        parser = BusinessEPCISParser(
+            os.path.join(curpath, 'data/comm-delete.xml'),
+            event_cache_size=1,
+            flush_batch_size=2
+        )
+        parser.parse()
+        self.assertEqual(parser.flush_count, 2)
+        self.assertEqual(events.Event.objects.count(), 3)
+        self.assertEqual(entries.EntryEvent.objects.count(), 22)
+
+    def test_memory_mapped_file(self):
+        '''
+        Parses a memory map of a file on disk; in-memory files are not
+        mapped.
+        '''
+        path = os.path.join(os.path.dirname(__file__), 'data/comm-delete.xml')
+        with open(path, 'rb') as f:
+            with filemap.open_mapped(File(f)) as mapped:
+                BusinessEPCISParser(mapped).parse()
+                self.assertEqual(mapped.tell(), os.path.getsize(path))
+            self.assertTrue(mapped.closed)
+        self.assertEqual(events.Event.objects.count(), 3)
+        self.assertEqual(entries.EntryEvent.objects.count(), 22)
+        with filemap.open_mapped(File(io.BytesIO(b'<epcis/>'))) as mapped:
+            self.assertIsNone(mapped)
+
+    def test_backfill(self):
+        '''
+        Backfills a SOAP message and EPCIS documents in timestamp order.  A
+        file that can not be parsed fails and the later file that shares
+        one of its epcs is skipped.
+        '''
+        self.assertEqual(backfill.get_dependencies(
+            [['a', 'b'], ['c'], ['b', 'c'], None, ['a']]),
+            [set(), set(), {0, 1}, set(), {0}])
+        data = os.path.join(os.path.dirname(__file__), 'data')
+        known = 'urn:epc:id:sgtin:0342195.030809.110269387573'
+        broken = 'urn:epc:id:sgtin:0342195.030809.999999999998'
+        with open(os.path.join(data, 'known-comm-delete.xml')) as f:
+            dependent = f.read().replace('999999999999', '999999999998')
+        output, stderr = io.StringIO(), io.StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            files = [('e-soap.xml', None, 'antares-lot-batch.xml'),
+                     ('d-commission.xml', None, 'comm-delete.xml'),
+                     ('c-delete.xml', None, 'known-comm-delete.xml'),
+                     ('b-broken.xml', '<message><epc>%s</epc></message>' %
+                      broken, None),
+                     ('a-dependent.xml', dependent, None)]
+            for timestamp, (name, content, source) in enumerate(files):
+                path = os.path.join(directory, name)
+                if source:
+                    shutil.copy(os.path.join(data, source), path)
+                else:
+                    with open(path, 'w') as f:
+                        f.write(content)
+                os.utime(path, (timestamp, timestamp))
+            with self.assertRaises(CommandError):
+                call_command('antares_backfill', directory, '--workers', '0',
+                             stdout=output, stderr=stderr)
+        self.assertIn('Parsed 3 of 5 files', output.getvalue())
+        self.assertIn('b-broken.xml: failed', stderr.getvalue())
+        self.assertIn('a-dependent.xml: skipped', stderr.getvalue())
+        # the epc was commissioned before the delete and not again by it
+        self.assertEqual(entries.EntryEvent.objects.filter(
+            identifier=known,
+            event__biz_step='urn:epcglobal:cbv:bizstep:commissioning'
+        ).count(), 1)
+        self.assertTrue(entries.Entry.objects.get(
+            identifier=known).decommissioned)
+
+    def test_resume_from_checkpoint(self):
+        '''
+        Fails on the second event of a checkpointed parse and resumes
+        from the checkpoint of the first.
+        '''
+        class FailingParser(BusinessEPCISParser):
+            def _pre_commission_event(self, epcis_event):
+                raise RuntimeError('Worker died.')
+
+        checkpoints = []
+        data = os.path.join(os.path.dirname(__file__), 'data/comm-delete.xml')
+        parser = FailingParser(
+            data, event_cache_size=1,
+            on_checkpoint=lambda *args: checkpoints.append(args))
+        with self.assertRaises(RuntimeError):
+            parser.parse()
+        self.assertEqual(len(checkpoints), 1)
+        message_id, event_index = checkpoints[-1]
+        self.assertEqual(event_index, 1)
+        self.assertEqual(events.Event.objects.count(), 1)
+        parser = BusinessEPCISParser(
+            data, event_cache_size=1,
+            on_checkpoint=lambda *args: checkpoints.append(args),
+            resume_from=checkpoints[-1])
+        self.assertEqual(parser.parse(), message_id)
+        self.assertEqual(checkpoints[-1], (message_id, 2))
+        self.assertEqual(events.Event.objects.count(), 3)
+        self.assertEqual(headers.Message.objects.count(), 1)
+
+    def test_commit_interval_rollback(self):
+        '''
+        Commits every event and makes sure a failed chunk is rolled back
+        without touching the committed ones.
+        '''
+        class FailingParser(BusinessEPCISParser):
+            def _pre_commission_event(self, epcis_event):
+                super()._pre_commission_event(epcis_event)
+                raise RuntimeError('Bad chunk.')
+
+        parser = FailingParser(
+            os.path.join(os.path.dirname(__file__), 'data/comm-delete.xml'),
+            commit_interval=1)
+        with self.assertRaises(RuntimeError):
+            parser.parse()
+        self.assertEqual(parser.commit_count, 1)
+        self.assertEqual(events.Event.objects.count(), 1)
+        self.assertEqual(entries.Entry.objects.count(), 16)
+        self.assertFalse(parser.event_cache)
+        self.assertFalse(parser.entry_event_cache)
+
     def _parse_test_data(self, test_file='data/comm-delete.xml',
                          parser_type=BusinessEPCISParser,
                          recursive_decommission=False):
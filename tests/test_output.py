@@ -7,7 +7,9 @@ test_quartet_output
 
 Tests for `quartet_output` models module.
 """
+import io
 import os
+import tempfile
 from EPCPyYes.core.v1_2.events import EventType
 from EPCPyYes.core.v1_2.CBV.dispositions import Disposition
 from EPCPyYes.core.v1_2.CBV.business_steps import BusinessSteps
@@ -15,10 +17,24 @@ from quartet_epcis.parsing.business_parser import BusinessEPCISParser
 from quartet_4nt4r3s.parser import BusinessEPCISParser as AntaresParser
 from quartet_capture.models import Rule, Step, StepParameter, Task
 from quartet_capture.tasks import execute_rule, execute_queued_task
-from quartet_capture.rules import Rule as CRule
+from quartet_capture.rules import Rule as CRule, RuleContext
 from quartet_output.steps import SimpleOutputParser, ContextKeys
 from quartet_output.models import EPCISOutputCriteria
 from quartet_templates.models import Template
+from quartet_templates.steps import TemplateStep
+from quartet_4nt4r3s import rfxcel
+from quartet_4nt4r3s.steps import StreamingTemplateStep, \
+    RFXCELURNResponseStep, SOAPEnvelopeTransportStep, \
+    PooledSOAPEnvelopeTransportStep, \
+    SplitSOAPEnvelopeTransportStep, TraceLinkExportStep
+from quartet_4nt4r3s import tracelink, transport
+from quartet_4nt4r3s.standin import StandInServer
+from quartet_capture.defaults import get_storage
+from unittest import mock
+import requests
+from lxml import etree
+from quartet_capture.models import TaskParameter
+from serialbox.models import Pool
 from django.test import TestCase
 
 from quartet_output import models
@@ -44,6 +60,300 @@ class TestQuartetOutput(TestCase):
         self._parse_test_data('data/antares-lot-batch.xml', AntaresParser)
 
 
+    def test_streaming_template_step(self):
+        Template.objects.create(
+            name='Number Response',
+            content='<idList>\n{% for serial_number in data %}\n'
+                    '<id>{{serial_number}}</id>\n{% endfor %}\n</idList>'
+        )
+        db_task = Task.objects.create(rule=self._create_rule())
+        data = ['urn:epc:id:sgtin:0342195.030809.%s' % i for i in range(10)]
+        params = {'Template Name': 'Number Response'}
+        expected = TemplateStep(db_task, **params).execute(
+            data, RuleContext(db_task.rule.name, db_task.name))
+        rendered = StreamingTemplateStep(
+            db_task, **params, **{'Buffer Size': '4'}).execute(
+            data, RuleContext(db_task.rule.name, db_task.name))
+        chunks = list(rendered)
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(''.join(chunks), expected)
+        self.assertEqual(bytes(rendered), expected.encode())
+
+    def test_streaming_template_transport(self):
+        Template.objects.create(
+            name='Outbound Message',
+            content='<epcis:EPCISDocument task="{{ rule_context.task_name }}"'
+                    ' template="{{ step_parameters["Template Name"] }}">\n'
+                    '{% for epc in data %}\n<epc>{{ epc }}</epc>\n'
+                    '{% endfor %}\n</epcis:EPCISDocument>'
+        )
+        output_criteria = self._create_good_output_criterion()
+        db_task = self._create_task(self._create_rule())
+        TaskParameter.objects.create(task=db_task,
+                                     name='EPCIS Output Criteria',
+                                     value=output_criteria.name)
+        context = RuleContext(db_task.rule.name, db_task.name)
+        data = ['urn:epc:id:sgtin:0342195.030809.%s' % i for i in range(50)]
+        params = {'Template Name': 'Outbound Message'}
+        expected = TemplateStep(db_task, **params).execute(data, context)
+        rendered = StreamingTemplateStep(
+            db_task, **params, **{'Buffer Size': '8'}).execute(data, context)
+        sent = []
+
+        def post(url, data, **kwargs):
+            sent.extend(data)
+            return mock.Mock(text='')
+
+        # the transport posts the rendered chunks as they are produced
+        with mock.patch('quartet_output.transport.http.requests.post', post):
+            SOAPEnvelopeTransportStep(db_task).execute(rendered, context)
+        self.assertGreater(len(sent), 4)
+        self.assertIn(expected.encode(), b''.join(sent))
+
+    def test_native_rfxcel_response(self):
+        data = ['urn:epc:id:sgtin:0342195.030809.%s' % i for i in range(5)]
+        task_parameters = {'requestId': 'abc', 'eventId': 'a&b',
+                           'pool': '10342195308095'}
+        formats = {
+            'Random GTIN': rfxcel.template_data,
+            'Sequential GTIN': rfxcel.sequential_gtin_teplate_data,
+            'Sequential SSCC': rfxcel.sequential_sscc_teplate_data,
+        }
+        for ids in (data, data + ['<bad>'], []):
+            for response_format, content in formats.items():
+                expected = Template(content=content).render({
+                    'data': ids, 'task_parameters': task_parameters,
+                    'epoch': 1540000000.5, 'UUID': 'uuid'})
+                self.assertEqual(
+                    rfxcel.build_response(ids, task_parameters,
+                                          response_format, 1540000000.5,
+                                          'uuid'),
+                    expected)
+
+    def test_fused_rfxcel_response(self):
+        db_task = Task.objects.create(rule=self._create_rule())
+        context = RuleContext(db_task.rule.name, db_task.name)
+        for pool, response_format, urns in (
+            ('10342195308095', 'Random GTIN',
+             ['urn:epc:id:sgtin:0342195.130809.%s' % i for i in (5, 7, 9)]),
+            ('00342195', 'Sequential SSCC',
+             ['urn:epc:id:sscc:0342195.0%s' % str(i).zfill(9)
+              for i in (5, 7, 9)]),
+        ):
+            Pool.objects.create(readable_name=pool, machine_name=pool)
+            TaskParameter.objects.update_or_create(
+                task=db_task, name='pool', defaults={'value': pool})
+            step = RFXCELURNResponseStep(db_task, **{
+                'Response Format': response_format,
+                'Company Prefix Length': '7',
+                'Chunk Size': '2'})
+            response = step.execute([5, 7, 9], context)
+            expected = rfxcel.build_response(
+                urns, {'pool': pool}, response_format, 0, 'uuid')
+            self.assertEqual(
+                response.split('</ns5:sysEventId>')[1],
+                expected.split('</ns5:sysEventId>')[1])
+
+    def test_soap_envelope_transport(self):
+        self._create_template()
+        output_criteria = self._create_good_output_criterion()
+        db_task = self._create_task(self._create_rule())
+        TaskParameter.objects.create(task=db_task,
+                                     name='EPCIS Output Criteria',
+                                     value=output_criteria.name)
+        context = RuleContext(db_task.rule.name, db_task.name)
+        message = '<epcis:EPCISDocument>%s</epcis:EPCISDocument>' % (
+            'x' * 100)
+        params = {'deployment_id': 'QU4RTET', 'sender_sgln': 'urn:sgln'}
+        context.context[ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value] = \
+            message
+        expected = TemplateStep(
+            db_task, **params, **{'Template Name': 'RFXCEL SOAP'}).execute(
+            message, context)
+        sent = []
+        response = mock.Mock(text='')
+
+        def post(url, data, **kwargs):
+            sent.extend(data)
+            return response
+
+        with mock.patch('quartet_output.transport.http.requests.post', post):
+            SOAPEnvelopeTransportStep(
+                db_task, **params, **{'Chunk Size': '16'}).execute(
+                message.encode(), context)
+        self.assertGreater(len(sent), 8)
+        self.assertEqual(b''.join(sent).decode().replace(
+            'UnitTestUser', '').replace('UnitTestPassword', ''), expected)
+
+    def test_soap_envelope_transport_form_upload(self):
+        output_criteria = self._create_good_output_criterion()
+        db_task = self._create_task(self._create_rule())
+        TaskParameter.objects.create(task=db_task,
+                                     name='EPCIS Output Criteria',
+                                     value=output_criteria.name)
+        context = RuleContext(db_task.rule.name, db_task.name)
+        message = b'<epcis:EPCISDocument/>'
+        sent = []
+
+        def post(url, data, **kwargs):
+            sent.append(data)
+            return mock.Mock(text='')
+
+        with mock.patch('quartet_output.transport.http.requests.post', post):
+            SOAPEnvelopeTransportStep(
+                db_task, **{'body-raw': 'False', 'Chunk Size': '16'}
+            ).execute(message, context)
+        self.assertEqual(list(sent[0]), ['file'])
+        self.assertIsInstance(sent[0]['file'], bytes)
+        self.assertIn(message, sent[0]['file'])
+        # the pooled step sends the messages of claimed tasks the same way
+        pooled = PooledSOAPEnvelopeTransportStep(db_task,
+                                                 **{'body-raw': 'False'})
+        self.assertEqual(
+            pooled.prepare_message(message, context, output_criteria),
+            sent[0]['file'])
+
+    def test_soap_envelope_transport_standin(self):
+        output_criteria = self._create_good_output_criterion()
+        db_task = self._create_task(self._create_rule())
+        TaskParameter.objects.create(task=db_task,
+                                     name='EPCIS Output Criteria',
+                                     value=output_criteria.name)
+        context = RuleContext(db_task.rule.name, db_task.name)
+        with StandInServer() as server:
+            output_criteria.end_point.urn = server.url + '/rfxcel/'
+            output_criteria.end_point.save()
+            SOAPEnvelopeTransportStep(db_task, **{'Chunk Size': '64'}).execute(
+                b'<epcis:EPCISDocument/>' * 20, context)
+        self.assertEqual(server.counts['messages'], 1)
+
+    def test_split_soap_envelope_transport(self):
+        output_criteria = self._create_good_output_criterion()
+        db_task = self._create_task(self._create_rule())
+        TaskParameter.objects.create(task=db_task,
+                                     name='EPCIS Output Criteria',
+                                     value=output_criteria.name)
+        context = RuleContext(db_task.rule.name, db_task.name)
+        with open(os.path.join(os.path.dirname(__file__), 'data',
+                               'epcis.xml'), 'rb') as f:
+            data = f.read()
+        sent = []
+        response = mock.Mock(text='')
+
+        def post(url, data, **kwargs):
+            if len(sent) == 1:
+                # fail the second chunk once
+                sent.append(None)
+                raise requests.exceptions.ConnectionError()
+            sent.append(data)
+            return response
+
+        with mock.patch('quartet_output.transport.http.requests.post', post):
+            SplitSOAPEnvelopeTransportStep(
+                db_task, **{'Max Events': '2', 'Retry Delay': '0'}
+            ).execute(data, context)
+        self.assertEqual(len(sent), 3)
+        event_types = []
+        for message in [sent[0], sent[2]]:
+            root = etree.fromstring(message)
+            events = root.find('.//EventList')
+            self.assertEqual(len(events), 2)
+            event_types.extend(etree.QName(e).localname for e in events)
+        original = etree.fromstring(data).find('.//EventList')
+        self.assertEqual(event_types,
+                         [etree.QName(e).localname for e in original])
+
+    def test_pooled_transport_coalesces_queued_tasks(self):
+        output_criteria = self._create_good_output_criterion()
+        rule = self._create_transport_rule()
+        Step.objects.create(
+            rule=rule, order=1, name='Pooled Transport',
+            step_class='quartet_4nt4r3s.steps.PooledTransportStep',
+            description='unit test step')
+        tasks = []
+        for i in range(4):
+            task = Task.objects.create(rule=rule, name='pooled-%s' % i,
+                                       status='QUEUED')
+            get_storage().save('%s.dat' % task.name,
+                               io.BytesIO(b'<message>%d</message>' % i))
+            TaskParameter.objects.create(task=task,
+                                         name='EPCIS Output Criteria',
+                                         value=output_criteria.name)
+            tasks.append(task)
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(text='')
+        with mock.patch.object(transport, 'get_session',
+                               return_value=session):
+            execute_queued_task(tasks[0].name, raise_exception=True)
+            execute_queued_task(tasks[2].name, raise_exception=True)
+        sent = sorted(call[0][1] for call in session.post.call_args_list)
+        self.assertEqual(sent, [b'<message>%d</message>' % i
+                                for i in range(4)])
+        for task in tasks:
+            task.refresh_from_db()
+            self.assertEqual(task.status, 'FINISHED')
+        self.assertEqual(transport.get_coalesced_by(tasks[2]), tasks[0].name)
+        for task in tasks:
+            get_storage().delete('%s.dat' % task.name)
+
+    def test_tracelink_export(self):
+        export_dir = tempfile.mkdtemp()
+        output_criteria = self._create_good_output_criterion()
+        output_criteria.end_point.urn = 'file://%s' % export_dir
+        output_criteria.end_point.save()
+        db_task = self._create_task(self._create_rule())
+        TaskParameter.objects.create(task=db_task,
+                                     name='EPCIS Output Criteria',
+                                     value=output_criteria.name)
+        epcs = ('urn:epc:id:sgtin:0368220.011210.%s' % i
+                for i in range(25))
+        step = TraceLinkExportStep(db_task, **{
+            'Sender GLN': '0358716000006', 'Receiver GLN': '0303780000063',
+            'Read Point': 'urn:epc:id:sgln:0358716.0.0',
+            'Business Location': 'urn:epc:id:sgln:0358716.0.0',
+            'Lot Number': '000001', 'Expiration Date': '2019-11-01',
+            'Batch Size': '10'
+        })
+        step.execute(epcs, RuleContext('output-test', db_task.name))
+        export = os.path.join(export_dir, '%s.xml' % db_task.name)
+        root = etree.parse(export).getroot()
+        template = etree.parse(os.path.join(
+            os.path.dirname(__file__), '..', 'quartet_4nt4r3s', 'templates',
+            'sftp', 'TraceLink.xml')).getroot()
+        self.assertEqual(root.tag, template.tag)
+        self.assertEqual(
+            [e.tag for e in root.iter() if e.tag != 'epc'],
+            [e.tag for e in template.iter()
+             if e.tag != 'epc' and isinstance(e.tag, str)])
+        epc_list = root.findall('.//epc')
+        self.assertEqual(len(epc_list), 25)
+        self.assertEqual(epc_list[-1].text,
+                         'urn:epc:id:sgtin:0368220.011210.24')
+        self.assertEqual(root.find('.//{urn:epcglobal:cbv:mda}lotNumber').text,
+                         '000001')
+        os.remove(export)
+        os.rmdir(export_dir)
+
+    def test_tracelink_writer_leaves_out_empty_elements(self):
+        stream = io.BytesIO()
+        with tracelink.TraceLinkWriter(stream, '0358716000006',
+                                       '0303780000063', 'a&b',
+                                       batch_size=2) as writer:
+            writer.write_object_event(['urn:1', 'urn:2', 'urn:3'],
+                                      packaging_item_code_type=None)
+        root = etree.fromstring(stream.getvalue())
+        self.assertIsNone(root.get(
+            '{http://www.w3.org/2001/XMLSchema-nstance}schemaLocation'))
+        self.assertEqual(root.find('.//{http://www.unece.org/cefact/'
+                                   'namespaces/StandardBusinessDocumentHeader'
+                                   '}InstanceIdentifier').text, 'a&b')
+        event = root.find('.//ObjectEvent')
+        self.assertEqual([e.text for e in event.iter('epc')],
+                         ['urn:1', 'urn:2', 'urn:3'])
+        self.assertEqual([e.tag for e in event],
+                         ['eventTime', 'eventTimeZoneOffset', 'epcList',
+                          'action', 'bizStep', 'disposition'])
+
     def _create_good_output_criterion(self):
         endpoint = self._create_endpoint()
         auth = self._create_auth()
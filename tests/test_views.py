@@ -13,6 +13,13 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 import os
+import subprocess
+import sys
+import threading
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
 import django
 
@@ -23,10 +30,30 @@ from django.urls import reverse
 from django.contrib.auth.models import Group, User
 from quartet_capture import models
 from quartet_capture.management.commands.create_capture_groups import Command
+from django.test import override_settings
+from serialbox.models import Pool, ResponseRule
+from quartet_4nt4r3s.models import NumberResponse
+from quartet_4nt4r3s.standin import StandInServer
+from quartet_4nt4r3s import capture, coalescing, profiling, replay, \
+    tracing, transport, warmup
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
+from django.core.management import call_command
+from io import StringIO
+import tempfile
+from quartet_4nt4r3s.management.commands.create_rfxcel_processing_rule import \
+    Command as ProcessingRuleCommand
 
 os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.settings'
 django.setup()
 
+class CollectingExporter:
+    spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
 class ViewTest(APITestCase):
     def setUp(self):
         user = User.objects.create_user(username='testuser',
@@ -59,12 +86,573 @@ class ViewTest(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('RECEIVED', response.data)
 
-    def _get_test_data(self):
+    def test_execute_view_fast_acknowledge(self):
+        self._create_rule()
+        ProcessingRuleCommand().handle()
+        url = reverse('antares-epcis-report')
+        data = self._get_test_data()
+        response = self.client.post(
+            '{0}?fast-acknowledge=true&run-immediately=true'.format(url),
+            data=data, content_type='text')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('RECEIVED', response.data)
+        dispatch_task = models.Task.objects.get(
+            rule__name='Antares EPCIS Dispatch')
+        self.assertEqual(dispatch_task.status, 'FINISHED')
+        epcis_task = models.Task.objects.get(rule__name='epcis')
+        self.assertEqual(epcis_task.status, 'FINISHED')
+
+    def test_fast_acknowledge_run_later(self):
+        self._create_rule()
+        ProcessingRuleCommand().handle()
+        url = reverse('antares-epcis-report')
+        with mock.patch('quartet_capture.tasks.execute_queued_task.delay'
+                        ) as delay:
+            response = self.client.post(
+                '{0}?fast-acknowledge=true&run-immediately=false'.format(url),
+                data=self._get_test_data(), content_type='text')
+        self.assertEqual(response.status_code, 200)
+        dispatch_task = models.Task.objects.get(
+            rule__name='Antares EPCIS Dispatch')
+        self.assertEqual(dispatch_task.status, 'WAITING')
+        delay.assert_called_once_with(task_name=dispatch_task.name,
+                                      user_id=self.user.id)
+        self.assertEqual(
+            dispatch_task.taskparameter_set.get(name='run-immediately').value,
+            'False')
+        self.assertFalse(models.Task.objects.filter(rule__name='epcis'))
+
+    @override_settings(ANTARES_TRACING=True,
+                       ANTARES_TRACE_EXPORTER='tests.test_views.'
+                                              'CollectingExporter')
+    def test_fast_acknowledge_tracing(self):
+        CollectingExporter.spans.clear()
+        self._create_rule()
+        ProcessingRuleCommand().handle()
+        url = reverse('antares-epcis-report')
+        response = self.client.post(
+            '{0}?fast-acknowledge=true&run-immediately=true'.format(url),
+            data=self._get_test_data(), content_type='text')
+        self.assertEqual(response.status_code, 200)
+        for task in models.Task.objects.all():
+            self.assertEqual(tracing.get_correlation_id(task),
+                             'Commission-01-02-15')
+        names = [span.name for span in CollectingExporter.spans]
+        for name in ['antares.report', 'antares.queue', 'antares.dispatch',
+                     'antares.parse', 'task']:
+            self.assertIn(name, names)
+        self.assertEqual(names.count('task'), 2)
+        self.assertEqual(names[-1], 'antares.report')
+        self.assertEqual({span.correlation_id
+                          for span in CollectingExporter.spans},
+                         {'Commission-01-02-15'})
+
+    @override_settings(ANTARES_TRACING=True,
+                       ANTARES_TRACE_EXPORTER='tests.test_views.'
+                                              'CollectingExporter')
+    def test_task_tracing(self):
+        CollectingExporter.spans.clear()
+        with tracing.bound('outer'):
+            # a task without a correlation id does not inherit the outer one
+            tracing.bind('task', None)
+            self.assertIsNone(tracing.current_correlation_id())
+            tracing.unbind('task')
+            self.assertEqual(tracing.current_correlation_id(), 'outer')
+            task = models.Task.objects.create(rule=self._create_rule())
+        # saved the way execute_queued_task saves a task that runs out of
+        # time and one that fails, the second run reusing the instance
+        for status in ('QUEUED', 'FAILED'):
+            task.start = datetime.now()
+            task.status = 'RUNNING'
+            task.save()
+            self.assertEqual(tracing.current_correlation_id(), 'outer')
+            task.status = status
+            task.save()
+            self.assertIsNone(tracing.current_correlation_id())
+            task.end = datetime.now()
+            task.save()
+        self.assertEqual([(span.name, span.attributes['status'])
+                          for span in CollectingExporter.spans],
+                         [('task', 'QUEUED'), ('task', 'FAILED')])
+        for span in CollectingExporter.spans:
+            self.assertGreaterEqual(span.end, span.start)
+
+    def test_profile_report(self):
+        self._create_rule()
+        url = reverse('antares-epcis-report')
+        profile_dir = tempfile.mkdtemp()
+        self.user.is_staff = True
+        self.user.save()
+        with override_settings(ANTARES_PROFILE_DIR=profile_dir):
+            response = self.client.post(
+                '{0}?profile=true&run-immediately=true'.format(url),
+                data=self._get_test_data(), content_type='text')
+            self.assertEqual(response.status_code, 200)
+            task = models.Task.objects.filter(
+                taskparameter__name=profiling.PROFILE_PARAMETER).get()
+            self.assertTrue(profiling.is_task_profiled(task))
+            # the report profile covers the task run in the same thread
+            self.assertEqual(
+                len([f for f in os.listdir(profile_dir)
+                     if f.endswith('.prof')]), 1)
+            output = StringIO()
+            call_command('antares_profile_summary', stdout=output)
+            self.assertIn('parse_data', output.getvalue())
+            self.assertIn('peak', output.getvalue())
+            # only staff can profile
+            self.user.is_staff = False
+            self.user.save()
+            response = self.client.post(
+                '{0}?profile=true'.format(url),
+                data=self._get_test_data().replace('unittest', 'wrong'),
+                content_type='text')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(
+                len([f for f in os.listdir(profile_dir)
+                     if f.endswith('.prof')]), 1)
+        for file_name in os.listdir(profile_dir):
+            os.remove(os.path.join(profile_dir, file_name))
+        os.rmdir(profile_dir)
+
+    def test_overlapping_profiles(self):
+        profile_dir = tempfile.mkdtemp()
+        entered, finish = threading.Event(), threading.Event()
+
+        def first():
+            with profiling.profile('first'):
+                entered.set()
+                finish.wait(5)
+
+        with override_settings(ANTARES_PROFILE_DIR=profile_dir):
+            thread = threading.Thread(target=first)
+            thread.start()
+            entered.wait(5)
+            with profiling.profile('second') as result:
+                # the first profile ends while this one is running
+                finish.set()
+                thread.join()
+            self.assertTrue(os.path.exists(result.memory_path))
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(len(os.listdir(profile_dir)), 4)
+        for file_name in os.listdir(profile_dir):
+            os.remove(os.path.join(profile_dir, file_name))
+        os.rmdir(profile_dir)
+
+    def test_fast_acknowledge_unauthorized(self):
+        url = reverse('antares-epcis-report')
+        data = self._get_test_data().replace('unittest', 'wrong')
+        response = self.client.post(
+            '{0}?fast-acknowledge=true'.format(url),
+            data=data, content_type='text')
+        self.assertEqual(response.status_code, 401)
+
+    def test_number_request_pass_through(self):
+        Pool.objects.create(readable_name='Unit Test Pool',
+                            machine_name='10342195308095')
+        upstream = mock.Mock(status_code=200,
+                             headers={'Content-Type': 'application/xml'})
+        upstream.iter_content.return_value = [b'<ids>', b'</ids>']
+        url = reverse('antares-number-request')
+        with mock.patch('requests.Session.get',
+                        return_value=upstream) as get:
+            response = self.client.post(
+                '{0}?pass-through=true'.format(url),
+                data=self._get_test_data('data/antares-number-request.xml'),
+                content_type='text')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/xml')
+            self.assertEqual(b''.join(response.streaming_content),
+                             b'<ids></ids>')
+        self.assertTrue(get.call_args[1]['stream'])
+        upstream.close.assert_called_once_with()
+
+    def test_number_request_standin(self):
+        Pool.objects.create(readable_name='Unit Test Pool',
+                            machine_name='10342195308095')
+        url = reverse('antares-number-request')
+        data = self._get_test_data('data/antares-number-request.xml')
+        with StandInServer() as server:
+            with override_settings(ANTARES_SERIALBOX_SCHEME='http',
+                                   ANTARES_SERIALBOX_HOST=server.host,
+                                   ANTARES_SERIALBOX_PORT=server.port):
+                response = self.client.post(
+                    '{0}?pass-through=true'.format(url), data=data,
+                    content_type='text')
+                self.assertEqual(response.status_code, 200)
+                body = b''.join(response.streaming_content).decode()
+                self.assertEqual(body.count('urn:epc:id:sgtin:0342195.'
+                                            '130809.'), 10)
+                self.assertIn('5b0e4c3a-0b3c-11e9-9b5e-0242ac110002', body)
+                server.error_rate = 1
+                response = self.client.post(
+                    '{0}?pass-through=true'.format(url), data=data,
+                    content_type='text')
+                self.assertEqual(response.status_code, 503)
+        self.assertEqual(server.counts['requests'], 2)
+        self.assertEqual(server.counts['errors'], 1)
+        with StandInServer(company_prefix_length=9) as server:
+            self.assertEqual(server.make_ids('10342195308095', 1),
+                             ['urn:epc:id:sgtin:034219530.1809.0'])
+
+    def test_coalesced_allocations(self):
+        coalescer = coalescing.AllocationCoalescer(window=0.2)
+        with StandInServer() as server:
+            session = transport.get_session(server.url)
+
+            def fetch(count):
+                return session.get('%s/serialbox/allocate/10342195308095/%d/'
+                                   % (server.url, count))
+
+            def allocate(i):
+                return coalescer.allocate(('pool', 'user'), i + 1,
+                                          'event-%d' % i, fetch)
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(allocate, range(4)))
+        self.assertEqual(server.counts['requests'], 1)
+        all_ids = []
+        for i, result in enumerate(results):
+            self.assertEqual(result.status, 200)
+            root = etree.fromstring(result.body)
+            ids = [e.text for e in root.iter('{*}id')]
+            self.assertEqual(len(ids), i + 1)
+            self.assertEqual(root.get('requestId'), 'event-%d' % i)
+            self.assertEqual(next(root.iter('{*}eventId')).text,
+                             'event-%d' % i)
+            all_ids.extend(ids)
+        self.assertEqual(len(set(all_ids)), 10)
+        # a request on its own is sent as usual
+        self.assertIsNone(coalescer.allocate(('pool', 'user'), 1, 'event',
+                                             fetch))
+        transport.close_sessions()
+        # the requests of a response that can not be split are sent on
+        # their own instead of failing
+        unsplittable = mock.Mock(return_value=mock.Mock(
+            status_code=200, headers={}, content=b'<ids/>'))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(
+                lambda i: coalescer.allocate(('other', 'user'), 1,
+                                             'event-%d' % i, unsplittable),
+                range(2)))
+        unsplittable.assert_called_once_with(2)
+        self.assertEqual(results, [None, None])
+        self.assertIsNone(coalescer.allocate(('other', 'user'), 1, 'event',
+                                             unsplittable))
+
+    def test_coalesced_pools(self):
+        coalescer = coalescing.AllocationCoalescer(window=0.01)
+        pool = Pool.objects.create(readable_name='Unit Test Pool',
+                                   machine_name='10342195308095')
+        self.assertFalse(coalescing.AllocationCoalescer(
+            window=0).coalesces(pool))
+        # no response rule, the responses may not have an idList
+        self.assertFalse(coalescer.coalesces(pool))
+        with override_settings(ANTARES_COALESCE_POOLS=['10342195308095']):
+            self.assertTrue(coalescer.coalesces(pool))
+        rule = models.Rule.objects.create(name='Custom Response')
+        response_rule = ResponseRule.objects.create(
+            pool=pool, rule=rule, content_type='xml')
+        self.assertFalse(coalescer.coalesces(pool))
+        models.Step.objects.create(
+            rule=rule, order=1, name='Reply',
+            step_class='quartet_4nt4r3s.steps.RFXCELURNResponseStep')
+        self.assertTrue(coalescer.coalesces(pool))
+        response_rule.rule = models.Rule.objects.create(
+            name='Random RFXCEL GTIN URN Response')
+        response_rule.save()
+        self.assertTrue(coalescer.coalesces(pool))
+
+    def test_number_request_coalescing(self):
+        Pool.objects.create(readable_name='Unit Test Pool',
+                            machine_name='10342195308095')
+        url = reverse('antares-number-request')
+        data = self._get_test_data('data/antares-number-request.xml')
+        with StandInServer() as server:
+            with override_settings(ANTARES_SERIALBOX_SCHEME='http',
+                                   ANTARES_SERIALBOX_HOST=server.host,
+                                   ANTARES_SERIALBOX_PORT=server.port,
+                                   ANTARES_COALESCE_WINDOW=0.01,
+                                   ANTARES_COALESCE_POOLS=['10342195308095']):
+                response = self.client.post(url, data=data,
+                                            content_type='text')
+                self.assertEqual(response.status_code, 200)
+                # a coalesced share is returned like a request on its own
+                share = coalescing.CoalescedResponse(
+                    200, 'application/xml', response.data.encode())
+                with mock.patch.object(coalescing.coalescer, 'allocate',
+                                       return_value=share):
+                    coalesced = self.client.post(url, data=data,
+                                                 content_type='text')
+                self.assertEqual(coalesced['Content-Type'],
+                                 response['Content-Type'])
+                self.assertEqual(coalesced.content, response.content)
+        self.assertEqual(server.counts['requests'], 1)
+        transport.close_sessions()
+
+    def test_number_request_replay(self):
+        Pool.objects.create(readable_name='Unit Test Pool',
+                            machine_name='10342195308095')
+        url = reverse('antares-number-request')
+        data = self._get_test_data('data/antares-number-request.xml')
+        with StandInServer() as server:
+            with override_settings(ANTARES_SERIALBOX_SCHEME='http',
+                                   ANTARES_SERIALBOX_HOST=server.host,
+                                   ANTARES_SERIALBOX_PORT=server.port,
+                                   ANTARES_REPLAY_RETENTION=3600):
+                bodies = []
+                for i in range(2):
+                    response = self.client.post(
+                        '{0}?pass-through=true'.format(url), data=data,
+                        content_type='text')
+                    self.assertEqual(response.status_code, 200)
+                    bodies.append(b''.join(response.streaming_content)
+                                  if response.streaming else
+                                  response.content)
+                self.assertEqual(bodies[0], bodies[1])
+                self.assertEqual(server.counts['requests'], 1)
+                # a different password is not given the stored numbers
+                response = self.client.post(
+                    url, data=data.replace('unittest', 'other'),
+                    content_type='text')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(server.counts['requests'], 2)
+                # nor is a new event
+                second_event = data.replace('0242ac110002', '0242ac110003')
+                first = self.client.post(url, data=second_event,
+                                         content_type='text')
+                retry = self.client.post(url, data=second_event,
+                                         content_type='text')
+                self.assertEqual(first.content, retry.content)
+                self.assertEqual(server.counts['requests'], 3)
+        self.assertEqual(NumberResponse.objects.count(), 2)
+        transport.close_sessions()
+
+    def test_number_request_reservations(self):
+        Pool.objects.create(readable_name='Unit Test Pool',
+                            machine_name='10342195308095')
+        url = '{0}?pass-through=true'.format(
+            reverse('antares-number-request'))
+        data = self._get_test_data('data/antares-number-request.xml')
+        event_id = '5b0e4c3a-0b3c-11e9-9b5e-0242ac110002'
+        with StandInServer() as server:
+            with override_settings(ANTARES_SERIALBOX_SCHEME='http',
+                                   ANTARES_SERIALBOX_HOST=server.host,
+                                   ANTARES_SERIALBOX_PORT=server.port,
+                                   ANTARES_REPLAY_RETENTION=3600,
+                                   ANTARES_REPLAY_WAIT=0.2,
+                                   ANTARES_PASS_THROUGH_CHUNK_SIZE=64):
+                # a retry while the original is allocating is not allocated
+                reserved = replay.reserve('testuser', 'unittest', event_id)
+                response = self.client.post(url, data=data,
+                                            content_type='text')
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(server.counts['requests'], 0)
+                # it gets the response once the original stores it
+                with mock.patch('quartet_4nt4r3s.replay.time.sleep',
+                                side_effect=lambda _: reserved.complete(
+                                    b'<ids/>', 'application/xml', True)):
+                    response = self.client.post(url, data=data,
+                                                content_type='text')
+                self.assertEqual(response.content, b'<ids/>')
+                NumberResponse.objects.all().delete()
+                # a failed allocation releases the reservation
+                server.error_rate = 1
+                response = self.client.post(url, data=data,
+                                            content_type='text')
+                self.assertEqual(response.status_code, 503)
+                b''.join(response.streaming_content)
+                self.assertFalse(NumberResponse.objects.exists())
+                # the response is stored when the client goes away
+                server.error_rate = 0
+                response = self.client.post(url, data=data,
+                                            content_type='text')
+                next(iter(response.streaming_content))
+                response.close()
+                stored = NumberResponse.objects.get()
+                self.assertTrue(stored.complete)
+                self.assertEqual(
+                    bytes(stored.body).count(b'urn:epc:id:sgtin:'), 10)
+                # an abandoned reservation is taken over
+                NumberResponse.objects.update(complete=False)
+                with override_settings(
+                        ANTARES_REPLAY_RESERVATION_TIMEOUT=-1):
+                    response = self.client.post(url, data=data,
+                                                content_type='text')
+                    b''.join(response.streaming_content)
+                self.assertEqual(server.counts['requests'], 3)
+                self.assertTrue(NumberResponse.objects.get().complete)
+        transport.close_sessions()
+
+    def test_warm_up(self):
+        self._create_filter()
+        Pool.objects.create(readable_name='Unit Test Pool',
+                            machine_name='10342195308095')
+        transport.close_sessions()
+        with StandInServer() as server:
+            with override_settings(ANTARES_SERIALBOX_SCHEME='http',
+                                   ANTARES_SERIALBOX_HOST=server.host,
+                                   ANTARES_SERIALBOX_PORT=server.port,
+                                   ANTARES_WARM_UP=True):
+                with self.assertLogs('quartet_4nt4r3s.warmup', 'INFO') as logs:
+                    timings = warmup.warm_up()
+                self.assertEqual(set(timings), set(warmup.STAGES))
+                self.assertIn('Antares warm-up took', logs.output[-1])
+                # the number request reuses the connection opened above
+                adapter = transport.get_session(server.url).get_adapter(
+                    server.url)
+                self.assertEqual(len(adapter.poolmanager.pools), 1)
+                response = self.client.post(
+                    reverse('antares-number-request'),
+                    data=self._get_test_data(
+                        'data/antares-number-request.xml'),
+                    content_type='text')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(adapter.poolmanager.pools), 1)
+        with self.assertLogs('quartet_4nt4r3s.warmup', 'WARNING'):
+            self.assertEqual(warmup.warm_up(['unknown']), {})
+        transport.close_sessions()
+
+    def test_warm_up_after_start(self):
+        from celery.signals import worker_process_init
+        from django.core.signals import request_started
+        with override_settings(ANTARES_WARM_UP=True), \
+                mock.patch.object(warmup, 'warm_up') as warm_up:
+            warmup.install()
+            try:
+                warm_up.assert_called_once_with(['imports', 'templates'])
+                # as in a newly forked worker
+                warmup._after_fork()
+                for i in range(2):
+                    self.client.get(reverse('antares-epcis-report'))
+                worker_process_init.send(sender=None)
+                self.assertEqual(warm_up.call_count, 2)
+                warm_up.assert_called_with(
+                    ['lxml', 'serialbox', 'pools', 'rules'])
+            finally:
+                request_started.disconnect(dispatch_uid=warmup.DISPATCH_UID)
+                worker_process_init.disconnect(
+                    dispatch_uid=warmup.DISPATCH_UID)
+
+    def test_capture_and_replay(self):
+        self._create_rule()
+        Pool.objects.create(readable_name='Unit Test Pool',
+                            machine_name='10342195308095')
+        capture_dir = tempfile.mkdtemp()
+        with StandInServer() as server:
+            with override_settings(
+                MIDDLEWARE=['quartet_4nt4r3s.capture.CaptureMiddleware'],
+                ANTARES_CAPTURE_DIR=capture_dir,
+                ANTARES_SERIALBOX_SCHEME='http',
+                ANTARES_SERIALBOX_HOST=server.host,
+                ANTARES_SERIALBOX_PORT=server.port):
+                response = self.client.post(
+                    '{0}?rule=epcis&run-immediately=true'.format(
+                        reverse('antares-epcis-report')),
+                    data=self._get_test_data(), content_type='text')
+                self.assertEqual(response.status_code, 200)
+                response = self.client.post(
+                    '{0}?pass-through=true'.format(
+                        reverse('antares-number-request')),
+                    data=self._get_test_data(
+                        'data/antares-number-request.xml'),
+                    content_type='text')
+                size = len(b''.join(response.streaming_content))
+        files = [os.path.join(capture_dir, f)
+                 for f in os.listdir(capture_dir)]
+        records = capture.load_records(files)
+        self.assertEqual([r['url_name'] for r in records],
+                         ['antares-epcis-report', 'antares-number-request'])
+        for record in records:
+            self.assertEqual(record['status'], 200)
+            self.assertNotIn('unittest', record['body'])
+            self.assertNotIn('testuser', record['body'])
+            self.assertEqual(record['body'].count(capture.REDACTED), 2)
+        self.assertEqual(records[1]['response_size'], size)
+        self.assertIn('pass-through=true', records[1]['path'])
+        # the bodies of other requests are left to their views
+        with override_settings(
+            MIDDLEWARE=['quartet_4nt4r3s.capture.CaptureMiddleware'],
+            ANTARES_CAPTURE_DIR=capture_dir,
+            DATA_UPLOAD_MAX_MEMORY_SIZE=10):
+            response = self.client.post('/not-antares/', data='x' * 100,
+                                        content_type='text')
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(capture.load_records(files)), 2)
+
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append((self.path, self.rfile.read(
+                    int(self.headers['Content-Length']))))
+                status = 500 if 'IMessaging' in self.path else 200
+                self.send_response(status)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, format, *args):
+                pass
+
+        target = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=target.serve_forever, daemon=True).start()
+        output = StringIO()
+        try:
+            call_command('antares_replay', capture_dir, speed=0,
+                         url='http://127.0.0.1:%s/' % target.server_port,
+                         username='replayuser', password='secret',
+                         stdout=output, stderr=StringIO())
+        finally:
+            target.shutdown()
+            target.server_close()
+        # with speed 0 both are sent at once, in either order
+        self.assertCountEqual([path for path, _ in received],
+                              [r['path'] for r in records])
+        for _, body in received:
+            self.assertIn(b'<wsse:Username>replayuser</wsse:Username>', body)
+            self.assertNotIn(capture.REDACTED.encode(), body)
+        summary = output.getvalue()
+        self.assertIn('2 requests', summary)
+        self.assertRegex(summary, r'antares-epcis-report +1 +1 ')
+        self.assertRegex(summary, r'antares-number-request +1 +0 ')
+        for file_name in files:
+            os.remove(file_name)
+        os.rmdir(capture_dir)
+
+    def test_lazy_imports(self):
+        # a fresh interpreter, this one has loaded everything already
+        script = (
+            'import sys, django; django.setup(); '
+            'import quartet_4nt4r3s.views, quartet_4nt4r3s.steps; '
+            'print(" ".join(sys.modules))'
+        )
+        root = os.path.join(os.path.dirname(__file__), '..')
+        loaded = subprocess.check_output(
+            [sys.executable, '-c', script], cwd=root,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='tests.settings'),
+            universal_newlines=True).split()
+        for module in ['celery', 'paramiko', 'quartet_capture.tasks',
+                       'quartet_output.steps', 'quartet_templates.steps',
+                       'quartet_4nt4r3s.output_steps',
+                       'quartet_epcis.parsing.steps', 'gs123.steps',
+                       'gs123.conversion', 'quartet_4nt4r3s.parser',
+                       'quartet_4nt4r3s.parsing_steps',
+                       'quartet_4nt4r3s.conversion_steps']:
+            self.assertNotIn(module, loaded)
+        from quartet_4nt4r3s import steps, output_steps, parsing_steps, \
+            conversion_steps
+        self.assertIs(steps.TraceLinkExportStep,
+                      output_steps.TraceLinkExportStep)
+        self.assertIs(steps.EPCISParsingStep, parsing_steps.EPCISParsingStep)
+        self.assertIs(steps.AntaresBarcodeConversionStep,
+                      conversion_steps.AntaresBarcodeConversionStep)
+
+    def _get_test_data(self, file_name='data/antares-lot-batch.xml'):
         '''
         Loads the XML file and passes its data back as a string.
         '''
         curpath = os.path.dirname(__file__)
-        data_path = os.path.join(curpath, 'data/antares-lot-batch.xml')
+        data_path = os.path.join(curpath, file_name)
         with open(data_path) as data_file:
             return data_file.read()
 